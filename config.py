@@ -29,6 +29,63 @@ class Config(object):
     RQ_REDIS_URL = os.environ.get('REDIS_SERVER', 'redis://localhost:6379') + '/0'
     RQ_QUEUES = ['default']
     SSE_REDIS_URL = os.environ.get('REDIS_SERVER', 'redis://localhost:6379') + '/1'
+    # worker processes used to break trips in parallel during trips exports
+    EXPORT_PROCESSES = int(os.environ.get('IT_EXPORT_PROCESSES', 1))
+    # threads used to write the raw export sheets concurrently (1 writes them in turn)
+    EXPORT_SHEET_THREADS = int(os.environ.get('IT_EXPORT_SHEET_THREADS', 4))
+    # rows fetched per round-trip when streaming coordinates to the tripbreaker
+    COORDINATES_FETCH_SIZE = int(os.environ.get('IT_COORDINATES_FETCH_SIZE', 10000))
+    # rows fetched per round-trip when streaming survey responses into an export
+    EXPORT_FETCH_SIZE = int(os.environ.get('IT_EXPORT_FETCH_SIZE', 1000))
+    # scratch directory for export sheets before they are zipped (system default if unset)
+    EXPORT_TEMP_FOLDER = os.environ.get('IT_EXPORT_TEMP_FOLDER')
+    # export progress events are published at most every this many rows or seconds
+    EXPORT_PROGRESS_ROWS = int(os.environ.get('IT_EXPORT_PROGRESS_ROWS', 10000))
+    EXPORT_PROGRESS_SECONDS = float(os.environ.get('IT_EXPORT_PROGRESS_SECONDS', 5))
+    # finished export archives are reused for repeat requests of unchanged data until
+    # unused for the maximum age or evicted to keep the cache within its size (0 disables)
+    EXPORT_CACHE_MAX_AGE_HOURS = float(os.environ.get('IT_EXPORT_CACHE_MAX_AGE_HOURS', 72))
+    EXPORT_CACHE_MAX_MB = int(os.environ.get('IT_EXPORT_CACHE_MAX_MB', 5000))
+    # rows per row group and the column compression codec of Parquet export sheets
+    EXPORT_PARQUET_ROW_GROUP_ROWS = int(os.environ.get('IT_EXPORT_PARQUET_ROW_GROUP_ROWS', 100000))
+    EXPORT_PARQUET_COMPRESSION = os.environ.get('IT_EXPORT_PARQUET_COMPRESSION', 'snappy')
+    # raw export sheets are written in chunks of this many days (0 writes the window as one
+    # chunk); chunks are kept to retry failed exports and may be written by extra RQ workers
+    EXPORT_CHUNK_DAYS = int(os.environ.get('IT_EXPORT_CHUNK_DAYS', 7))
+    EXPORT_CHUNK_WORKERS = int(os.environ.get('IT_EXPORT_CHUNK_WORKERS', 0))
+    EXPORT_CHUNK_RETRIES = int(os.environ.get('IT_EXPORT_CHUNK_RETRIES', 2))
+    # a chunk claimed by a worker is written again if unfinished after this many seconds
+    EXPORT_CHUNK_LOCK_SECONDS = int(os.environ.get('IT_EXPORT_CHUNK_LOCK_SECONDS', 3600))
+    EXPORT_CHUNK_POLL_SECONDS = float(os.environ.get('IT_EXPORT_CHUNK_POLL_SECONDS', 2))
+    # export archive compression: 'deflate', 'store' (no compression) or 'parallel' deflate
+    # of blocks across threads, at the given zlib level (1 fastest to 9 smallest)
+    EXPORT_ZIP_COMPRESSION = os.environ.get('IT_EXPORT_ZIP_COMPRESSION', 'deflate')
+    EXPORT_ZIP_LEVEL = int(os.environ.get('IT_EXPORT_ZIP_LEVEL', 6))
+    EXPORT_ZIP_THREADS = int(os.environ.get('IT_EXPORT_ZIP_THREADS', 4))
+    # mapper points are simplified to hide detail smaller than this many pixels at the
+    # requested zoom; pyramids are ranked down to the minimum tolerance in meters and
+    # the most recent are kept per API process (0 disables)
+    MAPPER_SIMPLIFY_PIXELS = float(os.environ.get('IT_MAPPER_SIMPLIFY_PIXELS', 1))
+    MAPPER_SIMPLIFY_MIN_METERS = float(os.environ.get('IT_MAPPER_SIMPLIFY_MIN_METERS', 1))
+    MAPPER_PYRAMID_CACHE_SIZE = int(os.environ.get('IT_MAPPER_PYRAMID_CACHE_SIZE', 64))
+    # decimal places of the coordinates in polyline-encoded mapper responses
+    MAPPER_POLYLINE_PRECISION = int(os.environ.get('IT_MAPPER_POLYLINE_PRECISION', 5))
+    # mapper responses are cached per user and window in a local LRU of this many entries
+    # and in Redis (empty to disable), expiring after the given number of seconds
+    MAPPER_CACHE_SIZE = int(os.environ.get('IT_MAPPER_CACHE_SIZE', 256))
+    MAPPER_CACHE_REDIS_URL = os.environ.get('IT_MAPPER_CACHE_REDIS_URL',
+                                            os.environ.get('REDIS_SERVER', 'redis://localhost:6379') + '/2')
+    MAPPER_CACHE_TTL_SECONDS = int(os.environ.get('IT_MAPPER_CACHE_TTL_SECONDS', 86400))
+    # survey coordinate density tiles count points in a grid of this many bins per tile
+    # side and are cached on disk per time window (system temp directory if unset),
+    # checked for newer coordinates at most every this many seconds
+    MAPPER_TILES_FOLDER = os.environ.get('IT_MAPPER_TILES_FOLDER')
+    MAPPER_TILE_GRID = int(os.environ.get('IT_MAPPER_TILE_GRID', 256))
+    MAPPER_TILE_MAX_ZOOM = int(os.environ.get('IT_MAPPER_TILE_MAX_ZOOM', 18))
+    MAPPER_TILE_CHECK_SECONDS = float(os.environ.get('IT_MAPPER_TILE_CHECK_SECONDS', 30))
+    MAPPER_TILE_CACHE_MAX_AGE_HOURS = float(os.environ.get('IT_MAPPER_TILE_CACHE_MAX_AGE_HOURS', 72))
+    # persist detected trips per user and only process coordinates recorded since the last run
+    TRIPBREAKER_INCREMENTAL = os.environ.get('IT_TRIPBREAKER_INCREMENTAL', '').lower() in ('1', 'true', 'yes')
 
 
 # Dashboard API config ========================================================
@@ -59,6 +116,7 @@ class DashboardTestingConfig(DashboardConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('IT_POSTGRES_URI', DEFAULT_TEST_DB)
     ASSETS_FOLDER = '/assets'    
+    MAPPER_CACHE_REDIS_URL = None
 
 
 class DashboardProductionConfig(DashboardConfig):
@@ -7,48 +7,126 @@ import codecs
 from datetime import datetime
 from decimal import Decimal
 from flask import current_app
-import io
+import functools
+import hashlib
+import json
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import operator
 import os
 import postgres_copy
+import pyarrow as pa
 import pytz
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+import tempfile
+import time
 import unicodecsv as csv
 
 import config
-from models import db, CancelledPromptResponse, MobileUser, MobileCoordinate, PromptResponse
+from models import (db, CancelledPromptResponse, MobileUser, MobileCoordinate, PromptResponse,
+                    SubwayStop, Survey, SurveyQuestion, SurveyResponse)
+from utils import columnar
+from utils.export_chunks import ChunkStore, chunk_windows, concatenate_csv
+from utils.filehandler import is_cached_zip, open_compressed_export_file, open_export_file
+from utils.progress import ExportProgress
+from utils.timestamps import epoch_timestamp, naive_utc, utc_timestamp
 from utils.tripbreaker import algorithm as tripbreaker
 
 from .mobile_user import MobileUserActions
 from .survey import SurveyActions
+from .trips import TripsActions
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(config.DashboardConfig.APP_NAME)
 
 
-def _utc_timestamp(timestamp):
-    return timestamp.replace(microsecond=0).astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S')
+# SQL equivalents of `utils.timestamps` formatting for sheets written with COPY
+def _sql_utc_timestamp(column):
+    return db.func.to_char(db.func.timezone('UTC', column), 'YYYY-MM-DD HH24:MI:SS')
+
+
+def _sql_epoch_timestamp(column):
+    return db.cast(db.func.trunc(db.func.extract('epoch', column)), db.BigInteger)
+
+
+def _sql_boolean(column):
+    return db.case([(column.is_(True), 'True'), (column.is_(False), 'False')])
+
+
+# the characters removed by Python's `unicode.strip`, as an escaped PostgreSQL string
+_SQL_WHITESPACE = "E'{}'".format(''.join('\\u{:04x}'.format(ord(c)) for c in
+                                         u'\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u180e'
+                                         u'\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007'
+                                         u'\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000'))
+
+
+def _sql_response(column):
+    # write JSONB responses as the per-row exporter wrote the decoded values: arrays are
+    # joined as stripped "; " separated text in their original order, strings are
+    # unquoted, booleans are capitalized and nulls are empty; numbers are written as
+    # their JSON text, which differs from Python's formatting only for non-integers such
+    # as `1.50` or `1e3`, and objects as JSON text rather than a Python dict
+    sql = ("CASE jsonb_typeof({col}) "
+           "WHEN 'array' THEN coalesce((SELECT string_agg(btrim(value, {whitespace}), '; ' "
+           "ORDER BY ordinality) "
+           "FROM jsonb_array_elements_text({col}) WITH ORDINALITY), '') "
+           "WHEN 'string' THEN {col} #>> '{{}}' "
+           "WHEN 'boolean' THEN initcap({col}::text) "
+           "WHEN 'null' THEN NULL "
+           "ELSE {col}::text END")
+    return db.literal_column(sql.format(col='{}.{}'.format(column.table.name, column.name),
+                                        whitespace=_SQL_WHITESPACE))
+
+
+# filter a column by a list of ids bound as one array parameter (`= ANY(:ids)`) rather
+# than a parameter for each id
+def _any_id(column, ids):
+    return column == db.any_(db.bindparam('ids', ids, type_=ARRAY(db.Integer), unique=True))
+
+
+# return a table's export columns as labeled SQL expressions; timestamps are expanded
+# to `_UTC` and `_epoch` columns
+def _copy_columns(table, ignored_columns):
+    columns = []
+    for c in table.__table__.columns:
+        if c.name in ignored_columns:
+            continue
+        if c.type.python_type == datetime:
+            columns.append(_sql_utc_timestamp(c).label(c.name + '_UTC'))
+            columns.append(_sql_epoch_timestamp(c).label(c.name + '_epoch'))
+        elif c.type.python_type == bool:
+            columns.append(_sql_boolean(c).label(c.name))
+        elif isinstance(c.type, JSONB):
+            columns.append(_sql_response(c).label(c.name))
+        else:
+            columns.append(c.label(c.name))
+    return columns
+
+
+# write a query's results to a sheet with COPY, counting the rows written as progress
+def _copy_to(query, sheet_f, progress=None):
+    dest = progress.writer(header=True) if progress else sheet_f
+    postgres_copy.copy_to(query, dest, db.engine, format='csv', header=True)
 
-def _epoch_timestamp(timestamp):
-    epoch = datetime(1970, 1, 1, tzinfo=pytz.utc)
-    timestamp_epoch = int((timestamp.astimezone(pytz.utc) - epoch).total_seconds())
-    return timestamp_epoch
 
 class ExportFormatters:
     @staticmethod
-    def survey_responses_csv(survey, active_users, tz):
-        # initialize output .csv file in memory with column headers
-        responses_csv = io.BytesIO()
+    def survey_responses_csv(responses_csv, survey, active_user_ids, tz, progress=None):
+        # write the output .csv file column headers
         responses_csv.write(codecs.BOM_UTF8)
         writer = csv.writer(responses_csv)
 
         location_column_types = [4, 105, 106, 107]
         location_columns = {}
         ignored_columns = ['survey_id']
+        user_columns = []
         install_columns = []
         for c in MobileUser.__table__.columns:
             if c.name in ignored_columns:
                 continue
+            user_columns.append(c)
             if c.type.python_type == datetime:
                 install_columns.append(c.name + '_UTC')
                 install_columns.append(c.name + '_epoch')
@@ -66,43 +144,27 @@ class ExportFormatters:
                 json_columns.append(q.question_label)
         headers = install_columns + json_columns
         writer.writerow(headers)
-        
-        # generate each .csv row from survey's active users and write to memory file
-        for user in active_users:
-            user.created_at_UTC = _utc_timestamp(user.created_at)
-            user.created_at_epoch = _epoch_timestamp(user.created_at)
-            user.modified_at_UTC = _utc_timestamp(user.modified_at)
-            user.modified_at_epoch = _epoch_timestamp(user.modified_at)
-            device_row = [getattr(user, col) for col in install_columns]
-            survey_response = user.survey_response.one_or_none()
-
-            json_row = []
-            if survey_response:
-                for col in json_columns:
-                    if col in location_columns:
-                        location_col = location_columns[col]
-                        location = survey_response.response.get(location_col)
-                        if location:
-                            if col.endswith('_lat'):
-                                json_row.append(location['latitude'])
-                            elif col.endswith('_lon'):
-                                json_row.append(location['longitude'])
-                        else:
-                            json_row.append('')    
-                    elif col in survey_response.response:
-                        response = survey_response.response[col]
-                        if isinstance(response, list):
-                            response = '; '.join(response)
-                        json_row.append(response)
-                    else:
-                        json_row.append('')
-
-            csv_row = device_row + json_row
-            writer.writerow(csv_row)
+
+        # fetch the survey's active users joined with their survey responses in a single
+        # streamed query and write each .csv row with the precompiled row builder
+        query = (db.select(user_columns + [SurveyResponse.response])
+                   .select_from(MobileUser.__table__.outerjoin(SurveyResponse.__table__))
+                   .where(_any_id(MobileUser.id, active_user_ids))
+                   .order_by(MobileUser.id)
+                   .execution_options(stream_results=True))
+        build_row = _survey_response_row_builder(user_columns, json_columns, location_columns)
+        rows = _streamed_rows(query, current_app.config['EXPORT_FETCH_SIZE'])
+        if progress:
+            for row in rows:
+                writer.writerow(build_row(row))
+                progress.add_rows(users=1)
+        else:
+            for row in rows:
+                writer.writerow(build_row(row))
         return responses_csv
 
     @staticmethod
-    def coordinates_csv(survey, active_users, start, end):
+    def coordinates_csv(coordinates_csv, survey, start, end, progress=None):
         def _tz_formatters(table, cols):
             formatters = []
             for col_name in cols:
@@ -113,13 +175,11 @@ class ExportFormatters:
                 formatters.append(timestamp_epoch)
             return formatters
 
-        coordinates_csv = io.BytesIO()
         coordinates_csv.write(codecs.BOM_UTF8)
-        active_mobile_ids = [u.id for u in active_users]
         formatters = _tz_formatters(MobileCoordinate, ['timestamp'])
         coordinates = (db.session.query(MobileUser, MobileCoordinate, *formatters)
                        .join(MobileCoordinate)
-                       .filter(db.and_(MobileCoordinate.mobile_id.in_(active_mobile_ids),
+                       .filter(db.and_(MobileCoordinate.survey_id == survey.id,
                                        MobileCoordinate.timestamp >= start,
                                        MobileCoordinate.timestamp <= end))
                        .options(db.Load(MobileUser).defer('id')
@@ -128,153 +188,481 @@ class ExportFormatters:
                                                          .defer('survey_id')
                                                          .defer('timestamp'))
                        .order_by(MobileCoordinate.id))
-        postgres_copy.copy_to(coordinates, coordinates_csv, db.engine,
-                              format='csv', header=True)
+        _copy_to(coordinates, coordinates_csv, progress)
         return coordinates_csv
 
     @staticmethod
-    def prompts_csv(survey, active_users, start, end):
-        prompts_csv = io.BytesIO()
+    def prompts_csv(prompts_csv, survey, active_user_ids, start, end, progress=None):
         prompts_csv.write(codecs.BOM_UTF8)
-        active_mobile_ids = [u.id for u in active_users]
-        prompts = (db.session.query(MobileUser, PromptResponse)
-                             .join(PromptResponse)
-                             .filter(db.and_(PromptResponse.mobile_id.in_(active_mobile_ids)),
-                                             PromptResponse.displayed_at >= start,
-                                             PromptResponse.displayed_at <= end)
-                             .order_by(PromptResponse.id))
         ignored_columns = ['survey_id', 'mobile_id']
-        columns = []
-        for c in PromptResponse.__table__.columns:
-            if c.name in ignored_columns:
-                continue
-            if c.type.python_type == datetime:
-                columns.append(c.name + '_UTC')
-                columns.append(c.name + '_epoch')
-            else:
-                columns.append(c.name)
-
-        # create csv file in memory with list responses expanded to string
-        csv_writer = csv.writer(prompts_csv)
-        headers = list(columns)
-        headers.insert(1, 'uuid')
-        csv_writer.writerow(headers)
-
-        for user, prompt in prompts:
-            prompt.displayed_at_UTC = _utc_timestamp(prompt.displayed_at)
-            prompt.displayed_at_epoch = _epoch_timestamp(prompt.displayed_at)
-            prompt.recorded_at_UTC = _utc_timestamp(prompt.recorded_at)
-            prompt.recorded_at_epoch = _epoch_timestamp(prompt.recorded_at)
-            prompt.edited_at_UTC = _utc_timestamp(prompt.edited_at)
-            prompt.edited_at_epoch = _epoch_timestamp(prompt.edited_at)
-            prompt_row = []
-            for col in columns:
-                # make uuid second column value
-                if len(prompt_row) == 1:
-                    prompt_row.append(user.uuid)
-
-                value = getattr(prompt, col)
-                if isinstance(value, list):
-                    value = '; '.join([v.strip() for v in value])
-                prompt_row.append(value)
-            csv_writer.writerow(prompt_row)
+        columns = _copy_columns(PromptResponse, ignored_columns)
+        columns.insert(1, MobileUser.uuid)
+
+        # format timestamps and expand list responses to strings within the COPY query
+        prompts = _prompts_query(PromptResponse, columns, survey, active_user_ids, start, end)
+        _copy_to(prompts, prompts_csv, progress)
         return prompts_csv
 
     @staticmethod
-    def cancelled_prompts_csv(survey, active_users, start, end):
-        cancelled_prompts_csv = io.BytesIO()
+    def cancelled_prompts_csv(cancelled_prompts_csv, survey, active_user_ids, start, end,
+                              progress=None):
         cancelled_prompts_csv.write(codecs.BOM_UTF8)
-        active_mobile_ids = [u.id for u in active_users]
-        cancelled_prompts = (db.session.query(MobileUser, CancelledPromptResponse)
-                                       .join(CancelledPromptResponse)
-                                       .filter(db.and_(CancelledPromptResponse.mobile_id.in_(active_mobile_ids)),
-                                                       CancelledPromptResponse.displayed_at >= start,
-                                                       CancelledPromptResponse.displayed_at <= end)
-                                       .order_by(CancelledPromptResponse.id))
-
         ignored_columns = ['survey_id', 'mobile_id']
-        columns = []
-        for c in CancelledPromptResponse.__table__.columns:
-            if c.name in ignored_columns:
-                continue
-            if c.type.python_type == datetime:
-                columns.append(c.name + '_UTC')
-                columns.append(c.name + '_epoch')
-            else:
-                columns.append(c.name)
-
-        # create csv file in memory with list responses expanded to string
-        csv_writer = csv.writer(cancelled_prompts_csv)
-        headers = list(columns)
-        headers.insert(1, 'uuid')
-        csv_writer.writerow(headers)
-
-        for user, cancelled in cancelled_prompts:
-            cancelled.displayed_at_UTC = _utc_timestamp(cancelled.displayed_at)
-            cancelled.displayed_at_epoch = _epoch_timestamp(cancelled.displayed_at)
-            if cancelled.cancelled_at:
-                cancelled.cancelled_at_UTC = _utc_timestamp(cancelled.cancelled_at)
-                cancelled.cancelled_at_epoch = _epoch_timestamp(cancelled.cancelled_at)
-            else:
-                cancelled.cancelled_at_UTC = None
-                cancelled.cancelled_at_epoch = None
-            cancelled_row = []
-            for col in columns:
-                # make uuid second column value
-                if len(cancelled_row) == 1:
-                    cancelled_row.append(user.uuid)
-                cancelled_row.append(getattr(cancelled, col))
-            csv_writer.writerow(cancelled_row)
+        columns = _copy_columns(CancelledPromptResponse, ignored_columns)
+        columns.insert(1, MobileUser.uuid)
+
+        cancelled_prompts = _prompts_query(CancelledPromptResponse, columns, survey,
+                                           active_user_ids, start, end)
+        _copy_to(cancelled_prompts, cancelled_prompts_csv, progress)
         return cancelled_prompts_csv
 
     @staticmethod
-    def trips_csv(survey, active_users, start, end):
-        def _process_trip_points(uuid, points, headers):
-            rows = []
-            for pt in points:
-                pt_row = [uuid]
-                for h in headers:
-                    if h == 'uuid':
-                        continue
-
-                    value = pt.get(h)
-                    if h == 'timestamp_UTC':
-                        value = _utc_timestamp(pt['timestamp'])
-                    elif h == 'timestamp_epoch':
-                        value = _epoch_timestamp(pt['timestamp'])
-                    elif isinstance(value, Decimal):
-                        value = float(value)
-                    pt_row.append(value)
-                rows.append(pt_row)
-            return rows
-
-        parameters = {
-            'break_interval_seconds': survey.trip_break_interval,
-            'subway_buffer_meters': survey.trip_subway_buffer,
-            'cold_start_distance_meters': survey.trip_break_cold_start_distance,
-            'accuracy_cutoff_meters': survey.gps_accuracy_threshold
-        }
-        trips_csv = io.BytesIO()
+    def trips_csv(trips_csv, survey, active_users, parameters, stations, start, end, processes=1,
+                  incremental=False, progress=None):
         trips_csv.write(codecs.BOM_UTF8)
         writer = csv.writer(trips_csv)
         headers = ['uuid', 'trip', 'latitude', 'longitude', 'h_accuracy', 'timestamp_UTC',
                    'timestamp_epoch', 'trip_distance', 'distance', 'break_period', 'trip_code']
 
         writer.writerow(headers)
-        for user in active_users:
-            user_coordinates = (user.mobile_coordinates
-                                          .filter(db.and_(MobileCoordinate.timestamp >= start,
-                                                          MobileCoordinate.timestamp <= end)))
-
-            trips, segments = tripbreaker.run(parameters,
-                                              survey.subway_stops,
-                                              user_coordinates)
-
-            for trip_id, points in trips.iteritems():
-                point_rows = _process_trip_points(user.uuid, points, headers)
-                writer.writerows(point_rows)
+        for rows in _all_user_trip_rows(active_users, parameters, stations, start, end, headers,
+                                        processes, incremental):
+            writer.writerows(rows)
+            if progress:
+                progress.add_rows(len(rows), users=1)
         return trips_csv
 
+    @staticmethod
+    def coordinates_parquet(coordinates_parquet, survey, start, end, progress=None):
+        columns, fields = _arrow_columns(MobileCoordinate, ['survey_id', 'mobile_id'])
+        columns.insert(1, MobileUser.uuid)
+        fields.insert(1, columnar.arrow_field(MobileUser.uuid))
+        coordinates = (db.session.query(*columns)
+                                 .select_from(MobileUser)
+                                 .join(MobileCoordinate)
+                                 .filter(db.and_(MobileCoordinate.survey_id == survey.id,
+                                                 MobileCoordinate.timestamp >= start,
+                                                 MobileCoordinate.timestamp <= end))
+                                 .order_by(MobileCoordinate.id))
+        return _write_parquet(coordinates, coordinates_parquet, fields, progress)
+
+    @staticmethod
+    def prompts_parquet(prompts_parquet, survey, active_user_ids, start, end, progress=None):
+        columns, fields = _arrow_columns(PromptResponse, ['survey_id', 'mobile_id'])
+        columns.insert(1, MobileUser.uuid)
+        fields.insert(1, columnar.arrow_field(MobileUser.uuid))
+        prompts = _prompts_query(PromptResponse, columns, survey, active_user_ids, start, end)
+        return _write_parquet(prompts, prompts_parquet, fields, progress)
+
+    @staticmethod
+    def cancelled_prompts_parquet(cancelled_prompts_parquet, survey, active_user_ids, start, end,
+                                  progress=None):
+        columns, fields = _arrow_columns(CancelledPromptResponse, ['survey_id', 'mobile_id'])
+        columns.insert(1, MobileUser.uuid)
+        fields.insert(1, columnar.arrow_field(MobileUser.uuid))
+        cancelled_prompts = _prompts_query(CancelledPromptResponse, columns, survey,
+                                           active_user_ids, start, end)
+        return _write_parquet(cancelled_prompts, cancelled_prompts_parquet, fields, progress)
+
+    @staticmethod
+    def trips_parquet(trips_parquet, survey, active_users, parameters, stations, start, end,
+                      processes=1, incremental=False, progress=None):
+        fields = TRIPS_PARQUET_FIELDS
+        headers = [f.name for f in fields]
+
+        def _batches():
+            for rows in _all_user_trip_rows(active_users, parameters, stations, start, end,
+                                            headers, processes, incremental):
+                if progress:
+                    progress.add_rows(len(rows), users=1)
+                yield rows
+        return columnar.write_parquet(trips_parquet, fields, _batches(),
+                                      current_app.config['EXPORT_PARQUET_ROW_GROUP_ROWS'],
+                                      compression=current_app.config['EXPORT_PARQUET_COMPRESSION'])
+
+
+# return a query of prompt responses, or cancelled prompts, from the given active users
+# displayed within a time range
+def _prompts_query(table, columns, survey, active_user_ids, start, end):
+    return (db.session.query(*columns)
+                      .select_from(MobileUser)
+                      .join(table)
+                      .filter(db.and_(table.survey_id == survey.id,
+                                      _any_id(table.mobile_id, active_user_ids)),
+                              table.displayed_at >= start,
+                              table.displayed_at <= end)
+                      .order_by(table.id))
+
+
+# Columnar export helpers ======================================================
+EXPORT_FORMATS = ('csv', 'parquet')
+# Parquet sheets keep the database column types; each timestamp is a single UTC
+# column rather than the `_UTC` and `_epoch` text columns of the .csv sheets
+TRIPS_PARQUET_FIELDS = [
+    pa.field('uuid', pa.string()),
+    pa.field('trip', pa.int32()),
+    pa.field('latitude', pa.float64()),
+    pa.field('longitude', pa.float64()),
+    pa.field('h_accuracy', pa.float64()),
+    pa.field('timestamp', pa.timestamp('us', tz='UTC')),
+    pa.field('trip_distance', pa.float64()),
+    pa.field('distance', pa.float64()),
+    pa.field('break_period', pa.int64()),
+    pa.field('trip_code', pa.int32())
+]
+
+
+# return a table's columns for a Parquet sheet with their Arrow fields
+def _arrow_columns(table, ignored_columns):
+    columns = []
+    fields = []
+    for c in table.__table__.columns:
+        if c.name in ignored_columns:
+            continue
+        if c.type.python_type == datetime:
+            columns.append(db.func.timezone('UTC', c).label(c.name))
+        elif isinstance(c.type, JSONB):
+            columns.append(_sql_response(c).label(c.name))
+        else:
+            columns.append(c.label(c.name))
+        fields.append(columnar.arrow_field(c))
+    return columns, fields
+
+
+def _write_parquet(query, sheet_f, fields, progress=None):
+    row_group_rows = current_app.config['EXPORT_PARQUET_ROW_GROUP_ROWS']
+    statement = query.statement.execution_options(stream_results=True)
+
+    def _batches():
+        for rows in _streamed_batches(statement, row_group_rows):
+            if progress:
+                progress.add_rows(len(rows))
+            yield rows
+    return columnar.write_parquet(sheet_f, fields, _batches(), row_group_rows,
+                                  compression=current_app.config['EXPORT_PARQUET_COMPRESSION'])
+
+
+# Survey responses export helpers ==============================================
+def _streamed_batches(query, fetch_size):
+    result = db.session.execute(query)
+    try:
+        while True:
+            rows = result.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        result.close()
+
+
+def _streamed_rows(query, fetch_size):
+    for rows in _streamed_batches(query, fetch_size):
+        for row in rows:
+            yield row
+
+
+def _location_value(question, key, response):
+    location = response.get(question)
+    if location:
+        return location[key]
+    return ''
+
+
+def _response_value(column, response):
+    if column in response:
+        value = response[column]
+        if isinstance(value, list):
+            value = '; '.join(value)
+        return value
+    return ''
+
+
+def _survey_response_row_builder(user_columns, json_columns, location_columns):
+    '''Precompile the lookup of each survey responses sheet column from a row of
+       `user_columns` followed by the user's response JSON; users without a survey
+       response only have their installation columns written'''
+    user_getters = []
+    for idx, column in enumerate(user_columns):
+        if column.type.python_type == datetime:
+            user_getters.append(lambda row, idx=idx: utc_timestamp(row[idx]))
+            user_getters.append(lambda row, idx=idx: epoch_timestamp(row[idx]))
+        else:
+            user_getters.append(operator.itemgetter(idx))
+
+    response_getters = []
+    for column in json_columns:
+        if column in location_columns:
+            key = 'latitude' if column.endswith('_lat') else 'longitude'
+            response_getters.append(functools.partial(_location_value, location_columns[column], key))
+        else:
+            response_getters.append(functools.partial(_response_value, column))
+
+    response_idx = len(user_columns)
+
+    def build_row(row):
+        csv_row = [getter(row) for getter in user_getters]
+        response = row[response_idx]
+        if response is not None:
+            csv_row.extend([getter(response) for getter in response_getters])
+        return csv_row
+    return build_row
+
+
+# Trips export helpers =========================================================
+# the trip breaking for each participant is independent of all others, so users
+# can be fanned out to a pool of forked worker processes that each open their own
+# database connections; results are returned in user order
+_trips_worker_state = {}
+
+
+_TRIP_POINT_TIMESTAMPS = {
+    'timestamp_UTC': utc_timestamp,
+    'timestamp_epoch': epoch_timestamp,
+    'timestamp': naive_utc
+}
+
+
+def _trip_point_value(h, pt):
+    value = getattr(pt, h, None)
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _trip_point_getter(h):
+    if h in _TRIP_POINT_TIMESTAMPS:
+        formatter = _TRIP_POINT_TIMESTAMPS[h]
+        return lambda pt: formatter(pt.timestamp)
+    return functools.partial(_trip_point_value, h)
+
+
+def _trip_point_rows(uuid, points, headers):
+    getters = [_trip_point_getter(h) for h in headers if h != 'uuid']
+    rows = []
+    for pt in points:
+        pt_row = [uuid]
+        pt_row.extend([getter(pt) for getter in getters])
+        rows.append(pt_row)
+    return rows
+
+
+def _user_trip_rows(user, parameters, stations, start, end, headers, incremental=False):
+    user_id, uuid = user
+    if incremental:
+        trips_actions = TripsActions()
+        state = trips_actions.update(user_id, parameters, stations)
+        trips, segments = trips_actions.window(state, start, end)
+    else:
+        user_coordinates = MobileUserActions.tripbreaker_coordinates(user_id, start, end)
+        trips, segments = tripbreaker.run(parameters,
+                                          stations,
+                                          user_coordinates)
+    rows = []
+    if trips:
+        for trip_id, points in trips.iteritems():
+            rows.extend(_trip_point_rows(uuid, points, headers))
+    return rows
+
+
+def _init_trips_worker(parameters, stations, start, end, headers, incremental):
+    _trips_worker_state.update({
+        'parameters': parameters,
+        'stations': stations,
+        'start': start,
+        'end': end,
+        'headers': headers,
+        'incremental': incremental
+    })
+
+
+def _trips_worker(user):
+    try:
+        return _user_trip_rows(user, **_trips_worker_state)
+    finally:
+        db.session.remove()
+
+
+def _all_user_trip_rows(active_users, parameters, stations, start, end, headers, processes,
+                        incremental):
+    users = [(user.id, user.uuid) for user in active_users]
+    if processes > 1:
+        return _parallel_user_trip_rows(users, processes, parameters, stations,
+                                        start, end, headers, incremental)
+    return (_user_trip_rows(user, parameters, stations, start, end, headers, incremental)
+            for user in users)
+
+
+def _parallel_user_trip_rows(users, processes, parameters, stations, start, end, headers, incremental):
+    # end the current transaction and close pooled connections so that no open
+    # database socket is shared with the forked workers
+    db.session.commit()
+    db.engine.dispose()
+
+    pool = multiprocessing.Pool(processes,
+                                initializer=_init_trips_worker,
+                                initargs=(parameters, stations, start, end, headers, incremental))
+    try:
+        for rows in pool.imap(_trips_worker, users):
+            yield rows
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+# Raw export helpers ===========================================================
+# the raw export sheets are independent queries that mostly wait on PostgreSQL, so
+# each is written by its own thread; the thread-local session and the COPY
+# statements each check out a separate connection from the engine's pool
+#
+# sheets are written as chunks of the export window that are kept in a `ChunkStore`,
+# so a retried export only writes the chunks that are missing or changed and each
+# chunk's transaction ends as soon as it is written; other RQ workers may write the
+# chunks of the same export (see `mobile_data_chunks`)
+def _write_chunk(store, ext, formatter, survey, key, args, progress=None):
+    chunk_f = store.open(key, ext)
+    try:
+        if progress:
+            progress.write_to(chunk_f)
+            formatter(chunk_f, survey, *args, progress=progress)
+            progress.write_to(None)
+        else:
+            formatter(chunk_f, survey, *args)
+        db.session.commit()
+    except:
+        if progress:
+            progress.write_to(None)
+        db.session.rollback()
+        store.release(chunk_f, key)
+        raise
+    return store.finish(chunk_f, key, ext)
+
+
+# return the paths of a sheet's finished chunks in order; chunks claimed by another
+# worker are waited for and failed chunks are retried
+def _export_chunks(store, ext, formatter, survey, chunks, progress=None):
+    config = current_app.config
+    paths = {}
+    failures = {}
+    while len(paths) < len(chunks):
+        claimed_elsewhere = False
+        for key, args in chunks:
+            if key in paths:
+                continue
+            path = store.find(key, ext)
+            if path:
+                paths[key] = path
+                continue
+            if not store.claim(key):
+                claimed_elsewhere = True
+                continue
+            try:
+                paths[key] = _write_chunk(store, ext, formatter, survey, key, args, progress)
+            except Exception:
+                failures[key] = failures.get(key, 0) + 1
+                if failures[key] > config['EXPORT_CHUNK_RETRIES']:
+                    raise
+                logger.exception('Export chunk {} failed, retrying'.format(key))
+        if claimed_elsewhere:
+            time.sleep(config['EXPORT_CHUNK_POLL_SECONDS'])
+    return [paths[key] for key, _ in chunks]
+
+
+def _write_sheet(store, filename, formatter, survey, chunks, progress=None, assemble=True):
+    ext = os.path.splitext(filename)[1]
+    sheet = progress.sheet(filename) if progress else None
+    paths = _export_chunks(store, ext, formatter, survey, chunks, sheet)
+    if sheet:
+        sheet.finish()
+    if not assemble:
+        return None
+
+    # .csv sheets are compressed for the archive as their chunks are joined in this
+    # sheet's thread, while other sheets are still being written
+    if ext == '.parquet':
+        if len(paths) == 1:
+            return open(paths[0], 'rb')
+        sheet_f = open_export_file(suffix=ext)
+    else:
+        sheet_f = open_compressed_export_file(suffix=ext)
+    try:
+        if ext == '.parquet':
+            columnar.concatenate_parquet(paths, sheet_f,
+                                         compression=current_app.config['EXPORT_PARQUET_COMPRESSION'])
+        else:
+            concatenate_csv(paths, sheet_f)
+    except:
+        sheet_f.close()
+        raise
+    return sheet_f
+
+
+def _sheet_worker(job):
+    app, survey_id, store, filename, formatter, chunks, progress, assemble = job
+    with app.app_context():
+        try:
+            # ORM instances cannot be shared between sessions, so each thread loads
+            # the survey within its own
+            survey = Survey.query.get(survey_id)
+            return filename, _write_sheet(store, filename, formatter, survey, chunks,
+                                          progress, assemble)
+        finally:
+            db.session.remove()
+
+
+# yields (filename, file) pairs in the order the sheets finish
+def _threaded_sheets(survey, sheets, threads, store, progress=None, assemble=True):
+    if threads < 2:
+        for filename, formatter, chunks in sheets:
+            yield filename, _write_sheet(store, filename, formatter, survey, chunks,
+                                         progress, assemble)
+        return
+
+    # end the current transaction so its connection is returned to the pool
+    # while the threads run
+    survey_id = survey.id
+    db.session.commit()
+
+    app = current_app._get_current_object()
+    jobs = [(app, survey_id, store, filename, formatter, chunks, progress, assemble)
+            for filename, formatter, chunks in sheets]
+    pool = ThreadPool(min(threads, len(jobs)))
+    try:
+        for sheet in pool.imap_unordered(_sheet_worker, jobs):
+            yield sheet
+    finally:
+        pool.close()
+        pool.join()
+
+
+# Export cache =================================================================
+# tables whose rows are written to each export type, with the timestamp column used
+# to select rows within the export's time range
+EXPORT_DATA_TABLES = {
+    'raw': [
+        (MobileUser, None),
+        (MobileCoordinate, 'timestamp'),
+        (SurveyQuestion, None),
+        (SurveyResponse, None),
+        (PromptResponse, 'displayed_at'),
+        (CancelledPromptResponse, 'displayed_at')
+    ],
+    'trips': [
+        (MobileCoordinate, 'timestamp'),
+        (SubwayStop, None)
+    ]
+}
+
+
+# tables written to the survey responses sheet, which has no time range of its own
+SURVEY_RESPONSES_TABLES = [
+    (MobileUser, None),
+    (SurveyQuestion, None),
+    (SurveyResponse, None)
+]
+
 
 class ExportActions:
     def __init__(self):
@@ -282,11 +670,14 @@ class ExportActions:
         self.formatters = ExportFormatters()
         self.survey = SurveyActions()
 
-    # remove the previous survey export from assets directory by filename
+    # remove the previous survey export from assets directory by filename; cached
+    # exports are instead left to be reused or evicted from the cache
     def cleanup_stale_data(self, export_type, export_info, basepath):
         if export_info.get(export_type) and export_info[export_type].get('uri'):
             # remove previous export if exists
             filename = export_info[export_type]['uri'].split('/')[-1]
+            if is_cached_zip(filename):
+                return
             existing_fp = os.path.join(
                 current_app.config['ASSETS_FOLDER'],
                 basepath, filename
@@ -294,6 +685,52 @@ class ExportActions:
             if os.path.exists(existing_fp):
                 os.remove(existing_fp)
 
+    # return the key of an export's cached archive, which changes with the requested
+    # window, timezone and survey settings and with any data added within the window,
+    # or None when export caching is disabled
+    def cache_key(self, export_type, survey, start, end, timezone, export_format='csv'):
+        if not current_app.config['EXPORT_CACHE_MAX_MB']:
+            return None
+        key = {
+            'survey_id': survey.id,
+            'export_type': export_type,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'timezone': timezone,
+            'format': export_format,
+            'watermark': self.survey.get_data_watermark(survey, start, end,
+                                                        EXPORT_DATA_TABLES[export_type])
+        }
+        if export_type == 'trips':
+            key['parameters'] = self.survey.get_tripbreaker_parameters(survey)
+            # incremental detection numbers and clips trips differently at the window edges
+            key['incremental'] = current_app.config['TRIPBREAKER_INCREMENTAL']
+        return hashlib.sha1(json.dumps(key, sort_keys=True)).hexdigest()[:16]
+
+    def _chunk_store(self):
+        folder = current_app.config['EXPORT_TEMP_FOLDER'] or tempfile.gettempdir()
+        return ChunkStore(os.path.join(folder, 'itinerum-export-chunks'),
+                          current_app.config['EXPORT_CHUNK_LOCK_SECONDS'])
+
+    # return the key a chunk of an export sheet is stored under, which changes with the
+    # data recorded within the chunk's time range and any other values it depends on
+    def _chunk_key(self, survey, filename, start, end, tables, *depends_on):
+        key = {
+            'survey_id': survey.id,
+            'sheet': filename,
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'watermark': self.survey.get_data_watermark(survey, start, end, tables),
+            'depends_on': depends_on
+        }
+        return hashlib.sha1(json.dumps(key, sort_keys=True)).hexdigest()
+
+    # remove export chunks by the same age and size limits as cached archives
+    def evict_chunks(self):
+        max_age = current_app.config['EXPORT_CACHE_MAX_AGE_HOURS'] * 3600.
+        max_bytes = current_app.config['EXPORT_CACHE_MAX_MB'] * 1024 * 1024
+        return self._chunk_store().evict(max_age, max_bytes)
+
     # update survey with export start, end, and requested datetimes
     def _begin(self, export_type, survey, basepath, start, end):
         export = survey.last_export
@@ -329,23 +766,85 @@ class ExportActions:
         db.session.commit()
         return export
 
-    def survey_data(self, survey, start, end, timezone):
+    # when given, `publish_progress` is called with throttled progress events as the
+    # sheets are written
+    def _progress(self, publish_progress, event_type, num_sheets, total_users):
+        if not publish_progress:
+            return None
+        return ExportProgress(publish_progress, event_type, num_sheets, total_users,
+                              every_rows=current_app.config['EXPORT_PROGRESS_ROWS'],
+                              every_seconds=current_app.config['EXPORT_PROGRESS_SECONDS'])
+
+    # the coordinates, prompts and trips sheets can be written as typed Parquet files
+    # instead of .csv with an `export_format` of 'parquet'; survey responses are
+    # always written as .csv
+    # with `assemble` False the sheets' chunks are only written, for other workers to
+    # assemble, and no files are returned
+    def survey_data(self, survey, start, end, timezone, publish_progress=None, export_format='csv',
+                    assemble=True):
         tz = pytz.timezone(timezone)
-        active_users = [u for u in self.survey.get_active_users(survey, start, end)]
-        responses_csv = self.formatters.survey_responses_csv(survey, active_users, tz)
-        coordinates_csv = self.formatters.coordinates_csv(survey, active_users, start, end)
-        prompts_csv = self.formatters.prompts_csv(survey, active_users, start, end)
-        cancelled_prompts_csv = self.formatters.cancelled_prompts_csv(survey, active_users, start, end)
-
-        return {
-            'survey_responses.csv': responses_csv,
-            'coordinates.csv': coordinates_csv,
-            'prompt_responses.csv': prompts_csv,
-            'cancelled_prompts.csv': cancelled_prompts_csv
-        }
-
-    def trips_data(self, survey, start, end, timezone):
-        active_users = self.survey.get_active_users(survey, start, end)
-        trips_csv = self.formatters.trips_csv(survey, active_users, start, end)
-        filename = 'trips_{}.csv'.format(start.strftime('%Y%m%d'))
-        return {filename: trips_csv}
+        # the active users' ids are fetched once and bound to each chunk's query as an
+        # array; coordinates within the period are all from active users already
+        active_user_ids = self.survey.get_active_user_ids(survey, start, end)
+        f = self.formatters
+        if export_format == 'parquet':
+            coordinates, prompts, cancelled_prompts = (f.coordinates_parquet, f.prompts_parquet,
+                                                       f.cancelled_prompts_parquet)
+        else:
+            coordinates, prompts, cancelled_prompts = (f.coordinates_csv, f.prompts_csv,
+                                                       f.cancelled_prompts_csv)
+
+        # coordinates are written in chunks of the window, prompts are also limited to
+        # the users active over the whole window and survey responses are one chunk;
+        # the chunks that depend on the active users are keyed on their ids, so newer
+        # coordinates of users already active do not invalidate them
+        windows = chunk_windows(start, end, current_app.config['EXPORT_CHUNK_DAYS'])
+        active_users = hashlib.sha1(json.dumps(active_user_ids)).hexdigest()
+        responses_key = self._chunk_key(survey, 'survey_responses.csv', start, end,
+                                        SURVEY_RESPONSES_TABLES, timezone, active_users)
+        sheets = [
+            ('survey_responses.csv', f.survey_responses_csv, [(responses_key, (active_user_ids, tz))]),
+            ('coordinates.' + export_format, coordinates, [
+                (self._chunk_key(survey, 'coordinates.' + export_format, chunk_start, chunk_end,
+                                 [(MobileCoordinate, 'timestamp')]),
+                 (chunk_start, chunk_end))
+                for chunk_start, chunk_end in windows]),
+            ('prompt_responses.' + export_format, prompts, [
+                (self._chunk_key(survey, 'prompt_responses.' + export_format, chunk_start, chunk_end,
+                                 [(PromptResponse, 'displayed_at')], active_users),
+                 (active_user_ids, chunk_start, chunk_end))
+                for chunk_start, chunk_end in windows]),
+            ('cancelled_prompts.' + export_format, cancelled_prompts, [
+                (self._chunk_key(survey, 'cancelled_prompts.' + export_format, chunk_start, chunk_end,
+                                 [(CancelledPromptResponse, 'displayed_at')], active_users),
+                 (active_user_ids, chunk_start, chunk_end))
+                for chunk_start, chunk_end in windows])
+        ]
+        progress = None
+        if publish_progress:
+            progress = self._progress(publish_progress, 'raw-export-progress', len(sheets),
+                                      len(active_user_ids))
+        return _threaded_sheets(survey, sheets, current_app.config['EXPORT_SHEET_THREADS'],
+                                self._chunk_store(), progress, assemble)
+
+    def trips_data(self, survey, start, end, timezone, publish_progress=None, export_format='csv'):
+        active_users = self.survey.get_active_users(survey, start, end).all()
+        parameters = self.survey.get_tripbreaker_parameters(survey)
+        stations = self.survey.get_station_index(survey, parameters['utm_zone'])
+        filename = 'trips_{}.{}'.format(start.strftime('%Y%m%d'), export_format)
+        # the trips .csv is compressed for the archive as its rows are written
+        if export_format == 'parquet':
+            formatter = self.formatters.trips_parquet
+            trips_f = open_export_file(suffix='.parquet')
+        else:
+            formatter = self.formatters.trips_csv
+            trips_f = open_compressed_export_file()
+        progress = self._progress(publish_progress, 'trips-export-progress', 1, len(active_users))
+        sheet = progress.sheet(filename, trips_f) if progress else None
+        formatter(trips_f, survey, active_users, parameters, stations, start, end,
+                  processes=current_app.config['EXPORT_PROCESSES'],
+                  incremental=current_app.config['TRIPBREAKER_INCREMENTAL'],
+                  progress=sheet)
+        if sheet:
+            sheet.finish()
+        return {filename: trips_f}
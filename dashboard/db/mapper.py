@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+#
+# Database functions for the dashboard's participant mapper
+from collections import OrderedDict
+import ciso8601
+from flask import current_app
+import hashlib
+import math
+import os
+import tempfile
+import threading
+import time
+
+from models import db, CancelledPromptResponse, MobileCoordinate, PromptResponse
+from utils.response_cache import ResponseCache, cache_key
+from utils.simplify import TrajectoryPyramid
+from utils.tiles import MAX_LATITUDE, TileCache, encode_counts_tile, tile_bounds
+
+# the user, search window, collection period, prompts and coordinate statistics of the
+# mapper's view of one mobile user; all-zero coordinates are an iOS bug and do not
+# start the collection period
+WINDOW_SQL = '''
+WITH mobile_user AS (
+    SELECT id FROM mobile_users WHERE survey_id = :survey_id AND uuid = :uuid
+), period AS (
+    SELECT (SELECT min(timestamp) FROM mobile_coordinates
+            WHERE mobile_id = mobile_user.id AND (latitude <> 0 OR longitude <> 0)) AS collection_start,
+           (SELECT max(timestamp) FROM mobile_coordinates
+            WHERE mobile_id = mobile_user.id) AS collection_end
+    FROM mobile_user
+), search AS (
+    SELECT coalesce(CAST(:start_time AS timestamptz),
+                    date_trunc('day', collection_end)) AS search_start,
+           coalesce(CAST(:end_time AS timestamptz),
+                    date_trunc('day', collection_end) + interval '1 day' - interval '1 second') AS search_end
+    FROM period
+)
+SELECT mobile_user.id AS mobile_id, period.collection_start, period.collection_end,
+       search.search_start, search.search_end,
+       (SELECT json_agg(p ORDER BY p.displayed_at) FROM mobile_prompt_responses p
+        WHERE p.mobile_id = mobile_user.id
+          AND p.displayed_at >= search.search_start
+          AND p.displayed_at <= search.search_end) AS prompt_responses,
+       (SELECT json_agg(c ORDER BY c.displayed_at) FROM mobile_cancelled_prompt_responses c
+        WHERE c.mobile_id = mobile_user.id
+          AND c.displayed_at >= search.search_start
+          AND c.displayed_at <= search.search_end) AS cancelled_prompts,
+       coordinates.*
+FROM mobile_user, period, search,
+     LATERAL (SELECT count(id) AS num_points, max(id) AS max_id{coordinate_arrays}
+              FROM mobile_coordinates
+              WHERE mobile_id = mobile_user.id
+                AND h_accuracy <= :min_accuracy
+                AND timestamp >= search.search_start
+                AND timestamp <= search.search_end) AS coordinates
+'''
+COORDINATE_ARRAYS_SQL = ''',
+                     min(timestamp) AS first_timestamp, max(timestamp) AS last_timestamp,
+                     array_agg(CAST(latitude AS float8) ORDER BY timestamp) AS latitudes,
+                     array_agg(CAST(longitude AS float8) ORDER BY timestamp) AS longitudes,
+                     array_agg(CAST(trunc(extract(epoch FROM timestamp)) AS bigint)
+                               ORDER BY timestamp) AS epoch_seconds'''
+TRAJECTORY_SQL = '''
+SELECT {coordinate_arrays}
+FROM mobile_coordinates
+WHERE mobile_id = :mobile_id
+  AND h_accuracy <= :min_accuracy
+  AND timestamp >= :start_time
+  AND timestamp <= :end_time
+'''.format(coordinate_arrays=COORDINATE_ARRAYS_SQL.lstrip(',').strip())
+
+# what the mapper's cached responses for a mobile user depend on: the user's latest
+# coordinate, prompt (and prompt edit) and cancelled prompt and the survey's
+# tripbreaker settings and subway stations
+VERSION_SQL = '''
+SELECT mobile_users.id AS mobile_id,
+       (SELECT count(id) FROM mobile_coordinates
+        WHERE mobile_id = mobile_users.id) AS num_coordinates,
+       (SELECT max(id) FROM mobile_coordinates
+        WHERE mobile_id = mobile_users.id) AS max_coordinate_id,
+       (SELECT max(id) FROM mobile_prompt_responses
+        WHERE mobile_id = mobile_users.id) AS max_prompt_id,
+       (SELECT max(displayed_at) FROM mobile_prompt_responses
+        WHERE mobile_id = mobile_users.id) AS latest_prompt,
+       (SELECT max(edited_at) FROM mobile_prompt_responses
+        WHERE mobile_id = mobile_users.id) AS latest_prompt_edit,
+       (SELECT max(id) FROM mobile_cancelled_prompt_responses
+        WHERE mobile_id = mobile_users.id) AS max_cancelled_prompt_id,
+       (SELECT max(displayed_at) FROM mobile_cancelled_prompt_responses
+        WHERE mobile_id = mobile_users.id) AS latest_cancelled_prompt,
+       surveys.trip_break_interval, surveys.trip_subway_buffer,
+       surveys.trip_break_cold_start_distance, surveys.gps_accuracy_threshold,
+       (SELECT count(id) FROM survey_subway_stops WHERE survey_id = surveys.id) AS num_stations,
+       (SELECT max(id) FROM survey_subway_stops WHERE survey_id = surveys.id) AS max_station_id
+FROM mobile_users
+JOIN surveys ON surveys.id = mobile_users.survey_id
+WHERE mobile_users.survey_id = :survey_id AND mobile_users.uuid = :uuid
+'''
+
+
+# build transient model instances from the rows of a json_agg'd table
+def _json_models(model, rows):
+    timestamp_columns = [c.name for c in model.__table__.columns
+                         if isinstance(c.type, db.DateTime)]
+    instances = []
+    for row in rows or []:
+        for column in timestamp_columns:
+            if row.get(column):
+                row[column] = ciso8601.parse_datetime(row[column])
+        instances.append(model(**row))
+    return instances
+
+
+class MapperWindow(object):
+    '''A mobile user's data within the mapper's search window'''
+    def __init__(self, row):
+        self.mobile_id = row.mobile_id
+        self.collection_start = row.collection_start
+        # the period is unknown without a valid first point
+        self.collection_end = row.collection_end if row.collection_start else None
+        self.search_start = row.search_start
+        self.search_end = row.search_end
+        self.prompt_responses = _json_models(PromptResponse, row.prompt_responses)
+        self.cancelled_prompts = _json_models(CancelledPromptResponse, row.cancelled_prompts)
+        self.num_points = row.num_points
+        self.max_id = row.max_id
+        self.trajectory = None
+
+
+class MapperActions:
+    _response_cache = None
+
+    # time each survey's window of cached tiles was last checked for new coordinates
+    _tile_checks = {}
+
+    # recently built trajectory pyramids by user, window and the coordinates they
+    # were built from, shared by the requests of each API process
+    _pyramids = OrderedDict()
+    _pyramids_lock = threading.Lock()
+
+    @classmethod
+    def response_cache(cls):
+        config = current_app.config
+        settings = (config['MAPPER_CACHE_SIZE'], config['MAPPER_CACHE_REDIS_URL'],
+                    config['MAPPER_CACHE_TTL_SECONDS'])
+        if not cls._response_cache or cls._response_cache[0] != settings:
+            cls._response_cache = (settings, ResponseCache(*settings, prefix='itinerum:mapper:'))
+        return cls._response_cache[1]
+
+    # return the key of a mapper response for a mobile user, changing as new coordinates
+    # or prompts are recorded for them or the survey's tripbreaker settings change; None
+    # when the user does not exist or caching is disabled
+    def response_key(self, resource, survey_id, uuid, *params):
+        config = current_app.config
+        if not (config['MAPPER_CACHE_SIZE'] or config['MAPPER_CACHE_REDIS_URL']):
+            return None
+        version = db.session.execute(db.text(VERSION_SQL), {'survey_id': survey_id, 'uuid': uuid}).first()
+        if not version:
+            return None
+        return cache_key(resource, survey_id, uuid, tuple(version), params)
+
+    # return a mobile user's collection period, search window and the prompts and
+    # coordinates within it, from a single statement; the period is taken from
+    # min/max aggregates over the user's timestamp index and a window that is not
+    # given defaults to the last day of collection
+    def window(self, survey_id, uuid, start_time=None, end_time=None, min_accuracy=100,
+               coordinates=True):
+        sql = WINDOW_SQL.format(coordinate_arrays=COORDINATE_ARRAYS_SQL if coordinates else '')
+        row = db.session.execute(db.text(sql), {
+            'survey_id': survey_id,
+            'uuid': uuid,
+            'start_time': start_time,
+            'end_time': end_time,
+            'min_accuracy': min_accuracy
+        }).first()
+        if not row:
+            return None
+
+        window = MapperWindow(row)
+        if coordinates:
+            window.trajectory = self._trajectory(row)
+        return window
+
+    # return the user's coordinates within a window as a trajectory
+    def trajectory(self, window, min_accuracy=100):
+        row = db.session.execute(db.text(TRAJECTORY_SQL), {
+            'mobile_id': window.mobile_id,
+            'start_time': window.search_start,
+            'end_time': window.search_end,
+            'min_accuracy': min_accuracy
+        }).first()
+        return self._trajectory(row)
+
+    @staticmethod
+    def _trajectory(row):
+        return TrajectoryPyramid(row.latitudes or [], row.longitudes or [],
+                                 start_time=row.first_timestamp,
+                                 end_time=row.last_timestamp,
+                                 epoch_seconds=row.epoch_seconds or [],
+                                 min_tolerance=current_app.config['MAPPER_SIMPLIFY_MIN_METERS'])
+
+    # return the simplification pyramid of a window's points; a cached pyramid is
+    # reused while the count and latest id of the window's points match
+    def points_pyramid(self, window, min_accuracy=100):
+        cache_size = current_app.config['MAPPER_PYRAMID_CACHE_SIZE']
+        key = (window.mobile_id, window.search_start, window.search_end, min_accuracy,
+               window.num_points, window.max_id)
+        if cache_size:
+            with self._pyramids_lock:
+                pyramid = self._pyramids.pop(key, None)
+                if pyramid is not None:
+                    self._pyramids[key] = pyramid
+                    return pyramid
+
+        pyramid = window.trajectory or self.trajectory(window, min_accuracy)
+        if cache_size:
+            with self._pyramids_lock:
+                self._pyramids[key] = pyramid
+                while len(self._pyramids) > cache_size:
+                    self._pyramids.popitem(last=False)
+        return pyramid
+
+    @staticmethod
+    def _tile_cache():
+        folder = current_app.config['MAPPER_TILES_FOLDER']
+        if not folder:
+            folder = os.path.join(tempfile.gettempdir(), 'itinerum-tiles')
+        return TileCache(folder)
+
+    @staticmethod
+    def _tile_window_key(start_time, end_time):
+        if not (start_time or end_time):
+            return 'all'
+        window = '{}|{}'.format(start_time.isoformat() if start_time else '',
+                                end_time.isoformat() if end_time else '')
+        return hashlib.sha1(window).hexdigest()[:16]
+
+    @staticmethod
+    def _window_filters(survey, start_time, end_time):
+        filters = [MobileCoordinate.survey_id == survey.id]
+        if start_time:
+            filters.append(MobileCoordinate.timestamp >= start_time)
+        if end_time:
+            filters.append(MobileCoordinate.timestamp <= end_time)
+        return filters
+
+    # discard a window's cached tiles once coordinates newer than its watermark have
+    # been recorded within it; checked at most every MAPPER_TILE_CHECK_SECONDS
+    def _check_tiles(self, cache, survey, start_time, end_time, window_key):
+        now = time.time()
+        check_key = (cache.folder, survey.id, window_key)
+        if now - self._tile_checks.get(check_key, 0) < current_app.config['MAPPER_TILE_CHECK_SECONDS']:
+            return
+
+        latest_id = (db.session.query(db.func.max(MobileCoordinate.id))
+                               .filter(MobileCoordinate.survey_id == survey.id)
+                               .scalar()) or 0
+        watermark = cache.watermark(survey.id, window_key)
+        if watermark is None:
+            cache.invalidate(survey.id, window_key)
+            cache.evict(current_app.config['MAPPER_TILE_CACHE_MAX_AGE_HOURS'] * 3600)
+        elif latest_id > watermark:
+            filters = self._window_filters(survey, start_time, end_time)
+            filters.append(MobileCoordinate.id > watermark)
+            if db.session.query(db.exists().where(db.and_(*filters))).scalar():
+                cache.invalidate(survey.id, window_key)
+        cache.set_watermark(survey.id, window_key, latest_id)
+        self._tile_checks[check_key] = now
+
+    # return the survey's coordinate counts in a grid of `grid_size` bins across a map
+    # tile as (column, row, count) rows; bins are computed in the database so only the
+    # counts of occupied bins are transferred
+    def density_bins(self, survey, z, x, y, grid_size, start_time=None, end_time=None):
+        west, south, east, north = tile_bounds(z, x, y)
+        n = 2 ** z
+        latitude = db.cast(MobileCoordinate.latitude, db.Float)
+        longitude = db.cast(MobileCoordinate.longitude, db.Float)
+        latitude_rad = db.func.radians(latitude)
+        mercator_y = (1. - db.func.ln(db.func.tan(latitude_rad) + 1. / db.func.cos(latitude_rad)) / math.pi) / 2.
+        bin_x = db.func.floor(((longitude + 180.) / 360. * n - x) * grid_size)
+        bin_y = db.func.floor((mercator_y * n - y) * grid_size)
+
+        filters = self._window_filters(survey, start_time, end_time)
+        filters.extend([MobileCoordinate.latitude >= max(south, -MAX_LATITUDE),
+                        MobileCoordinate.latitude < min(north, MAX_LATITUDE),
+                        MobileCoordinate.longitude >= west,
+                        MobileCoordinate.longitude < east,
+                        # rows with all 0-values are an iOS bug
+                        db.or_(MobileCoordinate.latitude != 0, MobileCoordinate.longitude != 0)])
+        bins = (db.session.query(bin_x.label('bin_x'), bin_y.label('bin_y'),
+                                 db.func.count(MobileCoordinate.id).label('count'))
+                          .filter(*filters)
+                          .group_by(bin_x, bin_y))
+        last = grid_size - 1
+        return [(min(max(int(b.bin_x), 0), last), min(max(int(b.bin_y), 0), last), b.count)
+                for b in bins]
+
+    # return the encoded vector tile of survey coordinate density for a map tile,
+    # reading it from the tile cache when unchanged
+    def density_tile(self, survey, z, x, y, start_time=None, end_time=None):
+        cache = self._tile_cache()
+        window_key = self._tile_window_key(start_time, end_time)
+        self._check_tiles(cache, survey, start_time, end_time, window_key)
+
+        tile = cache.read(survey.id, window_key, z, x, y)
+        if tile is None:
+            grid_size = current_app.config['MAPPER_TILE_GRID']
+            bins = self.density_bins(survey, z, x, y, grid_size, start_time, end_time)
+            tile = encode_counts_tile('coordinates', bins, grid_size)
+            cache.write(survey.id, window_key, z, x, y, tile)
+        return tile
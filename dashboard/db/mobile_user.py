@@ -3,6 +3,8 @@
 # Kyle Fitzsimmons, 2017
 #
 # Database functions for mobile app users
+from flask import current_app
+
 from models import (db, CancelledPromptResponse, MobileCoordinate, MobileUser,
                     PromptResponse, SurveyQuestion, SurveyResponse)
 from utils.data import flatten_dict
@@ -160,6 +162,42 @@ class MobileUserActions:
             # get the most recent points
             return results.order_by(MobileCoordinate.timestamp.asc()).limit(limit)
 
+    # stream only the coordinate columns read by the tripbreaker through a server-side
+    # (named) cursor in batches of `fetch_size` rows, bypassing the ORM entirely
+    @staticmethod
+    def tripbreaker_coordinates(mobile_id, start_time=None, end_time=None, min_accuracy=None,
+                                fetch_size=None):
+        if not fetch_size:
+            fetch_size = current_app.config['COORDINATES_FETCH_SIZE']
+
+        filters = [MobileCoordinate.mobile_id == mobile_id]
+        if start_time:
+            filters.append(MobileCoordinate.timestamp >= start_time)
+        if end_time:
+            filters.append(MobileCoordinate.timestamp <= end_time)
+        if min_accuracy is not None:
+            filters.append(MobileCoordinate.h_accuracy <= min_accuracy)
+        query = (db.select([MobileCoordinate.id,
+                            MobileCoordinate.timestamp,
+                            MobileCoordinate.latitude,
+                            MobileCoordinate.longitude,
+                            MobileCoordinate.h_accuracy,
+                            MobileCoordinate.v_accuracy])
+                   .where(db.and_(*filters))
+                   .order_by(MobileCoordinate.timestamp.asc())
+                   .execution_options(stream_results=True))
+
+        result = db.session.execute(query)
+        try:
+            while True:
+                rows = result.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            result.close()
+
     def prompt_responses(self, survey, uuid, start_time=None, end_time=None):
         user = survey.mobile_users.filter_by(uuid=uuid).one_or_none()
         if user:
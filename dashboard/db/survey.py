@@ -3,13 +3,34 @@
 # Kyle Fitzsimmons, 2017
 #
 # Database functions for dashboard surveys
+from datetime import datetime
 from flask import current_app
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.exc import IntegrityError, ProgrammingError
 
-from models import (db, MobileCoordinate, MobileUser, NewSurveyToken, Survey,
-                    SurveyQuestion, SurveyResponse, SurveyQuestionChoice,
+from models import (db, CancelledPromptResponse, MobileCoordinate, MobileUser, NewSurveyToken,
+                    PromptResponse, Survey, SurveyQuestion, SurveyResponse, SurveyQuestionChoice,
                     SubwayStop, WebUserRole, web_user_role_lookup)
 from hardcoded_survey_questions import default_stack
+from utils.tripbreaker import algorithm as tripbreaker
+from utils.tripbreaker.modules.tools import utm_zone
+
+# aggregates that change when a table's rows are edited in place: users and prompt
+# responses are stamped when modified and cancelled prompts when cancelled, while
+# survey responses are digested since their edits are not timestamped
+EDIT_WATERMARKS = {
+    MobileUser: db.func.max(MobileUser.modified_at),
+    SurveyResponse: db.func.md5(db.func.string_agg(db.func.md5(db.cast(SurveyResponse.response,
+                                                                       db.Text)),
+                                                   aggregate_order_by(db.literal(''),
+                                                                      SurveyResponse.id))),
+    PromptResponse: db.func.max(PromptResponse.edited_at),
+    CancelledPromptResponse: db.func.max(CancelledPromptResponse.cancelled_at)
+}
+
+# subway station indexes by survey id, rebuilt only when the survey's stops
+# or UTM zone change
+_station_indexes = {}
 
 
 class SurveyActions(object):
@@ -76,6 +97,36 @@ class SurveyActions(object):
                                     .order_by(MobileUser.id))
         return users
 
+    # return the ids of a survey's users with coordinates recorded within a time range;
+    # the ids are fetched once so export queries can bind them as a single array
+    def get_active_user_ids(self, survey, start, end):
+        query = (db.select([MobileCoordinate.mobile_id])
+                   .where(db.and_(MobileCoordinate.survey_id == survey.id,
+                                  MobileCoordinate.timestamp >= start,
+                                  MobileCoordinate.timestamp <= end))
+                   .distinct()
+                   .order_by(MobileCoordinate.mobile_id))
+        return [row.mobile_id for row in db.session.execute(query)]
+
+    # return the row count and highest id of each table's survey rows, limited to the
+    # time range for tables given with a timestamp column, followed by the aggregate of
+    # tables with rows edited in place; rows being added, removed or edited change this
+    # watermark
+    def get_data_watermark(self, survey, start, end, tables):
+        columns = []
+        for table, timestamp_column in tables:
+            criteria = [table.survey_id == survey.id]
+            if timestamp_column:
+                timestamp = getattr(table, timestamp_column)
+                criteria += [timestamp >= start, timestamp <= end]
+            aggregates = [db.func.count(table.id), db.func.max(table.id)]
+            if table in EDIT_WATERMARKS:
+                aggregates.append(EDIT_WATERMARKS[table])
+            for aggregate in aggregates:
+                columns.append(db.select([aggregate]).where(db.and_(*criteria)).as_scalar())
+        watermark = db.session.execute(db.select(columns)).first()
+        return [value.isoformat() if isinstance(value, datetime) else value for value in watermark]
+
     # return the admin user record for a survey record
     def get_admin(self, survey):
         query = (survey.web_users.join(web_user_role_lookup)
@@ -93,6 +144,44 @@ class SurveyActions(object):
         if result:
             return result.timestamp
 
+    # return the UTM zone of the first valid coordinate in a survey so all of
+    # the survey's points are projected within the same zone
+    def get_utm_zone(self, survey):
+        result = (survey.mobile_coordinates.with_entities(MobileCoordinate.latitude,
+                                                          MobileCoordinate.longitude)
+                                           .filter(db.and_(MobileCoordinate.latitude != 0,
+                                                           MobileCoordinate.longitude != 0))
+                                           .order_by(MobileCoordinate.timestamp.asc())
+                                           .first())
+        if result:
+            return utm_zone(result.latitude, result.longitude)
+
+    # return the survey's tripbreaker settings as parameters for `tripbreaker.run`
+    def get_tripbreaker_parameters(self, survey):
+        return {
+            'break_interval_seconds': survey.trip_break_interval,
+            'subway_buffer_meters': survey.trip_subway_buffer,
+            'cold_start_distance_meters': survey.trip_break_cold_start_distance,
+            'accuracy_cutoff_meters': survey.gps_accuracy_threshold,
+            'utm_zone': self.get_utm_zone(survey)
+        }
+
+    # return the survey's subway stops as a tripbreaker spatial index, cached
+    # between calls so exports and mapper requests do not rebuild it each time
+    def get_station_index(self, survey, zone_number):
+        count, last_id = (survey.subway_stops.with_entities(db.func.count(SubwayStop.id),
+                                                            db.func.max(SubwayStop.id))
+                                             .one())
+        key = (zone_number, count, last_id)
+        cached = _station_indexes.get(survey.id)
+        if cached and cached[0] == key:
+            return cached[1]
+
+        stations = tripbreaker.station_index(survey.subway_stops.order_by(SubwayStop.id),
+                                             zone_number=zone_number)
+        _station_indexes[survey.id] = (key, stations)
+        return stations
+
     # TO DO: remove, seems to mimic `get_start_time` but worse
     def has_started__deprecated(self, survey):
         if survey.survey_responses.first():
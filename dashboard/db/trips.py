@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+#
+# Database functions for incremental trip detection; finished trips are persisted
+# per mobile user along with a checkpoint so later runs only process newer points
+import ciso8601
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, MobileTrip, MobileTripbreakerState, MobileUser, SubwayStop
+from utils.tripbreaker import algorithm as tripbreaker
+from utils.tripbreaker.modules.points import Point
+from utils.tripbreaker.modules.trip_codes import MISSING_TRIP, MISSING_TRIP_METRO
+
+from .mobile_user import MobileUserActions
+
+# survey settings that invalidate a user's persisted trips when changed, along
+# with the count and latest id of the survey's subway stops
+STATE_PARAMETERS = ['break_interval_seconds', 'subway_buffer_meters',
+                    'accuracy_cutoff_meters', 'utm_zone']
+POINT_FIELDS = ['latitude', 'longitude', 'h_accuracy', 'timestamp',
+                'trip_distance', 'distance', 'break_period']
+MISSING_TRIP_NOTES = [MISSING_TRIP, MISSING_TRIP_METRO]
+
+
+def _float(value):
+    if value is None:
+        return None
+    return float(value)
+
+
+def _is_missing_trip(points):
+    return all(p.note in MISSING_TRIP_NOTES for p in points)
+
+
+def _serialize_points(points):
+    return [[_float(p.latitude), _float(p.longitude), p.h_accuracy,
+             p.timestamp.isoformat(), p.trip_distance, p.distance, p.break_period]
+            for p in points]
+
+
+def _deserialize_points(rows, trip_num, trip_code):
+    points = []
+    for row in rows:
+        point = Point(trip=trip_num, trip_code=trip_code, **dict(zip(POINT_FIELDS, row)))
+        point.timestamp = ciso8601.parse_datetime(point.timestamp)
+        points.append(point)
+    return points
+
+
+def _serialize_trip(trip_num, points, summary):
+    return {
+        'trip_num': trip_num,
+        'trip_code': summary['trip_code'],
+        'start': summary['start'].isoformat(),
+        'end': summary['end'].isoformat(),
+        'olat': _float(summary['olat']),
+        'olon': _float(summary['olon']),
+        'dlat': _float(summary['dlat']),
+        'dlon': _float(summary['dlon']),
+        'direct_distance': summary['direct_distance'],
+        'cumulative_distance': summary['cumulative_distance'],
+        'merge_codes': summary['merge_codes'],
+        'points': _serialize_points(points)
+    }
+
+
+class TripsActions:
+    def _reset(self, state, settings):
+        MobileTrip.query.filter_by(mobile_id=state.mobile_id).delete(synchronize_session=False)
+        state.parameters = settings
+        state.checkpoint = None
+        state.last_trip_num = 0
+        state.open_trips = []
+
+    def _settings(self, survey_id, parameters):
+        settings = {key: parameters[key] for key in STATE_PARAMETERS}
+        num_stations, max_station_id = (db.session.query(db.func.count(SubwayStop.id),
+                                                         db.func.max(SubwayStop.id))
+                                                  .filter(SubwayStop.survey_id == survey_id)
+                                                  .one())
+        settings['num_stations'] = num_stations
+        settings['max_station_id'] = max_station_id
+        return settings
+
+    # a user's state is created if it's missing and then locked, so concurrent updates
+    # of a new user wait on the same row rather than inserting it twice
+    def _get_state(self, mobile_id, parameters):
+        user = db.select([MobileUser.survey_id, MobileUser.id]).where(MobileUser.id == mobile_id)
+        db.session.execute(insert(MobileTripbreakerState.__table__)
+                           .from_select(['survey_id', 'mobile_id'], user)
+                           .on_conflict_do_nothing(index_elements=['mobile_id']))
+        state = (MobileTripbreakerState.query.filter_by(mobile_id=mobile_id)
+                                             .with_for_update()
+                                             .one())
+        settings = self._settings(state.survey_id, parameters)
+        if state.parameters != settings:
+            self._reset(state, settings)
+        return state
+
+    # run the tripbreaker over a user's coordinates recorded since their checkpoint;
+    # the final points of the last finished trip are reprocessed as context so gaps to
+    # the next trip are inferred as in a full run, and trips following the last two
+    # complete trips are kept open to be re-detected when newer points arrive
+    def update(self, mobile_id, parameters, stations):
+        state = self._get_state(mobile_id, parameters)
+
+        checkpoint = state.checkpoint
+        context_ids = set()
+        # recorded timestamps of the points by id, since a single point attached to a
+        # trip takes the timestamp of the trip's end or start
+        timestamps = {}
+
+        def _record(points):
+            for p in points:
+                timestamps[p.id] = p.timestamp
+                if checkpoint and p.timestamp <= checkpoint:
+                    context_ids.add(p.id)
+                yield p
+
+        start_time = checkpoint
+        if checkpoint:
+            # a single point appended to the last finished trip is given the trip's
+            # previous end timestamp, so the context starts from the trip's end
+            trip_end = (db.session.query(MobileTrip.end)
+                                  .filter_by(mobile_id=mobile_id, trip_num=state.last_trip_num)
+                                  .scalar())
+            start_time = min(checkpoint, trip_end)
+        points = MobileUserActions.tripbreaker_coordinates(mobile_id, start_time=start_time)
+        trips, summaries = tripbreaker.run(parameters, stations, _record(points))
+        if checkpoint and trips:
+            # a newer point joined the context points' trip, either connected to it
+            # or attached as a single point, so the previously finished trip has been
+            # extended; redetect the user's trips in full
+            if any(p.id not in context_ids for p in trips[min(trips)]):
+                self._reset(state, state.parameters)
+                checkpoint = None
+                points = MobileUserActions.tripbreaker_coordinates(mobile_id)
+                trips, summaries = tripbreaker.run(parameters, stations, _record(points))
+
+        if not trips:
+            db.session.commit()
+            return state
+
+        trip_ids = sorted(trips)
+        offset = 0
+        if checkpoint:
+            trip_ids = trip_ids[1:]
+            offset = state.last_trip_num - 1
+        complete_ids = [num for num in trip_ids if not _is_missing_trip(trips[num])]
+
+        finished_ids = []
+        if len(complete_ids) > 1:
+            finished_ids = [num for num in trip_ids if num <= complete_ids[-2]]
+        for num in finished_ids:
+            trip = _serialize_trip(num + offset, trips[num], summaries[num])
+            db.session.add(MobileTrip(survey_id=state.survey_id,
+                                      mobile_id=mobile_id,
+                                      **trip))
+        if finished_ids:
+            state.last_trip_num = finished_ids[-1] + offset
+            # the checkpoint is the latest recorded timestamp of the last finished trip's
+            # points, so a single point appended to it is reprocessed only as context
+            state.checkpoint = max(timestamps[p.id] for p in trips[finished_ids[-1]]
+                                   if p.id in timestamps)
+
+        state.open_trips = [_serialize_trip(num + offset, trips[num], summaries[num])
+                            for num in trip_ids if num not in finished_ids]
+        db.session.commit()
+        return state
+
+    # return the persisted and open trips of a user overlapping a time window,
+    # formatted as the `trips, summaries` output of `tripbreaker.run`
+    def window(self, state, start=None, end=None):
+        finished = MobileTrip.query.filter_by(mobile_id=state.mobile_id)
+        if start:
+            finished = finished.filter(MobileTrip.end >= start)
+        if end:
+            finished = finished.filter(MobileTrip.start <= end)
+        finished = finished.order_by(MobileTrip.trip_num)
+        rows = [{column: getattr(trip, column) for column in ('trip_num', 'trip_code', 'start', 'end',
+                                                             'olat', 'olon', 'dlat', 'dlon',
+                                                             'direct_distance', 'cumulative_distance',
+                                                             'merge_codes', 'points')}
+                for trip in finished]
+        for trip in state.open_trips or []:
+            trip = dict(trip)
+            trip['start'] = ciso8601.parse_datetime(trip['start'])
+            trip['end'] = ciso8601.parse_datetime(trip['end'])
+            if (not start or trip['end'] >= start) and (not end or trip['start'] <= end):
+                rows.append(trip)
+
+        trips, summaries = {}, {}
+        for row in rows:
+            num = row.pop('trip_num')
+            trips[num] = _deserialize_points(row.pop('points'), num, row['trip_code'])
+            row['trip_id'] = num
+            summaries[num] = row
+        return trips, summaries
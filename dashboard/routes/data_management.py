@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 # Kyle Fitzsimmons, 2017
 import ciso8601
-from flask import request
+from flask import current_app, request
 from flask_restful import Resource
 from flask_rq2 import RQ
 from flask_security import roles_accepted
@@ -10,10 +10,11 @@ from flask_sse import sse
 import os
 
 from dashboard.database import Database
+from dashboard.db.export import EXPORT_FORMATS
 from utils.data import make_keys_camelcase
-from utils.filehandler import save_zip
+from utils.filehandler import evict_cached_zips, find_cached_zip, save_zip
 from utils.flask_jwt import jwt_required, current_identity
-from utils.responses import Success
+from utils.responses import Success, Error
 
 database = Database()
 rq = RQ()
@@ -50,8 +51,15 @@ class DataManagementSurveyStatusRoute(Resource):
                        body=make_keys_camelcase(response))
 
 
+# publish throttled export progress events on the export's SSE channel
+def _progress_publisher(sse_channel):
+    def publish(event):
+        sse.publish(make_keys_camelcase(event), channel=sse_channel)
+    return publish
+
+
 @rq.job
-def mobile_data_dump(survey_id, start, end, timezone, sse_channel):
+def mobile_data_dump(survey_id, start, end, timezone, sse_channel, export_format='csv'):
     survey = database.survey.get(survey_id)
     event_start_response = {
         'start': start.isoformat(),
@@ -60,16 +68,36 @@ def mobile_data_dump(survey_id, start, end, timezone, sse_channel):
     }
     sse.publish(event_start_response, channel=sse_channel)
     basepath = os.path.join('user', 'exports')
+    cache_key = database.export.cache_key('raw', survey, start, end, timezone, export_format)
     database.export._begin('raw', survey, basepath, start, end)
     basename = survey.pretty_name + '-responses'
-    data = database.export.survey_data(survey, start, end, timezone)
-    zip_filename = save_zip(basepath=basepath, basename=basename, data=data)
+    # a repeat export with no new data returns the existing archive
+    zip_filename = find_cached_zip(basepath, cache_key)
+    if not zip_filename:
+        for _ in range(current_app.config['EXPORT_CHUNK_WORKERS']):
+            mobile_data_chunks.queue(survey_id, start, end, timezone, export_format)
+        data = database.export.survey_data(survey, start, end, timezone,
+                                           publish_progress=_progress_publisher(sse_channel),
+                                           export_format=export_format)
+        zip_filename = save_zip(basepath=basepath, basename=basename, data=data, cache_key=cache_key)
+        if cache_key:
+            evict_cached_zips(basepath, keep=zip_filename)
+        database.export.evict_chunks()
     export = database.export._finish('raw', survey, basepath, zip_filename)
     event_finished_response = make_keys_camelcase(export)
     event_finished_response['type'] = 'raw-export-complete'
     sse.publish(event_finished_response, channel=sse_channel)
 
 
+# writes the chunks of a raw export alongside the `mobile_data_dump` job assembling them
+@rq.job
+def mobile_data_chunks(survey_id, start, end, timezone, export_format='csv'):
+    survey = database.survey.get(survey_id)
+    for _ in database.export.survey_data(survey, start, end, timezone,
+                                         export_format=export_format, assemble=False):
+        pass
+
+
 class DataManagementExportRawDataEventsRoute(Resource):
     headers = {'Location': '/data/download/raw/events'}
     resource_type = 'DataManagementExportRawDataEvents'
@@ -82,10 +110,16 @@ class DataManagementExportRawDataEventsRoute(Resource):
         end = ciso8601.parse_datetime(request.values.get('end'))
         timezone = request.values.get('timezone')
         sse_channel = request.values.get('channel')
+        export_format = request.values.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Error(status_code=400,
+                         headers=self.headers,
+                         resource_type=self.resource_type,
+                         errors=['Export format must be one of: ' + ', '.join(EXPORT_FORMATS)])
         # sse.publish({'msg': 'starting exports...', 'type': 'request-ack'},
         #             channel=sse_channel)
 
-        mobile_data_dump.queue(survey_id, start, end, timezone, sse_channel)
+        mobile_data_dump.queue(survey_id, start, end, timezone, sse_channel, export_format)
         # mobile_data_dump(survey_id, start, end, timezone, sse_channel)
 
         response = {
@@ -99,7 +133,7 @@ class DataManagementExportRawDataEventsRoute(Resource):
 
 
 @rq.job
-def mobile_trips_dump(survey_id, start, end, timezone, sse_channel):
+def mobile_trips_dump(survey_id, start, end, timezone, sse_channel, export_format='csv'):
     survey = database.survey.get(survey_id)
     event_start_response = {
         'start': start.isoformat(),
@@ -108,10 +142,17 @@ def mobile_trips_dump(survey_id, start, end, timezone, sse_channel):
     }
     sse.publish(event_start_response, channel=sse_channel)
     basepath = os.path.join('user', 'exports')
+    cache_key = database.export.cache_key('trips', survey, start, end, timezone, export_format)
     database.export._begin('trips', survey, basepath, start, end)
-    data = database.export.trips_data(survey, start, end, timezone)
     basename = survey.pretty_name + '-' + 'trips'
-    zip_filename = save_zip(basepath=basepath, basename=basename, data=data)
+    zip_filename = find_cached_zip(basepath, cache_key)
+    if not zip_filename:
+        data = database.export.trips_data(survey, start, end, timezone,
+                                          publish_progress=_progress_publisher(sse_channel),
+                                          export_format=export_format)
+        zip_filename = save_zip(basepath=basepath, basename=basename, data=data, cache_key=cache_key)
+        if cache_key:
+            evict_cached_zips(basepath, keep=zip_filename)
     export = database.export._finish('trips', survey, basepath, zip_filename)
     event_finish_response = make_keys_camelcase(export)
     event_finish_response['type'] = 'trips-export-complete'
@@ -130,10 +171,16 @@ class DataManagementExportTripsDataEventsRoute(Resource):
         end = ciso8601.parse_datetime(request.values.get('end'))
         timezone = request.values.get('timezone')
         sse_channel = request.values.get('channel')
+        export_format = request.values.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return Error(status_code=400,
+                         headers=self.headers,
+                         resource_type=self.resource_type,
+                         errors=['Export format must be one of: ' + ', '.join(EXPORT_FORMATS)])
         # sse.publish({'msg': 'starting exports...', 'type': 'request-ack'},
         #             channel=sse_channel)
 
-        mobile_trips_dump.queue(survey_id, start, end, timezone, sse_channel)
+        mobile_trips_dump.queue(survey_id, start, end, timezone, sse_channel, export_format)
         # mobile_trips_dump(survey_id, start, end, timezone, sse_channel)
 
         response = {
@@ -2,22 +2,28 @@
 # -*- coding: utf-8 -*-
 # Kyle Fitzsimmons, 2017
 import csv
-from datetime import datetime
 import dateutil.parser
-from flask import request
+from flask import current_app, make_response, request
 from flask_restful import Resource
 from flask_security import roles_accepted
 
 from dashboard.database import Database
 from models import db
 from utils.flask_jwt import jwt_required, current_identity
-from utils.geo import to_points_geojson, to_prompts_geojson, to_trips_geojson
+from utils.geo import (MAPPER_ENCODINGS, to_prompts_geojson, to_simplified_points_geojson,
+                       to_simplified_points_polyline, to_trips_geojson, to_trips_polyline)
 from utils.responses import Success, Error
+from utils.tiles import TILE_MIMETYPE, valid_tile
 from utils.tripbreaker import algorithm as tripbreaker
 
 database = Database()
 
 
+def _isoformat(timestamp):
+    if timestamp:
+        return timestamp.isoformat()
+
+
 class MapperPointsRoute(Resource):
     headers = {'Location': '/itinerum/users/<string:uuid>/points'}
     resource_type = 'MapperPoints'
@@ -25,58 +31,72 @@ class MapperPointsRoute(Resource):
     @jwt_required()
     @roles_accepted('admin', 'researcher', 'participant')
     def get(self, uuid):
-        survey = database.survey.get(current_identity.survey_id)
+        encoding = request.values.get('encoding', 'geojson')
+        if encoding not in MAPPER_ENCODINGS:
+            return Error(status_code=400,
+                         headers=self.headers,
+                         resource_type=self.resource_type,
+                         errors=['Unsupported encoding: {}'.format(encoding)])
+        precision = current_app.config['MAPPER_POLYLINE_PRECISION']
 
         start = request.values.get('startTime')
         end = request.values.get('endTime')
-
-        collection_start, collection_end = database.mobile_user.active_period(survey, uuid)
-        if not (start and end):
-            start = datetime(year=collection_end.year,
-                             month=collection_end.month,
-                             day=collection_end.day,
-                             hour=0,
-                             minute=0,
-                             second=0,
-                             tzinfo=collection_end.tzinfo)
-            end = datetime(year=collection_end.year,
-                           month=collection_end.month,
-                           day=collection_end.day,
-                           hour=23,
-                           minute=59,
-                           second=59,
-                           tzinfo=collection_end.tzinfo)
-        else:
+        if start and end:
             start = dateutil.parser.parse(start)
             end = dateutil.parser.parse(end)
+        else:
+            start, end = None, None
 
+        # a `zoom` or `tolerance` (meters) returns the points simplified to the detail
+        # visible on the map instead of every raw point
+        zoom = request.values.get('zoom', type=float)
+        tolerance = request.values.get('tolerance', type=float)
+        simplify = zoom is not None or tolerance is not None
 
-        gps_points = database.mobile_user.coordinates(survey=survey,
-                                                      uuid=uuid,
-                                                      start_time=start,
-                                                      end_time=end)
+        cache = database.mapper.response_cache()
+        cache_key = database.mapper.response_key('points', current_identity.survey_id, uuid,
+                                                 start, end, encoding, zoom, tolerance, precision,
+                                                 current_app.config['MAPPER_SIMPLIFY_PIXELS'],
+                                                 current_app.config['MAPPER_SIMPLIFY_MIN_METERS'])
+        if cache_key:
+            response = cache.get(cache_key)
+            if response is not None:
+                return response
 
-        prompt_responses = database.mobile_user.prompt_responses(survey=survey,
-                                                                 uuid=uuid,
-                                                                 start_time=start,
-                                                                 end_time=end)
+        window = database.mapper.window(current_identity.survey_id, uuid,
+                                        start_time=start,
+                                        end_time=end,
+                                        coordinates=not simplify)
+        if not window:
+            return Error(status_code=404,
+                         headers=self.headers,
+                         resource_type=self.resource_type,
+                         errors=['Mobile user not found'])
 
-        cancelled_prompts = database.mobile_user.cancelled_prompts(survey=survey,
-                                                                   uuid=uuid,
-                                                                   start_time=start,
-                                                                   end_time=end)
+        pyramid = window.trajectory
+        if simplify:
+            pyramid = database.mapper.points_pyramid(window)
+            if tolerance is None:
+                tolerance = pyramid.zoom_tolerance(zoom, current_app.config['MAPPER_SIMPLIFY_PIXELS'])
+        if encoding == 'polyline':
+            points = to_simplified_points_polyline(pyramid, tolerance, precision)
+        else:
+            points = to_simplified_points_geojson(pyramid, tolerance)
 
         # returns bare response to be returned as msgpack
-        return {
+        response = {
             'uuid': uuid,
-            'points': to_points_geojson(gps_points),
-            'promptResponses': to_prompts_geojson(prompt_responses, group_by='displayed_at'),
-            'cancelledPrompts': to_prompts_geojson(cancelled_prompts),
-            'collectionStart': collection_start.isoformat(),
-            'collectionEnd': collection_end.isoformat(),
-            'searchStart': start.isoformat(),
-            'searchEnd': end.isoformat()
+            'points': points,
+            'promptResponses': to_prompts_geojson(window.prompt_responses, group_by='displayed_at'),
+            'cancelledPrompts': to_prompts_geojson(window.cancelled_prompts),
+            'collectionStart': _isoformat(window.collection_start),
+            'collectionEnd': _isoformat(window.collection_end),
+            'searchStart': _isoformat(window.search_start),
+            'searchEnd': _isoformat(window.search_end)
         }
+        if cache_key:
+            cache.set(cache_key, response)
+        return response
 
 
 class MapperTripsRoute(Resource):
@@ -85,29 +105,82 @@ class MapperTripsRoute(Resource):
 
     @jwt_required()
     def get(self, uuid):
-        survey = database.survey.get(current_identity.survey_id)
+        encoding = request.values.get('encoding', 'geojson')
+        if encoding not in MAPPER_ENCODINGS:
+            return Error(status_code=400,
+                         headers=self.headers,
+                         resource_type=self.resource_type,
+                         errors=['Unsupported encoding: {}'.format(encoding)])
+        precision = current_app.config['MAPPER_POLYLINE_PRECISION']
         start = dateutil.parser.parse(request.values.get('startTime'))
         end = dateutil.parser.parse(request.values.get('endTime'))
 
-        parameters = {
-            'break_interval_seconds': survey.trip_break_interval,
-            'cold_start_distance_meters': survey.trip_break_cold_start_distance,
-            'subway_buffer_meters': survey.trip_subway_buffer,
-            'accuracy_cutoff_meters': survey.gps_accuracy_threshold
-        }
-        gps_points = database.mobile_user.coordinates(survey, uuid, start, end)
-        trips, summaries = tripbreaker.run(parameters, survey.subway_stops, gps_points)
-
-        response = {
-            'trips': to_trips_geojson(trips, summaries) if trips else {},
-            'searchStart': start.isoformat(),
-            'searchEnd': end.isoformat()            
-        }
+        cache = database.mapper.response_cache()
+        cache_key = database.mapper.response_key('trips', current_identity.survey_id, uuid,
+                                                 start, end, encoding, precision,
+                                                 current_app.config['TRIPBREAKER_INCREMENTAL'])
+        response = cache.get(cache_key) if cache_key else None
+        if response is None:
+            response = self._trips(current_identity.survey_id, uuid, start, end, encoding, precision)
+            if cache_key:
+                cache.set(cache_key, response)
         return Success(status_code=200,
                        headers=self.headers,
                        resource_type=self.resource_type,
                        body=response)
 
+    def _trips(self, survey_id, uuid, start, end, encoding, precision):
+        survey = database.survey.get(survey_id)
+        parameters = database.survey.get_tripbreaker_parameters(survey)
+        stations = database.survey.get_station_index(survey, parameters['utm_zone'])
+        user = survey.mobile_users.filter_by(uuid=uuid).one_or_none()
+        trips, summaries = None, None
+        if user and current_app.config['TRIPBREAKER_INCREMENTAL']:
+            state = database.trips.update(user.id, parameters, stations)
+            trips, summaries = database.trips.window(state, start, end)
+        elif user:
+            gps_points = database.mobile_user.tripbreaker_coordinates(user.id, start, end,
+                                                                      min_accuracy=100)
+            trips, summaries = tripbreaker.run(parameters, stations, gps_points)
+
+        if not trips:
+            trips_result = {}
+        elif encoding == 'polyline':
+            trips_result = to_trips_polyline(trips, summaries, precision)
+        else:
+            trips_result = to_trips_geojson(trips, summaries)
+        return {
+            'trips': trips_result,
+            'searchStart': start.isoformat(),
+            'searchEnd': end.isoformat()
+        }
+
+
+class MapperTilesRoute(Resource):
+    headers = {'Location': '/itinerum/tiles/<int:z>/<int:x>/<int:y>'}
+    resource_type = 'MapperTiles'
+
+    @jwt_required()
+    @roles_accepted('admin', 'researcher')
+    def get(self, z, x, y):
+        if not valid_tile(z, x, y, current_app.config['MAPPER_TILE_MAX_ZOOM']):
+            return Error(status_code=400,
+                         headers=self.headers,
+                         resource_type=self.resource_type,
+                         errors=['Invalid map tile'])
+        survey = database.survey.get(current_identity.survey_id)
+        start = request.values.get('startTime')
+        end = request.values.get('endTime')
+        if start:
+            start = dateutil.parser.parse(start)
+        if end:
+            end = dateutil.parser.parse(end)
+
+        tile = database.mapper.density_tile(survey, z, x, y, start_time=start, end_time=end)
+        response = make_response(tile)
+        response.headers['Content-Type'] = TILE_MIMETYPE
+        return response
+
 
 class MapperSubwayStationsRoute(Resource):
     headers = {'Location': '/itinerum/tripbreaker/subway'}
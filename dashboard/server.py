@@ -115,6 +115,7 @@ def create_app(testing=False):
     api.add_resource(routes.MobileUserTableRoute, '/itinerum/users/table')
     api.add_resource(routes.MapperPointsRoute, '/itinerum/users/<string:uuid>/points')
     api.add_resource(routes.MapperTripsRoute, '/itinerum/users/<string:uuid>/trips')
+    api.add_resource(routes.MapperTilesRoute, '/itinerum/tiles/<int:z>/<int:x>/<int:y>')
     api.add_resource(routes.MapperSubwayStationsRoute, '/itinerum/tripbreaker/subway')
     # data management endpoints
     api.add_resource(routes.DataManagementExportRawDataEventsRoute, '/data/export/raw/events')
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+from collections import namedtuple
+from datetime import datetime
+from flask import Flask
+from io import BytesIO
+import os
+import pytest
+import pytz
+import time
+
+from dashboard.db.export import ExportActions
+from utils import filehandler
+
+CACHE_KEY = '0123456789abcdef'
+
+
+@pytest.fixture
+def assets_app(tmpdir):
+    app = Flask(__name__)
+    app.config.update({
+        'ASSETS_FOLDER': str(tmpdir),
+        'EXPORT_CACHE_MAX_AGE_HOURS': 1,
+        'EXPORT_CACHE_MAX_MB': 1,
+        'EXPORT_TEMP_FOLDER': None,
+        'EXPORT_ZIP_COMPRESSION': 'deflate',
+        'EXPORT_ZIP_LEVEL': 6,
+        'EXPORT_ZIP_THREADS': 1,
+        'TRIPBREAKER_INCREMENTAL': False
+    })
+    tmpdir.mkdir('exports')
+    with app.app_context():
+        yield app
+
+
+def _save(basename, cache_key=None, size=10):
+    return filehandler.save_zip('exports', basename, {'a.csv': BytesIO(os.urandom(size))},
+                                cache_key=cache_key)
+
+
+def test_cached_zip_is_found_by_key(assets_app):
+    assert filehandler.find_cached_zip('exports', CACHE_KEY) is None
+    zip_filename = _save('survey', cache_key=CACHE_KEY)
+    assert filehandler.is_cached_zip(zip_filename)
+    assert not filehandler.is_cached_zip(_save('survey'))
+    assert filehandler.find_cached_zip('exports', CACHE_KEY) == zip_filename
+    assert filehandler.find_cached_zip('exports', 'fedcba9876543210') is None
+
+
+def test_cached_zips_are_evicted_by_age_and_size(assets_app):
+    folder = os.path.join(assets_app.config['ASSETS_FOLDER'], 'exports')
+    stale = _save('stale', cache_key='1' * 16)
+    os.utime(os.path.join(folder, stale), (time.time() - 7200, time.time() - 7200))
+    uncached = _save('uncached')
+    old = _save('old', cache_key='2' * 16, size=600 * 1024)
+    os.utime(os.path.join(folder, old), (time.time() - 60, time.time() - 60))
+    new = _save('new', cache_key='3' * 16, size=600 * 1024)
+
+    assert sorted(filehandler.evict_cached_zips('exports', keep=new)) == sorted([stale, old])
+    assert sorted(os.listdir(folder)) == sorted([uncached, new])
+
+
+def test_trips_cache_key_follows_incremental_mode(assets_app, monkeypatch):
+    actions = ExportActions()
+    monkeypatch.setattr(actions.survey, 'get_data_watermark', lambda *args: [10, 200, 0, None])
+    monkeypatch.setattr(actions.survey, 'get_tripbreaker_parameters', lambda survey: {'utm_zone': 18})
+    survey = namedtuple('Survey', ['id'])(1)
+    start = datetime(2018, 1, 1, tzinfo=pytz.utc)
+    end = datetime(2018, 2, 1, tzinfo=pytz.utc)
+
+    keys = {}
+    for incremental in (False, True):
+        assets_app.config['TRIPBREAKER_INCREMENTAL'] = incremental
+        keys[incremental] = {export_type: actions.cache_key(export_type, survey, start, end, 'UTC')
+                             for export_type in ('raw', 'trips')}
+    assert keys[False]['raw'] == keys[True]['raw']
+    assert keys[False]['trips'] != keys[True]['trips']
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+import codecs
+from datetime import datetime, timedelta
+from decimal import Decimal
+import os
+import pyarrow.parquet as pq
+import pytz
+import tempfile
+import time
+
+from models import MobileCoordinate
+from utils import columnar
+from utils.export_chunks import ChunkStore, chunk_windows, concatenate_csv
+
+
+def test_chunk_windows_cover_range_without_overlap():
+    start = datetime(2018, 1, 3, 12, tzinfo=pytz.utc)
+    end = datetime(2018, 1, 20, tzinfo=pytz.utc)
+    windows = chunk_windows(start, end, days=7)
+    assert windows[0][0] == start and windows[-1][1] == end
+    for (_, prev_end), (next_start, _) in zip(windows, windows[1:]):
+        assert next_start - prev_end == timedelta(microseconds=1)
+    # chunk edges fall on the same days for any window
+    assert windows[1][0] in [w[0] for w in chunk_windows(start - timedelta(days=30), end, days=7)]
+    assert chunk_windows(start, end, days=0) == [(start, end)]
+
+
+def test_chunks_are_claimed_once_until_stale(tmpdir):
+    store = ChunkStore(str(tmpdir.join('chunks')), lock_seconds=60)
+    assert store.find('a', '.csv') is None
+    assert store.claim('a')
+    assert not store.claim('a')
+
+    chunk_f = store.open('a', '.csv')
+    chunk_f.write('id\n1\n')
+    path = store.finish(chunk_f, 'a', '.csv')
+    assert store.find('a', '.csv') == path
+    assert store.claim('a')
+
+    lock_path = store.path('a', '.lock')
+    os.utime(lock_path, (time.time() - 120, time.time() - 120))
+    assert store.claim('a')
+
+    store.release(store.open('b', '.csv'), 'b')
+    assert sorted(os.listdir(store.folder)) == ['a.csv', 'a.lock']
+
+
+def test_chunk_eviction_keeps_recent_chunks(tmpdir):
+    store = ChunkStore(str(tmpdir), lock_seconds=60)
+    for key, age in (('old', 7200), ('recent', 0)):
+        chunk_f = store.open(key, '.csv')
+        chunk_f.write('x' * 1024)
+        path = store.finish(chunk_f, key, '.csv')
+        os.utime(path, (time.time() - age, time.time() - age))
+    assert store.evict(max_age=3600, max_bytes=0) == ['old.csv']
+    assert os.listdir(store.folder) == ['recent.csv']
+
+
+def test_chunks_are_concatenated_with_one_header(tmpdir):
+    paths = []
+    for idx, rows in enumerate([['1,a', '2,b'], [], ['3,c']]):
+        path = str(tmpdir.join('{}.csv'.format(idx)))
+        with open(path, 'wb') as chunk_f:
+            chunk_f.write(codecs.BOM_UTF8 + 'id,uuid\n' + ''.join(r + '\n' for r in rows))
+        paths.append(path)
+    with tempfile.TemporaryFile() as sheet_f:
+        concatenate_csv(paths, sheet_f)
+        sheet_f.seek(0)
+        assert sheet_f.read() == codecs.BOM_UTF8 + 'id,uuid\n1,a\n2,b\n3,c\n'
+
+
+def test_parquet_chunks_keep_their_types(tmpdir):
+    fields = [columnar.arrow_field(MobileCoordinate.latitude), columnar.arrow_field(MobileCoordinate.timestamp)]
+    paths = []
+    for idx, rows in enumerate([[(Decimal('45.5'), datetime(2018, 1, 1))], []]):
+        path = str(tmpdir.join('{}.parquet'.format(idx)))
+        with open(path, 'wb') as chunk_f:
+            columnar.write_parquet(chunk_f, fields, [rows], row_group_rows=10)
+        paths.append(path)
+    with tempfile.NamedTemporaryFile(suffix='.parquet') as sheet_f:
+        columnar.concatenate_parquet(paths[::-1], sheet_f)
+        sheet_f.flush()
+        table = pq.read_table(sheet_f.name)
+    assert [f.type for f in table.schema] == [f.type for f in fields]
+    assert table.num_rows == 1
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+from datetime import datetime
+from decimal import Decimal
+import pyarrow as pa
+import pyarrow.parquet as pq
+import tempfile
+
+from models import MobileCoordinate
+from utils import columnar
+
+
+def test_coordinate_columns_keep_their_types():
+    fields = {c.name: columnar.arrow_field(c).type for c in MobileCoordinate.__table__.columns}
+    assert fields['latitude'] == pa.decimal128(10, 7)
+    assert fields['h_accuracy'] == pa.float64()
+    assert fields['timestamp'] == pa.timestamp('us', tz='UTC')
+    assert fields['mode_detected'] == pa.int32()
+
+
+def test_parquet_sheet_is_written_in_row_groups():
+    columns = [MobileCoordinate.latitude, MobileCoordinate.h_accuracy, MobileCoordinate.timestamp]
+    fields = [columnar.arrow_field(c) for c in columns]
+    batches = [[(Decimal('45.5012345'), 5.0, datetime(2018, 1, 1, 12))] * 3,
+               [(None, None, None)] * 2,
+               [(Decimal('-73.5'), 10.5, datetime(2018, 1, 2))] * 4]
+    with tempfile.NamedTemporaryFile(suffix='.parquet') as sheet_f:
+        columnar.write_parquet(sheet_f, fields, batches, row_group_rows=5)
+        sheet_f.flush()
+        parquet_f = pq.ParquetFile(sheet_f.name)
+        assert parquet_f.num_row_groups == 2
+        table = parquet_f.read().to_pydict()
+    assert table['latitude'][0] == Decimal('45.5012345')
+    assert table['latitude'][3] is None
+    assert table['timestamp'][-1].isoformat() == '2018-01-02T00:00:00+00:00'
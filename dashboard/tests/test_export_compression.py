@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+import pytest
+import zipfile
+
+from utils import compression
+from utils.compression import ZipEntryFile, write_zip_entry
+
+
+def _sheet_rows(num_rows):
+    return ['{},45.{:07d},-73.{:07d}\n'.format(i, i * 7919 % 10000000, i * 104729 % 10000000)
+            for i in range(num_rows)]
+
+
+def test_zip_entries_round_trip(tmpdir, monkeypatch):
+    monkeypatch.setattr(compression, 'PARALLEL_BLOCK_SIZE', 4096)
+    rows = _sheet_rows(5000)
+    zip_path = str(tmpdir.join('export.zip'))
+    entries = {
+        'deflate.csv': ZipEntryFile(zipfile.ZIP_DEFLATED, level=6),
+        'parallel.csv': ZipEntryFile(zipfile.ZIP_DEFLATED, level=6, threads=3),
+        'stored.csv': ZipEntryFile(zipfile.ZIP_STORED)
+    }
+    with zipfile.ZipFile(zip_path, 'w', allowZip64=True) as zip_f:
+        for arcname, entry in sorted(entries.items()):
+            for row in rows:
+                entry.write(row)
+            assert entry.tell() == len(''.join(rows))
+            write_zip_entry(zip_f, arcname, entry)
+            entry.close()
+
+    with zipfile.ZipFile(zip_path) as zip_f:
+        assert zip_f.testzip() is None
+        for arcname in entries:
+            assert zip_f.read(arcname) == ''.join(rows)
+        assert zip_f.getinfo('parallel.csv').compress_size < zip_f.getinfo('stored.csv').compress_size
+
+
+@pytest.mark.parametrize('copy_compressed', [True, False])
+def test_zip64_entries_round_trip(tmpdir, monkeypatch, copy_compressed):
+    # entries above a lowered ZIP64 limit are written with the ZIP64 extensions as
+    # they would be above the 4GB limit
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 1000)
+    monkeypatch.setattr(compression, 'COPY_COMPRESSED', copy_compressed and compression.COPY_COMPRESSED)
+    rows = _sheet_rows(500)
+    zip_path = str(tmpdir.join('export.zip'))
+    with zipfile.ZipFile(zip_path, 'w', allowZip64=True) as zip_f:
+        for arcname, compress_type in (('deflate.csv', zipfile.ZIP_DEFLATED),
+                                       ('stored.csv', zipfile.ZIP_STORED)):
+            entry = ZipEntryFile(compress_type, level=6)
+            for row in rows:
+                entry.write(row)
+            write_zip_entry(zip_f, arcname, entry)
+            entry.close()
+
+    with zipfile.ZipFile(zip_path) as zip_f:
+        assert zip_f.testzip() is None
+        for info in zip_f.infolist():
+            assert info.file_size > zipfile.ZIP64_LIMIT
+            assert info.extract_version >= 45
+            assert zip_f.read(info.filename) == ''.join(rows)
+
+
+def test_zip64_entries_require_allow_zip64(tmpdir, monkeypatch):
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', 1000)
+    entry = ZipEntryFile(zipfile.ZIP_STORED)
+    entry.write('x' * 2000)
+    with zipfile.ZipFile(str(tmpdir.join('export.zip')), 'w', allowZip64=False) as zip_f:
+        with pytest.raises(zipfile.LargeZipFile):
+            write_zip_entry(zip_f, 'stored.csv', entry)
+    entry.close()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+#
+# Export sheets written from PostgreSQL compared with rows formatted as the original
+# per-row Python exporter did
+import codecs
+from datetime import datetime, timedelta
+from decimal import Decimal
+from flask import current_app
+from io import BytesIO
+import os
+import postgres_copy
+import pytest
+import pytz
+import unicodecsv as csv
+import zipfile
+
+from dashboard.db.export import ExportActions, ExportFormatters, _sql_response
+from dashboard.db.survey import SurveyActions
+from dashboard.server import create_app
+from models import (db as _db, CancelledPromptResponse, MobileCoordinate, MobileUser,
+                    PromptResponse, Survey, SurveyQuestion, SurveyResponse)
+from utils import filehandler
+
+START = datetime(2018, 3, 1, tzinfo=pytz.utc)
+END = datetime(2018, 3, 4, tzinfo=pytz.utc)
+
+
+## Testing setup & teardown fixtures ==========================================
+@pytest.fixture(scope='module')
+def app():
+    app = create_app(testing=True)
+    ctx = app.app_context()
+    ctx.push()
+    _db.create_all()
+    yield app
+    _db.session.remove()
+    _db.drop_all()
+    ctx.pop()
+
+
+# the export sheets written with COPY read from their own connections, so the
+# survey's rows are committed and only removed with the tables
+@pytest.fixture(scope='module')
+def survey(app):
+    survey = Survey(name='export-sheets')
+    other_survey = Survey(name='export-sheets-other')
+    _db.session.add_all([survey, other_survey])
+    _db.session.flush()
+    for num, (question_type, label) in enumerate([(105, 'location_home'), (1, 'gender'),
+                                                  (2, 'travel_mode')]):
+        _db.session.add(SurveyQuestion(survey_id=survey.id, question_num=num,
+                                       question_type=question_type, question_label=label))
+
+    # the first two users have coordinates within the export window, the third only
+    # before it and the fourth belongs to another survey
+    active = add_user(survey, 1, [START + timedelta(hours=2, microseconds=500000),
+                                  START + timedelta(days=2)])
+    no_response = add_user(survey, 2, [START + timedelta(days=1)])
+    inactive = add_user(survey, 3, [START - timedelta(days=30)])
+    other = add_user(other_survey, 4, [START + timedelta(hours=1)])
+
+    add_survey_response(active, {'location_home': {'latitude': 45.5017, 'longitude': -73.5673},
+                                 'gender': u'Non-binary',
+                                 'travel_mode': [u'Walk', u' Bus ', u'Métro']})
+    add_survey_response(inactive, {'gender': u'Female', 'travel_mode': [u'Car']})
+    add_survey_response(other, {'gender': u'Male'})
+
+    # prompts are displayed within the window for every user, and outside of it for
+    # the first
+    in_window = START + timedelta(hours=3, minutes=15, seconds=30, microseconds=999999)
+    for user in (active, no_response, inactive, other):
+        add_prompt(user, 1, [u'Home ', u'\xa0Work'], in_window)
+        add_prompt(user, 2, u'Shopping', in_window + timedelta(days=1))
+        add_cancelled_prompt(user, in_window, in_window + timedelta(minutes=5), True)
+        add_cancelled_prompt(user, in_window + timedelta(days=1), None, None)
+    add_prompt(active, 3, [u'Other'], END + timedelta(seconds=1))
+    add_cancelled_prompt(active, START - timedelta(seconds=1), START, False)
+    _db.session.commit()
+    return survey
+
+
+# the window's three days are written as daily chunks by two sheet threads and
+# joined within the export archive
+@pytest.fixture
+def export_folder(app, tmpdir, monkeypatch):
+    monkeypatch.setitem(app.config, 'ASSETS_FOLDER', str(tmpdir))
+    monkeypatch.setitem(app.config, 'EXPORT_TEMP_FOLDER', str(tmpdir))
+    monkeypatch.setitem(app.config, 'EXPORT_SHEET_THREADS', 2)
+    monkeypatch.setitem(app.config, 'EXPORT_CHUNK_DAYS', 1)
+    tmpdir.mkdir('exports')
+    return tmpdir
+
+
+## Test helpers ================================================================
+def user_uuid(num):
+    return '00000000-0000-0000-0000-{:012d}'.format(num)
+
+
+def add_user(survey, num, timestamps):
+    user = MobileUser(survey_id=survey.id, uuid=user_uuid(num),
+                      model='Pixel', itinerum_version='99', os='android', os_version='8.1',
+                      created_at=START - timedelta(days=60, microseconds=250000),
+                      modified_at=START - timedelta(days=59))
+    _db.session.add(user)
+    _db.session.flush()
+    add_user_coordinates(user, timestamps)
+    return user
+
+
+def add_user_coordinates(user, timestamps):
+    for timestamp in timestamps:
+        _db.session.add(MobileCoordinate(survey_id=user.survey_id, mobile_id=user.id,
+                                         latitude=Decimal('45.5017000'),
+                                         longitude=Decimal('-73.5673000'),
+                                         h_accuracy=10., v_accuracy=10., timestamp=timestamp))
+
+
+def add_survey_response(user, response):
+    _db.session.add(SurveyResponse(survey_id=user.survey_id, mobile_id=user.id, response=response))
+
+
+def add_prompt(user, prompt_num, response, displayed_at):
+    _db.session.add(PromptResponse(survey_id=user.survey_id, mobile_id=user.id,
+                                   prompt_uuid=user_uuid(user.id * 100 + prompt_num),
+                                   prompt_num=prompt_num, response=response,
+                                   displayed_at=displayed_at,
+                                   recorded_at=displayed_at + timedelta(seconds=30),
+                                   edited_at=displayed_at + timedelta(minutes=1, microseconds=1),
+                                   latitude=Decimal('45.5017'), longitude=Decimal('-73.5673')))
+
+
+def add_cancelled_prompt(user, displayed_at, cancelled_at, is_travelling):
+    _db.session.add(CancelledPromptResponse(survey_id=user.survey_id, mobile_id=user.id,
+                                            prompt_uuid=user_uuid(user.id * 1000 + displayed_at.day),
+                                            latitude=Decimal('45.5017'),
+                                            longitude=Decimal('-73.5673'),
+                                            displayed_at=displayed_at, cancelled_at=cancelled_at,
+                                            is_travelling=is_travelling))
+
+
+def export_sheets(survey):
+    sheets = ExportActions().survey_data(survey, START, END, 'UTC')
+    zip_filename = filehandler.save_zip('exports', 'survey', sheets)
+    zip_filepath = os.path.join(current_app.config['ASSETS_FOLDER'], 'exports', zip_filename)
+    with zipfile.ZipFile(zip_filepath) as zip_f:
+        return {name: read_sheet(BytesIO(zip_f.read(name))) for name in zip_f.namelist()}
+
+
+def read_sheet(sheet_f):
+    sheet_f.seek(0)
+    data = sheet_f.read()
+    assert data.startswith(codecs.BOM_UTF8)
+    return list(csv.reader(BytesIO(data[len(codecs.BOM_UTF8):]), encoding='utf-8'))
+
+
+def write_rows(rows):
+    rows_f = BytesIO()
+    rows_f.write(codecs.BOM_UTF8)
+    csv.writer(rows_f).writerows(rows)
+    return read_sheet(rows_f)
+
+
+## Original exporter formatting ================================================
+def baseline_utc_timestamp(timestamp):
+    return timestamp.replace(microsecond=0).astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def baseline_epoch_timestamp(timestamp):
+    epoch = datetime(1970, 1, 1, tzinfo=pytz.utc)
+    return int((timestamp.astimezone(pytz.utc) - epoch).total_seconds())
+
+
+def baseline_response(value):
+    if isinstance(value, list):
+        value = '; '.join([v.strip() for v in value])
+    return value
+
+
+def baseline_survey_responses(survey, start, end):
+    location_columns = {}
+    install_columns = []
+    for c in MobileUser.__table__.columns:
+        if c.name == 'survey_id':
+            continue
+        if c.type.python_type == datetime:
+            install_columns += [c.name + '_UTC', c.name + '_epoch']
+        else:
+            install_columns.append(c.name)
+    json_columns = []
+    for q in survey.survey_questions.order_by('question_num'):
+        if q.question_type in [4, 105, 106, 107]:
+            location_columns[q.question_label + '_lat'] = q.question_label
+            location_columns[q.question_label + '_lon'] = q.question_label
+            json_columns += [q.question_label + '_lat', q.question_label + '_lon']
+        else:
+            json_columns.append(q.question_label)
+
+    rows = [install_columns + json_columns]
+    for user in SurveyActions().get_active_users(survey, start, end):
+        values = {}
+        for column in ('created_at', 'modified_at'):
+            values[column + '_UTC'] = baseline_utc_timestamp(getattr(user, column))
+            values[column + '_epoch'] = baseline_epoch_timestamp(getattr(user, column))
+        row = [values[col] if col in values else getattr(user, col) for col in install_columns]
+        survey_response = user.survey_response.one_or_none()
+        if survey_response:
+            for col in json_columns:
+                if col in location_columns:
+                    location = survey_response.response.get(location_columns[col])
+                    if location:
+                        row.append(location['latitude' if col.endswith('_lat') else 'longitude'])
+                    else:
+                        row.append('')
+                elif col in survey_response.response:
+                    response = survey_response.response[col]
+                    if isinstance(response, list):
+                        response = '; '.join(response)
+                    row.append(response)
+                else:
+                    row.append('')
+        rows.append(row)
+    return write_rows(rows)
+
+
+def baseline_coordinates(survey, start, end):
+    active_mobile_ids = [u.id for u in SurveyActions().get_active_users(survey, start, end)]
+    timestamp = MobileCoordinate.timestamp
+    coordinates = (_db.session.query(MobileUser, MobileCoordinate,
+                                     _db.func.timezone('UTC', timestamp).label('timestamp_UTC'),
+                                     _db.func.extract('epoch', timestamp).cast(_db.Integer)
+                                                                         .label('timestamp_epoch'))
+                              .join(MobileCoordinate)
+                              .filter(MobileCoordinate.mobile_id.in_(active_mobile_ids),
+                                      timestamp >= start,
+                                      timestamp <= end)
+                              .options(_db.Load(MobileUser).defer('id').load_only('uuid'),
+                                       _db.Load(MobileCoordinate).defer('mobile_id')
+                                                                 .defer('survey_id')
+                                                                 .defer('timestamp'))
+                              .order_by(MobileCoordinate.id))
+    coordinates_f = BytesIO()
+    coordinates_f.write(codecs.BOM_UTF8)
+    postgres_copy.copy_to(coordinates, coordinates_f, _db.engine, format='csv', header=True)
+    return read_sheet(coordinates_f)
+
+
+def baseline_prompts(table, survey, start, end):
+    active_mobile_ids = [u.id for u in SurveyActions().get_active_users(survey, start, end)]
+    prompts = (_db.session.query(MobileUser, table)
+                          .join(table)
+                          .filter(table.mobile_id.in_(active_mobile_ids),
+                                  table.displayed_at >= start,
+                                  table.displayed_at <= end)
+                          .order_by(table.id))
+    columns = []
+    timestamp_columns = []
+    for c in table.__table__.columns:
+        if c.name in ['survey_id', 'mobile_id']:
+            continue
+        if c.type.python_type == datetime:
+            columns += [c.name + '_UTC', c.name + '_epoch']
+            timestamp_columns.append(c.name)
+        else:
+            columns.append(c.name)
+
+    headers = list(columns)
+    headers.insert(1, 'uuid')
+    rows = [headers]
+    for user, prompt in prompts:
+        values = {}
+        for column in timestamp_columns:
+            timestamp = getattr(prompt, column)
+            values[column + '_UTC'] = baseline_utc_timestamp(timestamp) if timestamp else None
+            values[column + '_epoch'] = baseline_epoch_timestamp(timestamp) if timestamp else None
+        row = []
+        for col in columns:
+            # make uuid second column value
+            if len(row) == 1:
+                row.append(user.uuid)
+            row.append(baseline_response(values[col] if col in values else getattr(prompt, col)))
+        rows.append(row)
+    return write_rows(rows)
+
+
+## Tests =======================================================================
+def test_survey_responses_sheet_matches_baseline(survey):
+    active_user_ids = SurveyActions().get_active_user_ids(survey, START, END)
+    sheet = ExportFormatters.survey_responses_csv(BytesIO(), survey, active_user_ids, pytz.utc)
+    rows = read_sheet(sheet)
+    assert rows == baseline_survey_responses(survey, START, END)
+    # only the survey's users with coordinates within the window are written
+    uuid = rows[0].index('uuid')
+    assert [row[uuid] for row in rows[1:]] == [user_uuid(1), user_uuid(2)]
+
+
+def test_sql_responses_match_baseline(survey):
+    responses = [u'Home', u' kept as entered\t', u'say "hi", ok', u'',
+                 [u'Walk', u' Bus\t', u'\xa0M\xe9tro\u2028', u'\u3000Bike\r\n'], [u'Other'], [],
+                 3, -12, 2.5, -0.125, True, False, None]
+    user = add_user(survey, 10, [])
+    for num, response in enumerate(responses):
+        _db.session.add(PromptResponse(survey_id=survey.id, mobile_id=user.id,
+                                       prompt_uuid=user_uuid(100 + num), prompt_num=num,
+                                       response=response, displayed_at=START))
+    _db.session.commit()
+
+    query = (_db.session.query(PromptResponse.prompt_num, _sql_response(PromptResponse.response))
+                        .filter(PromptResponse.mobile_id == user.id)
+                        .order_by(PromptResponse.id))
+    sheet_f = BytesIO()
+    sheet_f.write(codecs.BOM_UTF8)
+    postgres_copy.copy_to(query, sheet_f, _db.engine, format='csv')
+    expected = write_rows([[num, baseline_response(r)] for num, r in enumerate(responses)])
+    assert read_sheet(sheet_f) == expected
+
+
+@pytest.mark.parametrize('table, formatter', [
+    (PromptResponse, ExportFormatters.prompts_csv),
+    (CancelledPromptResponse, ExportFormatters.cancelled_prompts_csv)
+])
+def test_prompt_sheets_match_baseline(survey, table, formatter):
+    active_user_ids = SurveyActions().get_active_user_ids(survey, START, END)
+    sheet = formatter(BytesIO(), survey, active_user_ids, START, END)
+    rows = read_sheet(sheet)
+    assert rows == baseline_prompts(table, survey, START, END)
+    # prompts displayed within the window by users without coordinates within it, or
+    # of another survey, are left out
+    uuid = rows[0].index('uuid')
+    assert sorted(set(row[uuid] for row in rows[1:])) == [user_uuid(1), user_uuid(2)]
+    assert len(rows) == 5
+
+
+def test_active_user_ids_are_fetched(survey):
+    survey_actions = SurveyActions()
+    assert survey_actions.get_active_user_ids(survey, START, END) == [
+        user.id for user in survey_actions.get_active_users(survey, START, END)]
+    # the empty list is bound as an empty array
+    empty_start = START - timedelta(days=10)
+    assert survey_actions.get_active_user_ids(survey, empty_start, empty_start) == []
+    sheet = ExportFormatters.prompts_csv(BytesIO(), survey, [], START, END)
+    assert len(read_sheet(sheet)) == 1
+
+
+
+def test_threaded_export_sheets_match_baseline(survey, export_folder):
+    rows = export_sheets(survey)
+    expected = {
+        'survey_responses.csv': baseline_survey_responses(survey, START, END),
+        'coordinates.csv': baseline_coordinates(survey, START, END),
+        'prompt_responses.csv': baseline_prompts(PromptResponse, survey, START, END),
+        'cancelled_prompts.csv': baseline_prompts(CancelledPromptResponse, survey, START, END)
+    }
+    assert sorted(rows) == sorted(expected)
+    # rows are ordered by id within each chunk rather than across the whole window
+    for name, sheet_rows in rows.items():
+        assert sheet_rows[0] == expected[name][0]
+        assert sorted(sheet_rows[1:]) == sorted(expected[name][1:])
+    assert len(rows['coordinates.csv']) == 4
+
+
+def test_cache_key_follows_edited_rows(survey):
+    export_actions = ExportActions()
+    user = MobileUser.query.filter_by(uuid=user_uuid(1)).one()
+    key = export_actions.cache_key('raw', survey, START, END, 'UTC')
+    assert export_actions.cache_key('raw', survey, START, END, 'UTC') == key
+
+    # a prompt answered again within the window keeps the table's count and ids
+    prompt = user.prompt_responses.filter_by(prompt_num=1).one()
+    prompt.response = [u'Home', u'Gym']
+    prompt.edited_at = datetime.now(pytz.utc)
+    _db.session.commit()
+    edited_key = export_actions.cache_key('raw', survey, START, END, 'UTC')
+    assert edited_key != key
+
+    # survey responses are edited without a timestamp
+    survey_response = user.survey_response.one()
+    survey_response.response = dict(survey_response.response, gender=u'Female')
+    _db.session.commit()
+    assert export_actions.cache_key('raw', survey, START, END, 'UTC') != edited_key
+
+
+def test_export_chunks_follow_edits_and_active_users(survey, export_folder):
+    chunks_folder = export_folder.join('itinerum-export-chunks')
+    export_sheets(survey)
+    chunks = set(chunks_folder.listdir())
+
+    # only the chunk of the day the prompt was displayed on is written again
+    user = MobileUser.query.filter_by(uuid=user_uuid(2)).one()
+    prompt = user.prompt_responses.filter_by(prompt_num=2).one()
+    prompt.response = u'Restaurant'
+    prompt.edited_at = datetime.now(pytz.utc)
+    _db.session.commit()
+    rows = export_sheets(survey)
+    assert len(set(chunks_folder.listdir()) - chunks) == 1
+    assert [u'Restaurant'] == [row[4] for row in rows['prompt_responses.csv']
+                               if row[1] == user_uuid(2) and row[3] == u'2']
+    chunks = set(chunks_folder.listdir())
+
+    # a newer coordinate of an active user only changes its day's coordinates chunk
+    add_user_coordinates(user, [START + timedelta(days=1, hours=1)])
+    _db.session.commit()
+    export_sheets(survey)
+    assert len(set(chunks_folder.listdir()) - chunks) == 1
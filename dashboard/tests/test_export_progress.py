@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+import tempfile
+
+from utils.progress import ExportProgress
+
+
+def test_progress_events_are_throttled_by_rows():
+    events = []
+    progress = ExportProgress(events.append, 'trips-export-progress', 1, total_users=10,
+                              every_rows=100, every_seconds=3600)
+    with tempfile.TemporaryFile() as sheet_f:
+        sheet = progress.sheet('trips.csv', sheet_f)
+        for _ in range(10):
+            sheet_f.write('x' * 50)
+            sheet.add_rows(50, users=1)
+        assert len(events) == 5
+        assert events[-1]['rows'] == 500 and events[-1]['users'] == 10
+        assert events[-1]['bytes'] == 500
+
+        sheet.finish()
+    assert len(events) == 6
+    assert events[-1]['sheets_finished'] == 1 and events[-1]['remaining_seconds'] == 0
+
+
+def test_copy_writer_counts_rows_after_header():
+    events = []
+    progress = ExportProgress(events.append, 'raw-export-progress', 4, every_rows=2, every_seconds=3600)
+    with tempfile.TemporaryFile() as sheet_f:
+        sheet = progress.sheet('coordinates.csv', sheet_f)
+        writer = sheet.writer(header=True)
+        for line in ['id,uuid\n', '1,a\n', '2,b\n', '3,c\n']:
+            writer.write(line)
+        sheet_f.seek(0)
+        assert sheet_f.read() == 'id,uuid\n1,a\n2,b\n3,c\n'
+    assert sheet.rows == 3
+    assert [e['rows'] for e in events] == [2]
+    assert events[0]['remaining_seconds'] is None
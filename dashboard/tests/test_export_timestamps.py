@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+from datetime import datetime, timedelta
+import pytz
+
+from utils.timestamps import epoch_timestamp, naive_utc, utc_timestamp
+
+
+def _reference_utc(timestamp):
+    return timestamp.replace(microsecond=0).astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _reference_epoch(timestamp):
+    epoch = datetime(1970, 1, 1, tzinfo=pytz.utc)
+    return int((timestamp.astimezone(pytz.utc) - epoch).total_seconds())
+
+
+def test_formatting_matches_datetime_conversions():
+    timestamps = []
+    for zone in ['UTC', 'America/Montreal', 'Asia/Kolkata', 'Pacific/Chatham']:
+        tz = pytz.timezone(zone)
+        for naive in [datetime(2018, 3, 11, 6, 59, 59, 999999), datetime(2018, 11, 4, 5, 30, 0, 1),
+                      datetime(2017, 12, 31, 23, 59, 59), datetime(1969, 12, 31, 23, 59, 59, 500000),
+                      datetime(1970, 1, 1, 0, 0, 0, 250000)]:
+            timestamps.append(pytz.utc.localize(naive).astimezone(tz))
+            timestamps.append(tz.localize(naive + timedelta(hours=7, microseconds=3)))
+
+    for timestamp in timestamps:
+        assert utc_timestamp(timestamp) == _reference_utc(timestamp)
+        assert epoch_timestamp(timestamp) == _reference_epoch(timestamp)
+        assert naive_utc(timestamp) == timestamp.astimezone(pytz.utc).replace(tzinfo=None)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+from datetime import datetime
+import pytest
+import pytz
+
+from dashboard.db import export
+from dashboard.tests.test_tripbreaker_engines import PARAMETERS, STATIONS, generate_trace
+from utils.tripbreaker import algorithm as tripbreaker
+
+HEADERS = ['uuid', 'trip', 'latitude', 'longitude', 'h_accuracy', 'timestamp_UTC',
+           'timestamp_epoch', 'trip_distance', 'distance', 'break_period', 'trip_code']
+
+
+class RecordingDatabase(object):
+    '''Stands in for the database handle around the worker pool, recording the
+       calls that release connections before the workers are forked'''
+    def __init__(self):
+        self.calls = []
+        self.session = self
+        self.engine = self
+
+    def commit(self):
+        self.calls.append('commit')
+
+    def dispose(self):
+        self.calls.append('dispose')
+
+    def remove(self):
+        self.calls.append('remove')
+
+
+@pytest.fixture
+def trips_export(monkeypatch):
+    # each user's coordinates are a generated trace seeded by their id; the forked
+    # workers inherit the patched query
+    def tripbreaker_coordinates(mobile_id, start_time=None, end_time=None, **kwargs):
+        return generate_trace(mobile_id, n=500)
+
+    database = RecordingDatabase()
+    monkeypatch.setattr(export.MobileUserActions, 'tripbreaker_coordinates',
+                        staticmethod(tripbreaker_coordinates))
+    monkeypatch.setattr(export, 'db', database)
+    yield database
+
+
+def test_pooled_trip_rows_match_serial_rows(trips_export):
+    parameters = dict(PARAMETERS, utm_zone=18)
+    stations = tripbreaker.station_index(STATIONS, zone_number=18)
+    start = datetime(2018, 1, 1, tzinfo=pytz.utc)
+    end = datetime(2019, 1, 1, tzinfo=pytz.utc)
+    users = [(user_id, 'uuid-{}'.format(user_id)) for user_id in range(1, 8)]
+
+    serial = [export._user_trip_rows(user, parameters, stations, start, end, HEADERS)
+              for user in users]
+    pooled = list(export._parallel_user_trip_rows(users, 3, parameters, stations,
+                                                  start, end, HEADERS, False))
+    assert pooled == serial
+    assert all(serial)
+    # the parent ends its transaction and closes its connections before forking
+    assert trips_export.calls[:2] == ['commit', 'dispose']
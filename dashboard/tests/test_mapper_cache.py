@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+from datetime import datetime, timedelta
+from decimal import Decimal
+import pytest
+import pytz
+import time
+
+from dashboard.db.mapper import MapperActions
+from dashboard.server import create_app
+from models import db as _db, MobileCoordinate, MobileUser, Survey
+from utils.response_cache import ResponseCache, cache_key
+
+
+## Testing setup & teardown fixtures ==========================================
+@pytest.fixture(scope='module')
+def app():
+    app = create_app(testing=True)
+    ctx = app.app_context()
+    ctx.push()
+    _db.create_all()
+    yield app
+    _db.session.remove()
+    _db.drop_all()
+    ctx.pop()
+
+
+@pytest.fixture
+def session(app, monkeypatch):
+    connection = _db.engine.connect()
+    transaction = connection.begin()
+    session = _db.create_scoped_session(options=dict(bind=connection, binds={}))
+    monkeypatch.setattr(_db, 'session', session)
+    yield session
+    session.remove()
+    transaction.rollback()
+    connection.close()
+
+
+## Tests =======================================================================
+
+
+def test_cache_key_changes_with_version():
+    window = (datetime(2018, 3, 1), datetime(2018, 3, 1, 23, 59, 59))
+    key = cache_key('points', 1, 'uuid', (3, datetime(2018, 3, 2, 8)), window)
+    assert key == cache_key('points', 1, 'uuid', (3, datetime(2018, 3, 2, 8)), window)
+    assert key != cache_key('points', 1, 'uuid', (3, datetime(2018, 3, 2, 9)), window)
+    assert key != cache_key('trips', 1, 'uuid', (3, datetime(2018, 3, 2, 8)), window)
+
+
+def test_local_entries_are_evicted_and_expire(monkeypatch):
+    cache = ResponseCache(local_size=2, ttl=60)
+    cache.set('a', {'points': 1})
+    cache.set('b', {'points': 2})
+    assert cache.get('a') == {'points': 1}
+    cache.set('c', {'points': 3})
+    # 'b' was the least recently used
+    assert cache.get('b') is None and cache.get('a') == {'points': 1}
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert cache.get('a') is None
+    assert ResponseCache(local_size=0).get('a') is None
+
+
+def test_unreachable_redis_is_skipped():
+    cache = ResponseCache(local_size=4, redis_url='redis://127.0.0.1:1/2')
+    cache.set('a', {'trips': []})
+    assert cache.get('a') == {'trips': []}
+    assert cache.get('b') is None
+
+
+def test_response_key_follows_late_coordinates(session):
+    survey = Survey(name='mapper-cache')
+    session.add(survey)
+    session.flush()
+    user = MobileUser(survey_id=survey.id, uuid='00000000-0000-0000-0000-000000000001')
+    session.add(user)
+    session.flush()
+    latest = datetime(2018, 3, 2, 8, tzinfo=pytz.utc)
+    for timestamp in (latest - timedelta(hours=1), latest):
+        session.add(MobileCoordinate(survey_id=survey.id, mobile_id=user.id, timestamp=timestamp,
+                                     latitude=Decimal('45.5017'), longitude=Decimal('-73.5673')))
+    session.commit()
+
+    mapper = MapperActions()
+    key = mapper.response_key('points', survey.id, user.uuid)
+    assert key == mapper.response_key('points', survey.id, user.uuid)
+
+    # a point uploaded late is older than the user's latest coordinate
+    session.add(MobileCoordinate(survey_id=survey.id, mobile_id=user.id,
+                                 timestamp=latest - timedelta(minutes=30),
+                                 latitude=Decimal('45.5020'), longitude=Decimal('-73.5670')))
+    session.commit()
+    assert mapper.response_key('points', survey.id, user.uuid) != key
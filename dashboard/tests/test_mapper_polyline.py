@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+import msgpack
+import numpy as np
+
+from utils.fake_data import generate_gps_trace
+from utils.geo import to_points_geojson, to_simplified_points_geojson, to_simplified_points_polyline
+from utils.polyline import decode_coordinates, decode_integers, encode_coordinates, encode_integers
+from utils.simplify import TrajectoryPyramid
+from utils.timestamps import epoch_timestamp
+
+
+def test_polyline_matches_reference_encoding():
+    assert encode_coordinates([38.5, 40.7, 43.252], [-120.2, -120.95, -126.453]) == '_p~iF~ps|U_ulLnnqC_mqNvxq`@'
+    assert decode_coordinates('_p~iF~ps|U_ulLnnqC_mqNvxq`@').tolist() == [[38.5, -120.2], [40.7, -120.95],
+                                                                          [43.252, -126.453]]
+    values = [1519891230, 1519891231, 1519891200, 0, -1, 2 ** 40]
+    assert decode_integers(encode_integers(values)).tolist() == values
+    assert encode_integers([]) == ''
+
+
+def test_points_polyline_round_trip():
+    rows = generate_gps_trace(2000, seed=5)
+    pyramid = TrajectoryPyramid.from_rows(rows)
+    assert to_simplified_points_geojson(pyramid) == to_points_geojson(rows)
+    line = to_simplified_points_polyline(pyramid, precision=6)
+    coordinates = decode_coordinates(line['coordinates'], precision=6)
+    assert np.allclose(coordinates[:, 0], [float(r.latitude) for r in rows], atol=1e-6)
+    assert np.allclose(coordinates[:, 1], [float(r.longitude) for r in rows], atol=1e-6)
+    assert decode_integers(line['timestamps']).tolist() == [epoch_timestamp(r.timestamp) for r in rows]
+    assert line['numPoints'] == 2000 and line['startTime'] == rows[0].timestamp.isoformat()
+    assert len(msgpack.packb(line)) * 3 < len(msgpack.packb(to_points_geojson(rows)))
+
+    tolerance = pyramid.zoom_tolerance(13)
+    simplified = to_simplified_points_polyline(pyramid, tolerance)
+    assert len(decode_integers(simplified['timestamps'])) == len(pyramid.indices(tolerance))
+    assert to_simplified_points_polyline(TrajectoryPyramid.from_rows([]))['coordinates'] == ''
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+from dashboard.db.mapper import _json_models
+from models import PromptResponse
+from utils.geo import to_prompts_geojson
+
+
+def test_prompt_rows_from_json_match_models():
+    rows = [{'id': 1, 'survey_id': 2, 'mobile_id': 3, 'prompt_uuid': 'a', 'prompt_num': 0,
+             'response': ['Home', 'Work'], 'displayed_at': '2018-03-01T03:00:30.763774-05:00',
+             'recorded_at': '2018-03-01T03:01:00-05:00', 'edited_at': None,
+             'latitude': 45.5017, 'longitude': -73.5673}]
+    prompts = _json_models(PromptResponse, rows)
+    assert prompts[0].displayed_at.isoformat() == '2018-03-01T03:00:30.763774-05:00'
+    feature = to_prompts_geojson(prompts, group_by='displayed_at')['features'][0]
+    assert feature['geometry']['coordinates'] == [-73.5673, 45.5017]
+    assert feature['properties']['responses'] == ['Home, Work']
+    assert feature['properties']['recordedAt'] == '2018-03-01T03:01:00-05:00'
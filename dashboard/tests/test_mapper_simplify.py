@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+import math
+import numpy as np
+
+from utils.fake_data import generate_gps_trace
+from utils.geo import to_points_geojson, to_simplified_points_geojson
+from utils.simplify import TrajectoryPyramid, douglas_peucker_weights
+
+
+def _segment_distance(x, y, first, last, idx):
+    dx, dy = x[last] - x[first], y[last] - y[first]
+    px, py = x[idx] - x[first], y[idx] - y[first]
+    length2 = dx * dx + dy * dy
+    t = min(max((px * dx + py * dy) / length2, 0.), 1.) if length2 > 0 else 0.
+    return math.hypot(px - t * dx, py - t * dy)
+
+
+def _douglas_peucker(x, y, tolerance, first=0, last=None):
+    if last is None:
+        last = len(x) - 1
+    distances = [_segment_distance(x, y, first, last, idx) for idx in range(first + 1, last)]
+    if not distances or max(distances) <= tolerance:
+        return [first, last]
+    split = first + 1 + distances.index(max(distances))
+    return _douglas_peucker(x, y, tolerance, first, split)[:-1] + _douglas_peucker(x, y, tolerance, split, last)
+
+
+def test_weights_match_douglas_peucker_at_every_tolerance():
+    rng = np.random.RandomState(4)
+    x = np.cumsum(rng.normal(size=400) * 10.)
+    y = np.cumsum(rng.normal(size=400) * 10.)
+    weights = douglas_peucker_weights(x, y)
+    for tolerance in [0.5, 5., 20., 80., 400.]:
+        assert np.flatnonzero(weights > tolerance).tolist() == _douglas_peucker(x, y, tolerance)
+
+
+def test_pyramid_levels_are_nested():
+    rows = generate_gps_trace(3000, seed=2)
+    pyramid = TrajectoryPyramid.from_rows(rows)
+    counts = []
+    for zoom in range(8, 21, 3):
+        tolerance = pyramid.zoom_tolerance(zoom)
+        counts.append(len(pyramid.indices(tolerance)))
+        assert set(pyramid.indices(tolerance)) >= set(pyramid.indices(tolerance * 2))
+    assert counts == sorted(counts) and counts[0] < len(rows) / 10
+
+    full = to_points_geojson(rows)['features'][0]
+    simplified = to_simplified_points_geojson(pyramid, pyramid.zoom_tolerance(12))['features'][0]
+    assert simplified['geometry']['coordinates'][0] == full['geometry']['coordinates'][0]
+    assert simplified['geometry']['coordinates'][-1] == full['geometry']['coordinates'][-1]
+    assert simplified['properties']['startTime'] == full['properties']['startTime']
+    assert simplified['properties']['numPoints'] == full['properties']['numPoints']
+    assert to_simplified_points_geojson(TrajectoryPyramid.from_rows([]))['features'][0]['geometry']['coordinates'] == []
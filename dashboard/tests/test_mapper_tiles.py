@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+import os
+import time
+
+from utils.tiles import TileCache, encode_counts_tile, tile_bounds, valid_tile
+
+
+def _read_varint(data, pos):
+    shift, value = 0, 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+# decode a protocol buffers message as {field number: [values]}
+def _decode(data):
+    fields = {}
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        if key & 0x7 == 0:
+            value, pos = _read_varint(data, pos)
+        else:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.setdefault(key >> 3, []).append(value)
+    return fields
+
+
+def _packed(data):
+    values, pos = [], 0
+    while pos < len(data):
+        value, pos = _read_varint(data, pos)
+        values.append(value)
+    return values
+
+
+def test_tile_bounds():
+    assert tile_bounds(0, 0, 0)[0] == -180. and round(tile_bounds(0, 0, 0)[3], 4) == 85.0511
+    west, south, east, north = tile_bounds(10, 302, 366)
+    assert west < -73.6 < east and south < 45.5 < north
+    assert valid_tile(3, 7, 0, max_zoom=18) and not valid_tile(3, 8, 0, max_zoom=18)
+
+
+def test_counts_tile_decodes_as_point_layer():
+    tile = _decode(encode_counts_tile('coordinates', [(0, 0, 5), (255, 10, 70000), (3, 3, 5)], 256))
+    layer = _decode(tile[3][0])
+    assert layer[1] == ['coordinates'] and layer[15] == [2] and layer[5] == [4096]
+    assert layer[3] == ['count']
+    counts = [_decode(v)[5][0] for v in layer[4]]
+    points = []
+    for feature in layer[2]:
+        feature = _decode(feature)
+        assert feature[3] == [1]
+        command, px, py = _packed(feature[4][0])
+        assert command == 9
+        key_idx, value_idx = _packed(feature[2][0])
+        points.append((px >> 1, py >> 1, counts[value_idx]))
+    assert points == [(8, 8, 5), (4088, 168, 70000), (56, 56, 5)]
+
+
+def test_cache_windows_are_invalidated_and_evicted(tmpdir):
+    cache = TileCache(str(tmpdir))
+    assert cache.watermark(1, 'all') is None
+    cache.set_watermark(1, 'all', 100)
+    cache.write(1, 'all', 3, 2, 1, 'tile')
+    assert cache.read(1, 'all', 3, 2, 1) == 'tile' and cache.watermark(1, 'all') == 100
+    cache.invalidate(1, 'all')
+    assert cache.read(1, 'all', 3, 2, 1) is None and cache.watermark(1, 'all') is None
+
+    cache.set_watermark(1, 'all', 100)
+    cache.set_watermark(2, 'window', 100)
+    stale = time.time() - 7200
+    os.utime(os.path.join(cache.window_path(2, 'window'), 'watermark'), (stale, stale))
+    assert cache.evict(3600) == [os.path.join('2', 'window')]
+    assert cache.watermark(1, 'all') == 100
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+from utils.fake_data import generate_gps_trace, generate_subway_stations
+from utils.tripbreaker import benchmark
+
+
+def test_gps_trace_is_reproducible():
+    stations = generate_subway_stations(10, seed=3)
+    trace = generate_gps_trace(500, seed=3, stations=stations)
+    assert len(trace) == 500
+    assert trace == generate_gps_trace(500, seed=3, stations=stations)
+    assert all(p1.timestamp <= p2.timestamp for p1, p2 in zip(trace, trace[1:]))
+
+
+def test_stage_profiles_cover_every_stage():
+    coordinates, stations = benchmark._trace(2000, seed=0)
+    stages = {}
+    for engine, profile_engine in benchmark.ENGINE_PROFILES.items():
+        profile = benchmark.StageProfiler()
+        profile_engine(profile, coordinates, stations)
+        stages[engine] = [s['stage'] for s in profile.stages]
+    assert sorted(stages['python']) == sorted(stages['numpy'])
+    assert stages['python'][-1] == 'summarize'
+
+
+def test_report_flags_regressions():
+    baseline = {'python': {'1000': [{'stage': 'merge_trips', 'seconds': 1., 'added_mb': 10.}]}}
+    results = {'1000': [{'stage': 'merge_trips', 'seconds': 1.1, 'added_mb': 10.}]}
+    assert benchmark.report('python', results, baseline, tolerance=0.25) == 0
+    results = {'1000': [{'stage': 'merge_trips', 'seconds': 2., 'added_mb': 30.}]}
+    assert benchmark.report('python', results, baseline, tolerance=0.25) == 2
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+import math
+import pytest
+import pytz
+import random
+import utm
+
+from utils.tripbreaker import algorithm as tripbreaker
+from utils.tripbreaker.modules import tools, trip_codes, vectorized
+from utils.tripbreaker.modules.stations import StationIndex
+
+
+Coordinate = namedtuple('Coordinate', ['id', 'timestamp', 'latitude', 'longitude',
+                                       'h_accuracy', 'v_accuracy'])
+Station = namedtuple('Station', ['latitude', 'longitude'])
+
+PARAMETERS = {
+    'break_interval_seconds': 360,
+    'subway_buffer_meters': 300,
+    'cold_start_distance_meters': 750,
+    'accuracy_cutoff_meters': 50
+}
+STATIONS = [Station(Decimal('45.5017'), Decimal('-73.5673')),
+            Station(Decimal('45.5120'), Decimal('-73.5530')),
+            Station(Decimal('45.4950'), Decimal('-73.5790'))]
+
+
+def generate_trace(seed, n=2000):
+    '''Random walk with dwells, subway gaps between stations, cold starts,
+       position glitches and noisy accuracy values'''
+    rng = random.Random(seed)
+    dt = datetime(2018, 3, 1, 8, 0, tzinfo=pytz.utc)
+    lat, lng = 45.5017, -73.5673
+    coordinates = []
+    for i in range(n):
+        roll = rng.random()
+        if roll < 0.01:
+            dt += timedelta(seconds=rng.randint(400, 3600))
+        elif roll < 0.015:
+            station = rng.choice(STATIONS)
+            lat, lng = float(station.latitude), float(station.longitude)
+            dt += timedelta(seconds=rng.randint(400, 1200))
+        elif roll < 0.02:
+            lat += rng.uniform(-0.006, 0.006)
+            dt += timedelta(seconds=rng.randint(400, 900))
+        else:
+            dt += timedelta(seconds=rng.choice([0, 1, 5, 10, 15, 30]),
+                            microseconds=rng.randint(0, 999999))
+        heading = rng.uniform(0, 2 * math.pi)
+        step = rng.uniform(0, 0.0003)
+        lat += step * math.cos(heading)
+        lng += step * math.sin(heading)
+
+        point_lat, point_lng = lat, lng
+        if rng.random() < 0.02:
+            point_lat += rng.uniform(-0.05, 0.05)
+        h_accuracy = rng.choice([None, 5., 10., 20., 35., 80., 150.]) if rng.random() < 0.1 else 10.
+        coordinates.append(Coordinate(id=i + 1,
+                                      timestamp=dt,
+                                      latitude=Decimal('%.7f' % point_lat),
+                                      longitude=Decimal('%.7f' % point_lng),
+                                      h_accuracy=h_accuracy,
+                                      v_accuracy=10.))
+    return coordinates
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_numpy_engine_matches_python_engine(seed):
+    points = generate_trace(seed)
+    expected = tripbreaker.run(PARAMETERS, STATIONS, points)
+    result = tripbreaker.run(PARAMETERS, STATIONS, points, engine='numpy')
+    assert result == expected
+
+
+@pytest.mark.parametrize('n', [0, 1, 2, 3])
+def test_numpy_engine_matches_python_engine_short_traces(n):
+    points = generate_trace(0, n=n)
+    expected = tripbreaker.run(PARAMETERS, STATIONS, points)
+    result = tripbreaker.run(PARAMETERS, STATIONS, points, engine='numpy')
+    assert result == expected
+
+
+def outlier_run_trace(num_outliers):
+    '''A slow walk interrupted by a run of glitches that step back towards the
+       walk, so each one is only rejected once the glitch before it has been'''
+    dt = datetime(2018, 3, 1, 8, 0, tzinfo=pytz.utc)
+    coordinates = []
+    offsets = ([i * 5 for i in range(10)] +
+               [5000 - i * 100 for i in range(num_outliers)] +
+               [50 + i * 5 for i in range(10)])
+    for i, meters in enumerate(offsets):
+        coordinates.append(Coordinate(id=i + 1,
+                                      timestamp=dt + timedelta(seconds=i),
+                                      latitude=Decimal('%.7f' % (45.5 + meters / 111320.)),
+                                      longitude=Decimal('-73.5600000'),
+                                      h_accuracy=10.,
+                                      v_accuracy=10.))
+    return coordinates
+
+
+@pytest.mark.parametrize('num_outliers', [3, 40])
+def test_filter_errorneous_distance_long_outlier_run(num_outliers):
+    points = tools.process_utm(outlier_run_trace(num_outliers), zone_number=18)
+    expected = [p.id for p in tripbreaker.filter_errorneous_distance(points, check_speed=60)]
+    arrays = vectorized.PointArrays.from_points(outlier_run_trace(num_outliers), zone_number=18)
+    for max_passes in (1, 4, num_outliers + 5):
+        result = vectorized.filter_errorneous_distance(arrays, check_speed=60, max_passes=max_passes)
+        assert result.id.tolist() == expected
+    assert not set(range(11, 10 + num_outliers)) & set(expected)
+
+
+def test_unknown_engine_raises():
+    with pytest.raises(ValueError):
+        tripbreaker.run(PARAMETERS, STATIONS, [], engine='fortran')
+
+
+def test_project_utm_matches_utm_from_latlon():
+    points = generate_trace(0, n=500)
+    latitudes = [p.latitude for p in points]
+    longitudes = [p.longitude for p in points]
+    eastings, northings, zone_number = tools.project_utm(latitudes, longitudes)
+    assert zone_number == 18
+    for lat, lng, easting, northing in zip(latitudes, longitudes, eastings, northings):
+        expected_easting, expected_northing, _, _ = utm.from_latlon(lat, lng)
+        assert (easting, northing) == (expected_easting, expected_northing)
+
+
+def test_project_utm_uses_fixed_zone():
+    # Ottawa (zone 18) and a point west of the 78W zone boundary (zone 17)
+    eastings, northings, zone_number = tools.project_utm([45.42, 45.60], [-75.70, -78.10],
+                                                         zone_number=18)
+    expected_easting, expected_northing, _, _ = utm.from_latlon(45.60, -78.10, force_zone_number=18)
+    assert zone_number == 18
+    assert (eastings[1], northings[1]) == (expected_easting, expected_northing)
+
+
+@pytest.mark.parametrize('distance', [50, 300, 2500, 50000])
+def test_station_index_matches_linear_scan(distance):
+    rng = random.Random(distance)
+    stations = [(rng.uniform(600000, 620000), rng.uniform(5030000, 5050000)) for _ in range(400)]
+    index = StationIndex(stations, zone_number=18)
+    for _ in range(200):
+        point = (rng.uniform(598000, 622000), rng.uniform(5028000, 5052000))
+        expected = [idx for idx, station in enumerate(stations)
+                    if tools.pythagoras(station, point) <= distance]
+        assert index.query_radius(point, distance) == expected
+        assert index.first_within(point, distance) == (stations[expected[0]] if expected else None)
+
+
+def test_points_store_integer_labels():
+    trips, summaries = tripbreaker.run(PARAMETERS, STATIONS, generate_trace(1))
+    for num, trip in trips.items():
+        for p in trip:
+            assert not hasattr(p, '__dict__')
+            assert p.note_label in trip_codes.notes.values()
+            assert set(p.merge_code_labels) <= set(trip_codes.merge_codes.values())
+        merge_codes = 0
+        for p in trip:
+            merge_codes |= p.merge_codes
+        assert summaries[num]['merge_codes'] == ', '.join(trip_codes.merge_code_labels(merge_codes))
+
+
+def test_merge_code_labels():
+    flags = trip_codes.MERGE_VELOCITY | trip_codes.MERGE_COLD_START
+    assert trip_codes.merge_code_labels(flags) == ['velocity', 'cold start']
+    assert trip_codes.merge_code_labels(0) == []
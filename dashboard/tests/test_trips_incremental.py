@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Kyle Fitzsimmons, 2018
+from collections import namedtuple
+import ciso8601
+from datetime import datetime, timedelta
+from decimal import Decimal
+import math
+import pytest
+import pytz
+
+from dashboard.db import trips as trips_db
+from dashboard.db.mobile_user import MobileUserActions
+from dashboard.db.trips import TripsActions
+from dashboard.server import create_app
+from models import (db as _db, MobileCoordinate, MobileTrip, MobileTripbreakerState, MobileUser,
+                    SubwayStop, Survey)
+from utils.tripbreaker import algorithm as tripbreaker
+
+PARAMETERS = {
+    'break_interval_seconds': 360,
+    'subway_buffer_meters': 300,
+    'cold_start_distance_meters': 750,
+    'accuracy_cutoff_meters': 50,
+    'utm_zone': 18
+}
+START = datetime(2018, 3, 1, 8, 0, tzinfo=pytz.utc)
+METERS_PER_DEGREE = 111320.
+
+Coordinate = namedtuple('Coordinate', ['id', 'timestamp', 'latitude', 'longitude',
+                                       'h_accuracy', 'v_accuracy'])
+
+
+class State(object):
+    '''Stands in for a user's `MobileTripbreakerState` row'''
+    def __init__(self, mobile_id, parameters):
+        self.mobile_id = mobile_id
+        self.survey_id = 1
+        self.parameters = parameters
+        self.checkpoint = None
+        self.last_trip_num = 0
+        self.open_trips = []
+
+
+class PersistedTrips(object):
+    '''Stands in for the `MobileTrip` model around `TripsActions.update`, keeping
+       the persisted trips in a list'''
+    end = 'end'
+
+    def __init__(self):
+        self.rows = []
+        self.deletes = 0
+        self.filters = {}
+        self.query = self
+
+    def __call__(self, survey_id, mobile_id, **row):
+        return row
+
+    def filter_by(self, **filters):
+        self.filters = filters
+        return self
+
+    def delete(self, synchronize_session=None):
+        self.deletes += 1
+        del self.rows[:]
+
+    # end of the persisted trip queried by `trip_num`
+    def scalar(self):
+        for row in self.rows:
+            if row['trip_num'] == self.filters['trip_num']:
+                return ciso8601.parse_datetime(row['end'])
+
+
+class PersistedTripsDatabase(object):
+    '''Stands in for the database handle, adding trips to `PersistedTrips`'''
+    def __init__(self, trips):
+        self.trips = trips
+        self.session = self
+
+    def add(self, row):
+        self.trips.rows.append(row)
+
+    def commit(self):
+        pass
+
+    def query(self, column):
+        return self.trips
+
+
+## Testing setup & teardown fixtures ==========================================
+@pytest.fixture(scope='module')
+def app():
+    app = create_app(testing=True)
+    ctx = app.app_context()
+    ctx.push()
+    _db.create_all()
+    yield app
+    _db.session.remove()
+    _db.drop_all()
+    ctx.pop()
+
+
+@pytest.fixture
+def session(app, monkeypatch):
+    connection = _db.engine.connect()
+    transaction = connection.begin()
+    session = _db.create_scoped_session(options=dict(bind=connection, binds={}))
+    monkeypatch.setattr(_db, 'session', session)
+    yield session
+    session.remove()
+    transaction.rollback()
+    connection.close()
+
+
+@pytest.fixture
+def mobile_user(session):
+    survey = Survey(name='incremental-trips')
+    session.add(survey)
+    session.flush()
+    user = MobileUser(survey_id=survey.id, uuid='00000000-0000-0000-0000-000000000001')
+    session.add(user)
+    session.commit()
+    return user
+
+
+## Test helpers ================================================================
+# a straight walk of `n` points from a position, one every `seconds`
+def walk(start, latitude, longitude, n, seconds=10, meters=40., heading=0.):
+    points = []
+    for i in range(n):
+        north = i * meters * math.cos(heading)
+        east = i * meters * math.sin(heading)
+        lat = latitude + north / METERS_PER_DEGREE
+        lng = longitude + east / (METERS_PER_DEGREE * math.cos(math.radians(latitude)))
+        points.append((start + timedelta(seconds=i * seconds), lat, lng))
+    return points
+
+
+def insert(user, points):
+    for timestamp, latitude, longitude in points:
+        _db.session.add(MobileCoordinate(survey_id=user.survey_id,
+                                         mobile_id=user.id,
+                                         timestamp=timestamp,
+                                         latitude=Decimal('%.7f' % latitude),
+                                         longitude=Decimal('%.7f' % longitude),
+                                         h_accuracy=10.,
+                                         v_accuracy=10.))
+    _db.session.commit()
+
+
+def stations(user):
+    return SubwayStop.query.filter_by(survey_id=user.survey_id).order_by(SubwayStop.id).all()
+
+
+def persisted_ids(user):
+    return [trip.id for trip in MobileTrip.query.filter_by(mobile_id=user.id)
+                                                .order_by(MobileTrip.trip_num)]
+
+
+def comparable(trips, summaries):
+    result = []
+    for num in sorted(trips or {}):
+        summary = summaries[num]
+        points = [(p.timestamp, float(p.latitude), float(p.longitude), p.h_accuracy,
+                   p.trip_distance, p.distance, p.break_period, p.trip_code)
+                  for p in trips[num]]
+        result.append((num, summary['trip_code'], summary['start'], summary['end'],
+                       float(summary['olat']), float(summary['olon']),
+                       float(summary['dlat']), float(summary['dlon']),
+                       summary['direct_distance'], summary['cumulative_distance'],
+                       summary['merge_codes'], points))
+    return result
+
+
+def full_run(user, parameters=PARAMETERS):
+    points = MobileUserActions.tripbreaker_coordinates(user.id)
+    return comparable(*tripbreaker.run(parameters, stations(user), points))
+
+
+def coordinates(points):
+    return [Coordinate(id=idx + 1, timestamp=timestamp,
+                       latitude=Decimal('%.7f' % latitude), longitude=Decimal('%.7f' % longitude),
+                       h_accuracy=10., v_accuracy=10.)
+            for idx, (timestamp, latitude, longitude) in enumerate(points)]
+
+
+def incremental_run(user, parameters=PARAMETERS):
+    trips_actions = TripsActions()
+    state = trips_actions.update(user.id, parameters, stations(user))
+    return state, comparable(*trips_actions.window(state))
+
+
+# three trips a kilometre and 20 minutes apart
+def three_trips():
+    return (walk(START, 45.50, -73.60, 20) +
+            walk(START + timedelta(minutes=20), 45.51, -73.60, 20, heading=math.pi / 2) +
+            walk(START + timedelta(minutes=40), 45.52, -73.60, 20))
+
+
+## Tests =======================================================================
+def test_incremental_trips_append_to_last_trip(mobile_user):
+    points = three_trips()
+    insert(mobile_user, points)
+    state, trips = incremental_run(mobile_user)
+    assert state.checkpoint and state.open_trips
+    assert trips == full_run(mobile_user)
+
+    last_timestamp, last_lat, last_lng = points[-1]
+    continued = walk(last_timestamp, last_lat, last_lng, 21)[1:]
+    insert(mobile_user, continued)
+    state, trips = incremental_run(mobile_user)
+    assert trips == full_run(mobile_user)
+    # the final point is held back by the reference distance filter
+    assert trips[-1][-1][-1][0] == continued[-2][0]
+
+
+def test_incremental_trips_append_single_point(mobile_user):
+    # a lone point near the end of the second trip is kept open, then attached to
+    # the finished second trip once the following trip arrives
+    points = (walk(START, 45.50, -73.60, 20) +
+              walk(START + timedelta(minutes=20), 45.51, -73.60, 20))
+    single_timestamp, single_lat, single_lng = points[-1]
+    points.append((single_timestamp + timedelta(minutes=20), single_lat + 0.0002, single_lng))
+    following = walk(single_timestamp + timedelta(minutes=40), 45.53, -73.60, 20)
+    # the reference distance filter holds back the final point, so the first point
+    # of the following trip makes the single point visible
+    insert(mobile_user, points + following[:1])
+    state, trips = incremental_run(mobile_user)
+    checkpoint = state.checkpoint
+    assert checkpoint == points[-2][0]
+    assert trips == full_run(mobile_user)
+    finished_points = trips[1][-1]
+
+    insert(mobile_user, following[1:])
+    state, trips = incremental_run(mobile_user)
+    expected = full_run(mobile_user)
+    assert trips == expected
+    # the single point extended the trip that had been finished at the checkpoint
+    assert expected[1][3] == checkpoint
+    assert len(expected[1][-1]) == len(finished_points) + 1
+    # the checkpoint is the single point's recorded timestamp rather than the end
+    # timestamp it was given, so later points no longer reset the finished trips
+    assert state.checkpoint == points[-1][0]
+    persisted = persisted_ids(mobile_user)
+
+    last_timestamp, last_lat, last_lng = following[-1]
+    insert(mobile_user, walk(last_timestamp + timedelta(minutes=20), last_lat + 0.01, last_lng, 20))
+    state, trips = incremental_run(mobile_user)
+    assert trips == full_run(mobile_user)
+    assert persisted_ids(mobile_user)[:len(persisted)] == persisted
+
+
+def test_incremental_trips_window_includes_open_trips(mobile_user):
+    insert(mobile_user, three_trips())
+    trips_actions = TripsActions()
+    state = trips_actions.update(mobile_user.id, PARAMETERS, stations(mobile_user))
+    persisted = MobileTrip.query.filter_by(mobile_id=mobile_user.id).count()
+    assert persisted and state.open_trips
+
+    expected = full_run(mobile_user)
+    assert len(expected) == persisted + len(state.open_trips)
+    last_start = expected[-1][2]
+    trips = comparable(*trips_actions.window(state, start=last_start))
+    assert trips == [trip for trip in expected if trip[3] >= last_start]
+
+
+def test_incremental_trips_reset_on_changed_settings(mobile_user):
+    insert(mobile_user, three_trips())
+    incremental_run(mobile_user)
+
+    # a longer break interval joins all three trips
+    parameters = dict(PARAMETERS, break_interval_seconds=3600)
+    state, trips = incremental_run(mobile_user, parameters)
+    assert state.parameters['break_interval_seconds'] == 3600
+    assert trips == full_run(mobile_user, parameters)
+    assert len(trips) < len(full_run(mobile_user))
+
+    # new subway stations reset the persisted trips as well
+    _db.session.add(SubwayStop(survey_id=mobile_user.survey_id,
+                               latitude=Decimal('45.5100'), longitude=Decimal('-73.6000')))
+    _db.session.commit()
+    state, trips = incremental_run(mobile_user, parameters)
+    assert state.parameters['num_stations'] == 1
+    assert trips == full_run(mobile_user, parameters)
+
+
+def test_incremental_trips_state_created_once(mobile_user):
+    # the state is inserted with ON CONFLICT DO NOTHING, so a user's existing state
+    # is locked and reused rather than inserted again
+    trips_actions = TripsActions()
+    state = trips_actions._get_state(mobile_user.id, PARAMETERS)
+    _db.session.flush()
+    assert trips_actions._get_state(mobile_user.id, PARAMETERS) is state
+    assert MobileTripbreakerState.query.filter_by(mobile_id=mobile_user.id).count() == 1
+
+
+def test_incremental_trips_reset_on_extended_trip(monkeypatch):
+    # runs without a database: the coordinates, state and persisted trips are kept
+    # in memory
+    rows = coordinates(three_trips())
+    persisted = PersistedTrips()
+    state = State(1, PARAMETERS)
+
+    def tripbreaker_coordinates(mobile_id, start_time=None, **kwargs):
+        return [row for row in sorted(rows, key=lambda r: r.timestamp)
+                if not start_time or row.timestamp >= start_time]
+
+    monkeypatch.setattr(trips_db.MobileUserActions, 'tripbreaker_coordinates',
+                        staticmethod(tripbreaker_coordinates))
+    monkeypatch.setattr(trips_db, 'db', PersistedTripsDatabase(persisted))
+    monkeypatch.setattr(trips_db, 'MobileTrip', persisted)
+    monkeypatch.setattr(TripsActions, '_get_state', lambda self, mobile_id, parameters: state)
+
+    def expected():
+        trips, summaries = tripbreaker.run(PARAMETERS, [], tripbreaker_coordinates(1))
+        return [trips_db._serialize_trip(num, trips[num], summaries[num]) for num in sorted(trips)]
+
+    trips_actions = TripsActions()
+    trips_actions.update(1, PARAMETERS, [])
+    assert state.checkpoint and persisted.rows
+    assert persisted.rows + state.open_trips == expected()
+
+    # a late upload a minute after the checkpoint extends the last finished trip, so
+    # the user's trips are detected again in full
+    last = [row for row in rows if row.timestamp == state.checkpoint][-1]
+    rows.append(last._replace(id=len(rows) + 1, timestamp=last.timestamp + timedelta(minutes=1)))
+    trips_actions.update(1, PARAMETERS, [])
+    assert persisted.deletes == 1
+    assert persisted.rows + state.open_trips == expected()
@@ -281,6 +281,16 @@ class MobileUser(Base):
                                         backref='mobile_user',
                                         lazy='dynamic')
 
+    trips = db.relationship('MobileTrip',
+                            cascade='all, delete-orphan',
+                            backref='mobile_user',
+                            lazy='dynamic')
+
+    tripbreaker_state = db.relationship('MobileTripbreakerState',
+                                        cascade='all, delete-orphan',
+                                        backref='mobile_user',
+                                        uselist=False)
+
     def __repr__(self):
         return '<MobileUser %d - %s>' % (self.id, self.uuid)
 
@@ -374,6 +384,56 @@ class CancelledPromptResponse(db.Model):
         return '<MobileCancelledPrompt %d>' % self.id
 
 
+# Tripbreaker tables ===========================================================
+class MobileTrip(db.Model):
+    __tablename__ = 'mobile_trips'
+
+    id = db.Column(db.Integer, primary_key=True)
+    survey_id = db.Column(db.Integer, db.ForeignKey(Survey.id, ondelete='CASCADE'))
+    mobile_id = db.Column(db.Integer, db.ForeignKey(MobileUser.id, ondelete='CASCADE'))
+    trip_num = db.Column(db.Integer, nullable=False)
+    trip_code = db.Column(db.Integer)
+    start = db.Column(db.DateTime(timezone=True))
+    end = db.Column(db.DateTime(timezone=True))
+    olat = db.Column(db.Numeric(precision=10, scale=7))
+    olon = db.Column(db.Numeric(precision=10, scale=7))
+    dlat = db.Column(db.Numeric(precision=10, scale=7))
+    dlon = db.Column(db.Numeric(precision=10, scale=7))
+    direct_distance = db.Column(db.Float)
+    cumulative_distance = db.Column(db.Float)
+    # comma-separated labels of the tripbreaker's `trip_codes.merge_codes` flags
+    merge_codes = db.Column(db.String(255))
+    points = db.Column(JSONB)
+
+    __table_args__ = (
+        db.Index('mobile_trips_user_trip_num_idx', mobile_id, trip_num, unique=True),
+        db.Index('mobile_trips_user_end_idx', mobile_id, end),
+    )
+
+    def __repr__(self):
+        return '<MobileTrip mobile_id=%s trip_num=%s>' % (self.mobile_id, self.trip_num)
+
+
+class MobileTripbreakerState(db.Model):
+    __tablename__ = 'mobile_tripbreaker_states'
+
+    id = db.Column(db.Integer, primary_key=True)
+    survey_id = db.Column(db.Integer, db.ForeignKey(Survey.id, ondelete='CASCADE'))
+    mobile_id = db.Column(db.Integer, db.ForeignKey(MobileUser.id, ondelete='CASCADE'), unique=True)
+    # tripbreaker settings the persisted trips were detected with
+    parameters = db.Column(JSONB)
+    # latest recorded timestamp of the points of the last finished (persisted) trip
+    checkpoint = db.Column(db.DateTime(timezone=True))
+    last_trip_num = db.Column(db.Integer, default=0)
+    # trailing trips that may still be extended by newer coordinates
+    open_trips = db.Column(JSONB)
+    modified_at = db.Column(db.DateTime(timezone=True), default=db.func.current_timestamp(),
+                            onupdate=db.func.current_timestamp())
+
+    def __repr__(self):
+        return '<MobileTripbreakerState mobile_id=%s>' % self.mobile_id
+
+
 # Relationship role tables =====================================================
 user_datastore = SQLAlchemyUserDatastore(db, WebUser, WebUserRole)
 web_user_role_lookup = db.Table('web_user_role_lookup',
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+#
+# Utils: typed columnar (Parquet) export sheets
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import types
+
+
+# return the Arrow type keeping a database column's type; timestamps are expected
+# to be selected as UTC and JSON as formatted text
+def arrow_type(column_type):
+    if isinstance(column_type, types.Float):
+        return pa.float64()
+    if isinstance(column_type, types.Numeric):
+        return pa.decimal128(column_type.precision, column_type.scale)
+    if isinstance(column_type, types.BigInteger):
+        return pa.int64()
+    if isinstance(column_type, types.Integer):
+        return pa.int32()
+    if isinstance(column_type, types.Boolean):
+        return pa.bool_()
+    if isinstance(column_type, types.DateTime):
+        return pa.timestamp('us', tz='UTC')
+    return pa.string()
+
+
+def arrow_field(column, name=None):
+    return pa.field(name or column.name, arrow_type(column.type))
+
+
+# Takes an iterable of row batches and writes them as a Parquet file of row groups
+# of at least `row_group_rows` rows; each column chunk is compressed separately
+# with the given codec
+def write_parquet(sheet_f, fields, batches, row_group_rows, compression='snappy'):
+    schema = pa.schema(fields)
+    writer = pq.ParquetWriter(sheet_f, schema, compression=compression)
+    try:
+        pending = []
+        for rows in batches:
+            pending.extend(rows)
+            if len(pending) >= row_group_rows:
+                _write_row_group(writer, schema, pending)
+                pending = []
+        if pending:
+            _write_row_group(writer, schema, pending)
+    finally:
+        writer.close()
+    return sheet_f
+
+
+def _write_row_group(writer, schema, rows):
+    arrays = [pa.array(list(values), type=field.type)
+              for field, values in zip(schema, zip(*rows))]
+    writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+# Takes the paths of Parquet chunks with the same schema and copies their row groups
+# into one Parquet sheet
+def concatenate_parquet(paths, sheet_f, compression='snappy'):
+    writer = None
+    try:
+        for path in paths:
+            chunk = pq.ParquetFile(path)
+            if writer is None:
+                writer = pq.ParquetWriter(sheet_f, chunk.schema.to_arrow_schema(),
+                                          compression=compression)
+            for idx in range(chunk.num_row_groups):
+                writer.write_table(chunk.read_row_group(idx))
+    finally:
+        if writer:
+            writer.close()
+    return sheet_f
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+#
+# Utils: zip entries compressed as export sheets are written
+from collections import deque
+import inspect
+from multiprocessing.pool import ThreadPool
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+
+COMPRESSION_STRATEGIES = ('deflate', 'store', 'parallel')
+PARALLEL_BLOCK_SIZE = 1024 * 1024
+COPY_BLOCK_SIZE = 1024 * 1024
+
+# compressed entries are copied into an archive through the private write state of
+# Python 2.7's zipfile module, which differs between releases; elsewhere they are
+# decompressed and added with `ZipFile.write`
+COPY_COMPRESSED = (sys.version_info[:2] == (2, 7) and
+                   hasattr(zipfile.ZipFile, '_writecheck') and
+                   'zip64' in inspect.getargspec(zipfile.ZipInfo.FileHeader).args)
+
+
+def _deflate_block(job):
+    level, block = job
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class Deflater(object):
+    '''Raw deflate stream for a zip entry. With more than one thread the data is
+       split into blocks that are compressed in parallel, each ending on a byte
+       boundary with a sync flush so that the blocks join into one stream'''
+    def __init__(self, level, threads=1):
+        self.level = level
+        self.threads = threads
+        self._pool = None
+        self._compressor = None
+        if threads > 1:
+            self._pool = ThreadPool(threads)
+            self._buffer = []
+            self._buffered = 0
+            self._pending = deque()
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def compress(self, data):
+        if self._compressor:
+            return self._compressor.compress(data)
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered < PARALLEL_BLOCK_SIZE:
+            return ''
+        self._submit()
+        return self._collect(backlog=self.threads * 2)
+
+    def flush(self):
+        if self._compressor:
+            return self._compressor.flush()
+        self._submit()
+        compressed = self._collect(backlog=0)
+        self.close()
+        # an empty final block ends the stream
+        return compressed + zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS).flush()
+
+    def close(self):
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def _submit(self):
+        if self._buffered:
+            block = ''.join(self._buffer)
+            self._pending.append(self._pool.apply_async(_deflate_block, ((self.level, block),)))
+            self._buffer = []
+            self._buffered = 0
+
+    # return the compressed blocks that are ready in order, waiting while more than
+    # `backlog` blocks are queued
+    def _collect(self, backlog):
+        compressed = []
+        while self._pending and (len(self._pending) > backlog or self._pending[0].ready()):
+            compressed.append(self._pending.popleft().get())
+        return ''.join(compressed)
+
+
+class ZipEntryFile(object):
+    '''Temporary file for an export sheet that is compressed for its zip archive
+       while it is written, so the archive is assembled by copying the compressed
+       bytes instead of compressing every sheet once generation has finished'''
+    def __init__(self, compress_type=zipfile.ZIP_DEFLATED, level=6, threads=1, **tempfile_kwargs):
+        self.compress_type = compress_type
+        self.file = tempfile.NamedTemporaryFile(**tempfile_kwargs)
+        self.dir = tempfile_kwargs.get('dir')
+        self.name = self.file.name
+        self.crc = 0
+        self.file_size = 0
+        self.finished = False
+        self._deflater = None
+        if compress_type == zipfile.ZIP_DEFLATED:
+            self._deflater = Deflater(level, threads=threads)
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.file_size += len(data)
+        if self._deflater:
+            data = self._deflater.compress(data)
+        if data:
+            self.file.write(data)
+
+    # position in the uncompressed sheet
+    def tell(self):
+        return self.file_size
+
+    def finish(self):
+        if self.finished:
+            return
+        if self._deflater:
+            self.file.write(self._deflater.flush())
+        self.file.flush()
+        self.finished = True
+
+    @property
+    def compress_size(self):
+        return self.file.tell()
+
+    def close(self):
+        if self._deflater:
+            self._deflater.close()
+        self.file.close()
+
+
+# Adds a finished entry to an open zip archive, copying its compressed bytes where
+# the zipfile module allows it
+def write_zip_entry(zip_f, arcname, entry):
+    entry.finish()
+    if COPY_COMPRESSED and all(hasattr(zip_f, attr) for attr in ('_didModify', '_allowZip64',
+                                                                   'filelist', 'NameToInfo')):
+        _copy_zip_entry(zip_f, arcname, entry)
+    else:
+        _rewrite_zip_entry(zip_f, arcname, entry)
+
+
+def _copy_zip_entry(zip_f, arcname, entry):
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[:6])
+    zinfo.external_attr = (stat.S_IFREG | 0o644) << 16
+    zinfo.compress_type = entry.compress_type
+    zinfo.CRC = entry.crc & 0xffffffff
+    zinfo.file_size = entry.file_size
+    zinfo.compress_size = entry.compress_size
+    zip64 = max(zinfo.file_size, zinfo.compress_size) > zipfile.ZIP64_LIMIT
+    if zip64 and not zip_f._allowZip64:
+        raise zipfile.LargeZipFile('Filesize would require ZIP64 extensions')
+
+    zip_f._writecheck(zinfo)
+    zip_f._didModify = True
+    zinfo.header_offset = zip_f.fp.tell()
+    zip_f.fp.write(zinfo.FileHeader(zip64))
+    entry.file.seek(0)
+    shutil.copyfileobj(entry.file, zip_f.fp, COPY_BLOCK_SIZE)
+    zip_f.filelist.append(zinfo)
+    zip_f.NameToInfo[zinfo.filename] = zinfo
+
+
+def _rewrite_zip_entry(zip_f, arcname, entry):
+    entry.file.seek(0)
+    with tempfile.NamedTemporaryFile(dir=entry.dir) as sheet_f:
+        if entry.compress_type == zipfile.ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            for block in iter(lambda: entry.file.read(COPY_BLOCK_SIZE), b''):
+                sheet_f.write(decompressor.decompress(block))
+            sheet_f.write(decompressor.flush())
+        else:
+            shutil.copyfileobj(entry.file, sheet_f, COPY_BLOCK_SIZE)
+        sheet_f.flush()
+        zip_f.write(sheet_f.name, arcname, compress_type=entry.compress_type)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+#
+# Utils: time-partitioned export chunks shared between export workers
+from datetime import datetime, timedelta
+import errno
+import os
+import shutil
+import threading
+import time
+
+import pytz
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+CHUNK_EXTENSIONS = ('.csv', '.parquet')
+
+
+# split a time range into chunks aligned to multiples of `days` since the epoch so
+# the same chunks recur in exports of different windows; each chunk is returned as
+# an inclusive (start, end) range ending one microsecond before the next chunk
+def chunk_windows(start, end, days):
+    if not days:
+        return [(start, end)]
+    epoch = EPOCH if start.tzinfo else EPOCH.replace(tzinfo=None)
+    step = timedelta(days=days)
+    edge = epoch + step * (int((start - epoch).total_seconds() // step.total_seconds()) + 1)
+
+    windows = []
+    chunk_start = start
+    while edge <= end:
+        windows.append((chunk_start, edge - timedelta(microseconds=1)))
+        chunk_start = edge
+        edge += step
+    windows.append((chunk_start, end))
+    return windows
+
+
+def _remove(filepath):
+    try:
+        os.remove(filepath)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+class ChunkStore(object):
+    '''Directory of finished export chunks named by their cache key. A chunk is
+       claimed with a lock file before it is written so several workers can share
+       the chunks of an export; the lock of a worker that died is treated as stale
+       after `lock_seconds` and the chunk is written again.'''
+    def __init__(self, folder, lock_seconds):
+        self.folder = folder
+        self.lock_seconds = lock_seconds
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def path(self, key, ext):
+        return os.path.join(self.folder, key + ext)
+
+    # return the path of a finished chunk, marking it as recently used
+    def find(self, key, ext):
+        path = self.path(key, ext)
+        try:
+            os.utime(path, None)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        return path
+
+    def claim(self, key):
+        lock_path = self.path(key, '.lock')
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            try:
+                age = time.time() - os.path.getmtime(lock_path)
+            except OSError:
+                age = None
+            if age is not None and age <= self.lock_seconds:
+                return False
+            _remove(lock_path)
+            return self.claim(key)
+        os.write(fd, str(os.getpid()))
+        os.close(fd)
+        return True
+
+    # open a chunk for writing under a name unique to this thread, it only becomes
+    # visible to `find` once finished
+    def open(self, key, ext):
+        part_path = self.path(key, '{}.{}-{}.part'.format(ext, os.getpid(), threading.current_thread().ident))
+        return open(part_path, 'w+b')
+
+    def finish(self, chunk_f, key, ext):
+        chunk_f.close()
+        path = self.path(key, ext)
+        os.rename(chunk_f.name, path)
+        _remove(self.path(key, '.lock'))
+        return path
+
+    def release(self, chunk_f, key):
+        chunk_f.close()
+        _remove(chunk_f.name)
+        _remove(self.path(key, '.lock'))
+
+    # remove chunks unused for longer than the maximum age and then the least
+    # recently used until the store fits within its maximum size; chunks used within
+    # the lock period may belong to a running export and are always kept
+    def evict(self, max_age, max_bytes):
+        chunks = []
+        for filename in os.listdir(self.folder):
+            if not filename.endswith(CHUNK_EXTENSIONS):
+                continue
+            filepath = os.path.join(self.folder, filename)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue
+            chunks.append((stat.st_mtime, stat.st_size, filepath))
+        chunks.sort()
+
+        total_bytes = sum(size for _, size, _ in chunks)
+        now = time.time()
+        removed = []
+        for mtime, size, filepath in chunks:
+            if now - mtime <= self.lock_seconds:
+                break
+            if now - mtime <= max_age and total_bytes <= max_bytes:
+                break
+            _remove(filepath)
+            total_bytes -= size
+            removed.append(os.path.basename(filepath))
+        return removed
+
+
+# Takes the paths of .csv chunks that each begin with a byte order mark and the
+# same header row and copies them into one sheet with a single header
+def concatenate_csv(paths, sheet_f):
+    for idx, path in enumerate(paths):
+        with open(path, 'rb') as chunk_f:
+            if idx > 0:
+                chunk_f.readline()
+            shutil.copyfileobj(chunk_f, sheet_f)
+    return sheet_f
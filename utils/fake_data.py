@@ -1,13 +1,21 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 # Kyle Fitzsimmons, 2017
-from datetime import timedelta
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
 from faker import Factory
+import math
 import random
 import pytz
 
 fake = Factory.create()
 
+# coordinate columns read from the database by the tripbreaker
+TripbreakerCoordinate = namedtuple('TripbreakerCoordinate', ['id', 'timestamp', 'latitude', 'longitude',
+                                                             'h_accuracy', 'v_accuracy'])
+SubwayStation = namedtuple('SubwayStation', ['latitude', 'longitude'])
+
 
 def generate_installation(survey_name):
     tz = pytz.timezone('America/Montreal')
@@ -116,6 +124,77 @@ def generate_coordinates(uuid, n=0):
     return coordinates
 
 
+# subway stations scattered around downtown Montreal as (latitude, longitude) rows
+def generate_subway_stations(n, seed=None):
+    rng = random.Random(seed)
+    return [SubwayStation(latitude=Decimal('%.7f' % (45.5017 + rng.uniform(-0.04, 0.04))),
+                          longitude=Decimal('%.7f' % (-73.5673 + rng.uniform(-0.06, 0.06))))
+            for i in range(n)]
+
+
+# random walk around downtown Montreal for exercising each stage of the tripbreaker:
+# dwell periods with the phone at rest, subway rides between `stations` without
+# signal, cold starts a few hundred meters from the last fix, longer missing trips,
+# isolated points between gaps, position glitches and noisy accuracy values
+def generate_gps_trace(n, seed=None, stations=None):
+    rng = random.Random(seed)
+    dt = datetime(2018, 3, 1, 8, 0, tzinfo=pytz.utc)
+    lat, lng = 45.5017, -73.5673
+    dwell = 0
+    coordinates = []
+
+    def add_point(latitude, longitude, h_accuracy):
+        coordinates.append(TripbreakerCoordinate(id=len(coordinates) + 1,
+                                                 timestamp=dt,
+                                                 latitude=Decimal('%.7f' % latitude),
+                                                 longitude=Decimal('%.7f' % longitude),
+                                                 h_accuracy=h_accuracy,
+                                                 v_accuracy=10.))
+
+    while len(coordinates) < n:
+        roll = rng.random()
+        if dwell:
+            dwell -= 1
+            dt += timedelta(seconds=rng.choice([30, 60, 120]))
+        elif roll < 0.005:
+            dwell = rng.randint(10, 200)
+        elif roll < 0.01:
+            # stop recording for a while at the same place
+            dt += timedelta(seconds=rng.randint(400, 3600))
+        elif roll < 0.013 and stations:
+            station = rng.choice(stations)
+            lat, lng = float(station.latitude), float(station.longitude)
+            dt += timedelta(seconds=rng.randint(400, 1200))
+        elif roll < 0.016:
+            heading = rng.uniform(0, 2 * math.pi)
+            lat += 0.005 * math.cos(heading)
+            lng += 0.005 * math.sin(heading)
+            dt += timedelta(seconds=rng.randint(400, 900))
+        elif roll < 0.018:
+            lat = 45.5017 + rng.uniform(-0.05, 0.05)
+            lng = -73.5673 + rng.uniform(-0.07, 0.07)
+            dt += timedelta(seconds=rng.randint(900, 3600))
+        elif roll < 0.02:
+            dt += timedelta(seconds=rng.randint(400, 900))
+            add_point(lat, lng, 10.)
+            dt += timedelta(seconds=rng.randint(400, 900))
+        else:
+            dt += timedelta(seconds=rng.choice([1, 5, 10, 15, 30]),
+                            microseconds=rng.randint(0, 999999))
+
+        step = rng.uniform(0, 0.00002 if dwell else 0.0003)
+        heading = rng.uniform(0, 2 * math.pi)
+        lat += step * math.cos(heading)
+        lng += step * math.sin(heading)
+
+        point_lat = lat
+        if rng.random() < 0.02:
+            point_lat += rng.uniform(-0.05, 0.05)
+        h_accuracy = rng.choice([None, 5., 20., 35., 80., 150.]) if rng.random() < 0.1 else 10.
+        add_point(point_lat, lng, h_accuracy)
+    return coordinates[:n]
+
+
 def generate_prompts_answers(uuid, prompts):
     answers = []
     tz = pytz.timezone('America/Montreal')
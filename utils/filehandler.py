@@ -2,16 +2,29 @@
 # -*- coding: utf-8 -*-
 # Kyle Fitzsimmons, 2016
 from flask import current_app
+import glob
 from hashids import Hashids
 import math
 import os
 from PIL import Image
+import re
+import shutil
+import tempfile
 import time
 from werkzeug.utils import secure_filename
 import zipfile
 
+from utils.compression import ZipEntryFile, write_zip_entry
+
 hashids = Hashids()
 
+# cached export archives end with their cache key so that a repeat export of
+# unchanged data can be found from the key alone
+CACHED_ZIP_RE = re.compile(r'-[0-9a-f]{16}\.zip$')
+# sheets already compressed by column are stored in export archives as-is
+STORED_EXTENSIONS = ('.parquet',)
+COPY_BUFFER_SIZE = 1024 * 1024
+
 
 def save(filedata, extensions=None):
     # check that extension is valid
@@ -78,15 +91,123 @@ def make_thumbnail(img_file, size=[200., 200.]):
     return img
 
 
-# Takes a dictionary object of BytesIO memory file objects
-# and writes a zip containing these files with the dictionary
-# keys as filenames
-def save_zip(basepath, basename, data):
+# Returns a temporary on-disk file for an export sheet to be written into so
+# the sheet never needs to be held in memory; the file is deleted once closed
+def open_export_file(suffix='.csv'):
+    return tempfile.NamedTemporaryFile(prefix='itinerum-export-', suffix=suffix,
+                                       dir=current_app.config['EXPORT_TEMP_FOLDER'])
+
+
+def _stored(filename):
+    return (current_app.config['EXPORT_ZIP_COMPRESSION'] == 'store' or
+            filename.endswith(STORED_EXTENSIONS))
+
+
+# Returns a temporary export file that is compressed for the export archive as
+# it is written by the configured `EXPORT_ZIP_COMPRESSION` strategy
+def open_compressed_export_file(suffix='.csv'):
+    config = current_app.config
+    compress_type = zipfile.ZIP_STORED if _stored(suffix) else zipfile.ZIP_DEFLATED
+    threads = config['EXPORT_ZIP_THREADS'] if config['EXPORT_ZIP_COMPRESSION'] == 'parallel' else 1
+    return ZipEntryFile(compress_type, level=config['EXPORT_ZIP_LEVEL'], threads=threads,
+                        prefix='itinerum-export-', suffix=suffix,
+                        dir=config['EXPORT_TEMP_FOLDER'])
+
+
+# Takes a dictionary object of export files (or BytesIO memory file objects)
+# and writes a zip containing these files with the dictionary keys as
+# filenames; files are closed once added. An iterable of (filename, file) pairs
+# is also accepted so that sheets can be added to the archive as they finish being
+# generated. Sheets opened with `open_compressed_export_file` are already
+# compressed and only copied; others are compressed as they are added.
+def save_zip(basepath, basename, data, cache_key=None):
     zip_filename = '{base}-{time}.zip'.format(base=basename.encode('utf-8'),
                                               time=int(time.time()))
+    if cache_key:
+        zip_filename = zip_filename.replace('.zip', '-{}.zip'.format(cache_key))
     zip_filepath = os.path.join(current_app.config['ASSETS_FOLDER'],
                                 basepath, zip_filename)
-    with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zip_f:
-        for csv_filename, csv_data in data.items():
-            zip_f.writestr(csv_filename, csv_data.getvalue())
+    # the archive is written under a temporary name so an incomplete file is never
+    # served or found in the cache
+    partial_filepath = zip_filepath + '.part'
+    with zipfile.ZipFile(partial_filepath, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zip_f:
+        sheets = data.items() if hasattr(data, 'items') else data
+        for csv_filename, csv_data in sheets:
+            try:
+                in_memory = hasattr(csv_data, 'getvalue')
+                if _stored(csv_filename) and not in_memory and not isinstance(csv_data, ZipEntryFile):
+                    csv_data.flush()
+                    zip_f.write(csv_data.name, arcname=csv_filename, compress_type=zipfile.ZIP_STORED)
+                    continue
+                if not isinstance(csv_data, ZipEntryFile):
+                    csv_data = _compressed_copy(csv_filename, csv_data)
+                write_zip_entry(zip_f, csv_filename, csv_data)
+            finally:
+                csv_data.close()
+    os.rename(partial_filepath, zip_filepath)
     return zip_filename
+
+
+def _compressed_copy(filename, sheet_f):
+    entry = open_compressed_export_file(suffix=os.path.splitext(filename)[1])
+    try:
+        if hasattr(sheet_f, 'getvalue'):
+            entry.write(sheet_f.getvalue())
+        else:
+            sheet_f.flush()
+            with open(sheet_f.name, 'rb') as src_f:
+                shutil.copyfileobj(src_f, entry, COPY_BUFFER_SIZE)
+            sheet_f.close()
+    except:
+        entry.close()
+        raise
+    return entry
+
+
+def is_cached_zip(filename):
+    return bool(CACHED_ZIP_RE.search(filename))
+
+
+# Returns the filename of a finished export archive saved with the given cache
+# key, marking it as recently used, or None when there is none
+def find_cached_zip(basepath, cache_key):
+    if not cache_key:
+        return None
+    pattern = os.path.join(current_app.config['ASSETS_FOLDER'], basepath,
+                           '*-{}.zip'.format(cache_key))
+    matches = sorted(glob.glob(pattern), key=os.path.getmtime)
+    if not matches:
+        return None
+    os.utime(matches[-1], None)
+    return os.path.basename(matches[-1])
+
+
+# Removes cached export archives unused for longer than the maximum age and then
+# the least recently used archives until the cache fits within its maximum size;
+# the `keep` archive is never removed
+def evict_cached_zips(basepath, keep=None):
+    max_age = current_app.config['EXPORT_CACHE_MAX_AGE_HOURS'] * 3600.
+    max_bytes = current_app.config['EXPORT_CACHE_MAX_MB'] * 1024 * 1024
+    folder = os.path.join(current_app.config['ASSETS_FOLDER'], basepath)
+
+    cached = []
+    for filename in os.listdir(folder):
+        if filename == keep or not is_cached_zip(filename):
+            continue
+        filepath = os.path.join(folder, filename)
+        stat = os.stat(filepath)
+        cached.append((stat.st_mtime, stat.st_size, filepath))
+    cached.sort()
+
+    total_bytes = sum(size for _, size, _ in cached)
+    if keep and os.path.exists(os.path.join(folder, keep)):
+        total_bytes += os.path.getsize(os.path.join(folder, keep))
+    now = time.time()
+    removed = []
+    for mtime, size, filepath in cached:
+        if now - mtime <= max_age and total_bytes <= max_bytes:
+            break
+        os.remove(filepath)
+        total_bytes -= size
+        removed.append(os.path.basename(filepath))
+    return removed
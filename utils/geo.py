@@ -5,6 +5,12 @@
 from datetime import datetime
 from decimal import Decimal
 from utils.data import cast, make_keys_camelcase
+from utils.polyline import encode_coordinates, encode_integers
+from utils.timestamps import epoch_timestamp
+
+# mapper payload encodings: GeoJSON, or polyline strings of coordinates and epoch
+# second timestamps
+MAPPER_ENCODINGS = ('geojson', 'polyline')
 
 
 ### Return points as linestring
@@ -41,6 +47,66 @@ def to_points_geojson(query_result):
     return geojson
 
 
+def _trajectory_properties(pyramid, tolerance, num_vertices):
+    properties = {}
+    if len(pyramid):
+        properties = {
+            'startTime': pyramid.start_time.isoformat(),
+            'endTime': pyramid.end_time.isoformat(),
+            'numPoints': len(pyramid)
+        }
+        if tolerance is not None:
+            properties['numVertices'] = num_vertices
+            properties['tolerance'] = tolerance
+    return properties
+
+
+def to_simplified_points_geojson(pyramid, tolerance=None):
+    '''Geojson polyline of a trajectory pyramid cut to the given tolerance in meters,
+       matching `to_points_geojson` for the raw points without a tolerance'''
+    geojson = to_points_geojson([])
+    feature = geojson['features'][0]
+    feature['geometry']['coordinates'] = pyramid.coordinates(tolerance)
+    feature['properties'] = _trajectory_properties(pyramid, tolerance,
+                                                   len(feature['geometry']['coordinates']))
+    return geojson
+
+
+### Return points as compact polyline strings
+def _polyline(latitudes, longitudes, epoch_seconds, precision):
+    return {
+        'precision': precision,
+        'coordinates': encode_coordinates(latitudes, longitudes, precision=precision),
+        'timestamps': encode_integers(epoch_seconds)
+    }
+
+
+def to_simplified_points_polyline(pyramid, tolerance=None, precision=5):
+    '''Polyline equivalent of `to_simplified_points_geojson` with the points'
+       coordinates and epoch timestamps as delta-encoded strings'''
+    idx = pyramid.indices(tolerance)
+    line = _polyline(pyramid.latitudes[idx], pyramid.longitudes[idx],
+                     pyramid.epoch_seconds[idx], precision)
+    line.update(_trajectory_properties(pyramid, tolerance, len(idx)))
+    return line
+
+
+def to_trips_polyline(trips_result, summaries_result, precision=5):
+    trips = []
+    for trip_id, trip in trips_result.items():
+        if trip:
+            line = _polyline([p.latitude for p in trip], [p.longitude for p in trip],
+                             [epoch_timestamp(p.timestamp) for p in trip], precision)
+            line.update({
+                'start': trip[0].timestamp.isoformat(),
+                'end': trip[-1].timestamp.isoformat(),
+                'tripCode': trip[0].trip_code,
+                'cumulativeDistance': summaries_result[trip_id]['cumulative_distance']
+            })
+            trips.append(line)
+    return {'trips': trips}
+
+
 def to_trips_geojson(trips_result, summaries_result):
     '''Geojson generated for polyline data from detected trips'''
     geojson = {
@@ -60,14 +126,14 @@ def to_trips_geojson(trips_result, summaries_result):
             feature = {
                 'type': 'Feature',
                 'properties': {
-                    'start': trip[0]['timestamp'].isoformat(),
-                    'end': trip[-1]['timestamp'].isoformat(),
-                    'tripCode': trip[0]['trip_code'],
+                    'start': trip[0].timestamp.isoformat(),
+                    'end': trip[-1].timestamp.isoformat(),
+                    'tripCode': trip[0].trip_code,
                     'cumulativeDistance': summaries_result[trip_id]['cumulative_distance']
                 },
                 'geometry': {
                     'type': 'LineString',
-                    'coordinates': [(cast(p['latitude'], float), cast(p['longitude'], float)) for p in trip]
+                    'coordinates': [(cast(p.latitude, float), cast(p.longitude, float)) for p in trip]
                 }
             }
 
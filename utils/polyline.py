@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+#
+# Utils: Google encoded polyline strings of delta-encoded integer arrays
+import numpy as np
+
+# a value needs at most this many 5-bit chunks; covers 64-bit epoch microseconds
+MAX_CHUNKS = 13
+SHIFTS = np.arange(0, MAX_CHUNKS * 5, 5, dtype=np.int64)
+
+
+# round half up as with the reference (javascript) encoder
+def _fixed(values, precision):
+    return np.floor(np.asarray(values, dtype=np.float64) * 10 ** precision + 0.5).astype(np.int64)
+
+
+def encode_integers(values):
+    '''Encodes an integer array, or the rows of a 2D array interleaved, as the
+       polyline string of each value's difference from the previous row'''
+    values = np.asarray(values, dtype=np.int64)
+    if not values.size:
+        return ''
+    deltas = np.concatenate([values[:1], np.diff(values, axis=0)]).ravel()
+    zigzag = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    chunks = (zigzag[:, None] >> SHIFTS) & 0x1f
+    num_chunks = 1 + ((zigzag[:, None] >> SHIFTS[1:]) > 0).sum(axis=1)
+    positions = np.arange(MAX_CHUNKS)
+    # every chunk but a value's last has the continuation bit set
+    chunks |= np.where(positions < (num_chunks - 1)[:, None], 0x20, 0)
+    return (chunks + 63)[positions < num_chunks[:, None]].astype(np.uint8).tostring()
+
+
+def decode_integers(encoded, dimensions=1):
+    values = []
+    value, shift = 0, 0
+    for char in encoded:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if not byte & 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+    values = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, dimensions), axis=0)
+    return values.ravel() if dimensions == 1 else values
+
+
+# Encodes (latitude, longitude) pairs with `precision` decimal places
+def encode_coordinates(latitudes, longitudes, precision=5):
+    return encode_integers(np.column_stack([_fixed(latitudes, precision),
+                                            _fixed(longitudes, precision)]))
+
+
+def decode_coordinates(encoded, precision=5):
+    return decode_integers(encoded, dimensions=2) / float(10 ** precision)
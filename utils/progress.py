@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+#
+# Utils: throttled progress events for long running exports
+import threading
+import time
+
+
+class ExportProgress(object):
+    '''Collects the progress of each sheet of an export and passes a summary event
+       to `publish` at most once every `every_rows` rows or `every_seconds` seconds,
+       plus once as each sheet finishes. Sheets may be written from separate threads.'''
+    def __init__(self, publish, event_type, num_sheets, total_users=None,
+                 every_rows=10000, every_seconds=5.):
+        self.publish = publish
+        self.event_type = event_type
+        self.num_sheets = num_sheets
+        self.total_users = total_users
+        self.every_rows = every_rows
+        self.every_seconds = every_seconds
+        # the clock is only read after this many rows to keep the writing loops cheap
+        self.check_rows = max(1, min(every_rows, 1000))
+        self.sheets = []
+        self.started = time.time()
+        self._next_rows = every_rows
+        self._next_time = self.started + every_seconds
+        self._lock = threading.Lock()
+
+    def sheet(self, name, sheet_f=None):
+        sheet = SheetProgress(self, name, sheet_f)
+        with self._lock:
+            self.sheets.append(sheet)
+        return sheet
+
+    @property
+    def rows(self):
+        return sum(s.rows for s in self.sheets)
+
+    # fraction of the export completed: finished sheets count fully and unfinished
+    # sheets written per user count by the users processed out of the total
+    def fraction(self):
+        done = 0.
+        for sheet in self.sheets:
+            if sheet.finished:
+                done += 1.
+            elif self.total_users and sheet.users:
+                done += min(1., float(sheet.users) / self.total_users)
+        return done / self.num_sheets
+
+    def sample(self, sheet, force=False):
+        sheet.bytes = sheet.bytes_done
+        if sheet.sheet_f:
+            sheet.bytes += sheet.sheet_f.tell()
+        with self._lock:
+            now = time.time()
+            rows = self.rows
+            if not (force or rows >= self._next_rows or now >= self._next_time):
+                return
+            self._next_rows = rows + self.every_rows
+            self._next_time = now + self.every_seconds
+            self.publish(self.event(sheet, rows, now))
+
+    def event(self, sheet, rows, now):
+        elapsed = now - self.started
+        fraction = self.fraction()
+        remaining = None
+        if fraction:
+            remaining = elapsed * (1. - fraction) / fraction
+        return {
+            'type': self.event_type,
+            'sheet': sheet.name,
+            'sheet_rows': sheet.rows,
+            'sheets_finished': sum(1 for s in self.sheets if s.finished),
+            'total_sheets': self.num_sheets,
+            'rows': rows,
+            'users': max(s.users for s in self.sheets),
+            'total_users': self.total_users,
+            'bytes': sum(s.bytes for s in self.sheets),
+            'elapsed_seconds': int(elapsed),
+            'remaining_seconds': int(remaining) if remaining is not None else None
+        }
+
+
+class SheetProgress(object):
+    '''Row and user counters for one export sheet, only ever updated by the thread
+       writing that sheet. A sheet written in chunks switches to each chunk's file
+       with `write_to`.'''
+    def __init__(self, export, name, sheet_f=None):
+        self.export = export
+        self.name = name
+        self.sheet_f = sheet_f
+        self.rows = 0
+        self.users = 0
+        self.bytes = 0
+        self.bytes_done = 0
+        self.finished = False
+        self._next_check = export.check_rows
+
+    def add_rows(self, rows=1, users=0):
+        self.rows += rows
+        self.users += users
+        if self.rows >= self._next_check:
+            self._next_check = self.rows + self.export.check_rows
+            self.export.sample(self)
+
+    def write_to(self, sheet_f):
+        if self.sheet_f:
+            self.bytes_done += self.sheet_f.tell()
+        self.sheet_f = sheet_f
+
+    def finish(self):
+        self.write_to(None)
+        self.finished = True
+        self.export.sample(self, force=True)
+
+    # file-like object counting each write after the header as one row, as PostgreSQL's
+    # COPY ... TO STDOUT writes the output a row at a time
+    def writer(self, header=True):
+        return _RowCountingWriter(self, header)
+
+
+class _RowCountingWriter(object):
+    def __init__(self, sheet, header):
+        self.sheet = sheet
+        self.header = header
+
+    def write(self, data):
+        self.sheet.sheet_f.write(data)
+        if self.header:
+            self.header = False
+            return
+        self.sheet.add_rows()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+#
+# Utils: two-level cache of API response bodies
+from collections import OrderedDict
+import hashlib
+import logging
+import msgpack
+import redis
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(*parts):
+    return hashlib.sha1(repr(parts)).hexdigest()
+
+
+class ResponseCache(object):
+    '''Response bodies kept in an in-process LRU of `local_size` entries in front of
+       an optional Redis store shared by every API process. Entries expire after
+       `ttl` seconds; a Redis server that cannot be reached is skipped.'''
+    def __init__(self, local_size, redis_url=None, ttl=86400, prefix='itinerum:'):
+        self.local_size = local_size
+        self.ttl = ttl
+        self.prefix = prefix
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url:
+            self._redis = redis.StrictRedis.from_url(redis_url, socket_timeout=1,
+                                                     socket_connect_timeout=1)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._local.pop(key, None)
+            if entry and entry[0] > now:
+                self._local[key] = entry
+                return entry[1]
+
+        if self._redis:
+            try:
+                packed = self._redis.get(self.prefix + key)
+            except redis.RedisError as e:
+                logger.warning('Response cache unavailable: {}'.format(e))
+                packed = None
+            if packed is not None:
+                value = msgpack.unpackb(packed, encoding='utf-8')
+                self._set_local(key, value)
+                return value
+
+    def set(self, key, value):
+        self._set_local(key, value)
+        if self._redis:
+            try:
+                self._redis.set(self.prefix + key, msgpack.packb(value), ex=int(self.ttl))
+            except redis.RedisError as e:
+                logger.warning('Response cache unavailable: {}'.format(e))
+
+    def _set_local(self, key, value):
+        if not self.local_size:
+            return
+        with self._lock:
+            self._local.pop(key, None)
+            self._local[key] = (time.time() + self.ttl, value)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+#
+# Utils: zoom-aware simplification of GPS trajectories for the mapper
+import math
+import numpy as np
+
+from utils.timestamps import epoch_timestamp
+from utils.tripbreaker.modules import tools
+
+EARTH_CIRCUMFERENCE = 2 * math.pi * 6378137.
+TILE_SIZE = 256.
+
+
+# ground distance in meters covered by one pixel of a 256px web mercator tile map
+def meters_per_pixel(zoom, latitude):
+    return EARTH_CIRCUMFERENCE * math.cos(math.radians(latitude)) / (TILE_SIZE * 2 ** zoom)
+
+
+# distance of each point to the segment from (x0, y0) to (x1, y1), all arrays
+def _segment_distances(x, y, x0, y0, x1, y1):
+    dx, dy = x1 - x0, y1 - y0
+    xs, ys = x - x0, y - y0
+    length2 = dx * dx + dy * dy
+    t = np.clip((xs * dx + ys * dy) / np.where(length2 > 0, length2, 1.), 0., 1.)
+    return np.hypot(xs - t * dx, ys - t * dy)
+
+
+def douglas_peucker_weights(x, y, min_tolerance=0.):
+    '''Ranks the points of a line by the Douglas-Peucker tolerance at which each is
+       dropped, so the simplified line at any tolerance is the points weighted above
+       it. A point's weight is its distance from the segment it splits, capped by the
+       weights of the points splitting the segments around it to keep the levels
+       nested. Segments whose points are all within `min_tolerance` are not split
+       further and all of their points share the farthest distance.
+
+       Every segment at one depth of the recursion is split in the same pass over
+       the remaining points, so the work is a few array operations per depth.'''
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    weights = np.zeros(len(x))
+    if not len(x):
+        return weights
+    weights[0] = weights[-1] = np.inf
+
+    # the unranked points, in order, with the ends and weight of their segment
+    points = np.arange(1, len(x) - 1)
+    firsts = np.zeros(len(points), dtype=np.int64)
+    lasts = np.full(len(points), len(x) - 1, dtype=np.int64)
+    parent_weights = np.full(len(points), np.inf)
+    while len(points):
+        distances = _segment_distances(x[points], y[points], x[firsts], y[firsts],
+                                       x[lasts], y[lasts])
+        group_starts = np.flatnonzero(np.r_[True, firsts[1:] != firsts[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(points)])
+        group_max = np.maximum.reduceat(distances, group_starts)
+        # the first of the farthest points splits each segment
+        positions = np.arange(len(points))
+        farthest = np.where(distances == np.repeat(group_max, group_sizes), positions, len(points))
+        splits = np.minimum.reduceat(farthest, group_starts)
+        group_weights = np.minimum(group_max, parent_weights[group_starts])
+
+        point_weights = np.repeat(group_weights, group_sizes)
+        finished = np.repeat(group_max <= min_tolerance, group_sizes)
+        weights[points[finished]] = point_weights[finished]
+        weights[points[splits]] = group_weights
+
+        split_points = np.repeat(points[splits], group_sizes)
+        before = points < split_points
+        after = points > split_points
+        lasts = np.where(before, split_points, lasts)
+        firsts = np.where(after, split_points, firsts)
+        remaining = (before | after) & ~finished
+        points = points[remaining]
+        firsts = firsts[remaining]
+        lasts = lasts[remaining]
+        parent_weights = point_weights[remaining]
+    return weights
+
+
+class TrajectoryPyramid(object):
+    '''Multi-resolution version of a user's GPS trace, ranked on first use and then
+       cut to the detail visible at any zoom level'''
+    def __init__(self, latitudes, longitudes, start_time=None, end_time=None,
+                 epoch_seconds=None, zone_number=None, min_tolerance=1.):
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.epoch_seconds = None
+        if epoch_seconds is not None:
+            self.epoch_seconds = np.asarray(epoch_seconds, dtype=np.int64)
+        self.start_time = start_time
+        self.end_time = end_time
+        self.zone_number = zone_number
+        self.min_tolerance = min_tolerance
+        self._weights = None
+
+    @classmethod
+    def from_rows(cls, rows, **kwargs):
+        rows = list(rows)
+        start_time, end_time = None, None
+        if rows:
+            start_time, end_time = rows[0].timestamp, rows[-1].timestamp
+        return cls([r.latitude for r in rows], [r.longitude for r in rows],
+                   start_time=start_time, end_time=end_time,
+                   epoch_seconds=[epoch_timestamp(r.timestamp) for r in rows], **kwargs)
+
+    def __len__(self):
+        return len(self.latitudes)
+
+    @property
+    def weights(self):
+        if self._weights is None:
+            eastings, northings, self.zone_number = tools.project_utm(self.latitudes,
+                                                                      self.longitudes,
+                                                                      zone_number=self.zone_number)
+            self._weights = douglas_peucker_weights(eastings, northings,
+                                                    min_tolerance=self.min_tolerance)
+        return self._weights
+
+    # distance in meters below which detail is hidden at a zoom level
+    def zoom_tolerance(self, zoom, pixels=1.):
+        if not len(self):
+            return 0.
+        return pixels * meters_per_pixel(zoom, float(self.latitudes.mean()))
+
+    def indices(self, tolerance=None):
+        if not tolerance:
+            return np.arange(len(self))
+        return np.flatnonzero(self.weights > tolerance)
+
+    # (latitude, longitude) pairs of the trace simplified to the given tolerance
+    def coordinates(self, tolerance=None):
+        idx = self.indices(tolerance)
+        return zip(self.latitudes[idx].tolist(), self.longitudes[idx].tolist())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+#
+# Utils: Mapbox Vector Tiles of binned point counts and their on-disk cache
+import errno
+import math
+import os
+import shutil
+import struct
+import time
+
+MAX_LATITUDE = 85.0511287798
+TILE_EXTENT = 4096
+TILE_MIMETYPE = 'application/vnd.mapbox-vector-tile'
+
+
+# Web mercator tiles ===========================================================
+# return the (west, south, east, north) bounds in degrees of a z/x/y map tile
+def tile_bounds(z, x, y):
+    n = 2. ** z
+    west = x / n * 360. - 180.
+    east = (x + 1) / n * 360. - 180.
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return west, south, east, north
+
+
+def valid_tile(z, x, y, max_zoom):
+    return 0 <= z <= max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+# Vector tile encoding =========================================================
+# a minimal protocol buffers writer for the vector tile schema (version 2) with a
+# single layer of point features, each with an integer `count` property
+def _varint(value):
+    out = []
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return struct.pack('{}B'.format(len(out)), *out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def _field(number, wire_type):
+    return _varint((number << 3) | wire_type)
+
+
+def _bytes_field(number, data):
+    return _field(number, 2) + _varint(len(data)) + data
+
+
+def _packed_field(number, values):
+    return _bytes_field(number, ''.join(_varint(v) for v in values))
+
+
+def encode_counts_tile(layer_name, bins, grid_size, extent=TILE_EXTENT):
+    '''Encodes (column, row, count) bins of a `grid_size` square grid over the tile as
+       a vector tile layer of points at the bin centres with a `count` property'''
+    scale = float(extent) / grid_size
+    values = {}
+    features = []
+    for column, row, count in bins:
+        value_idx = values.setdefault(count, len(values))
+        px = int((column + 0.5) * scale)
+        py = int((row + 0.5) * scale)
+        feature = (_packed_field(2, [0, value_idx]) +
+                   _field(3, 0) + _varint(1) +
+                   _packed_field(4, [9, _zigzag(px), _zigzag(py)]))
+        features.append(_bytes_field(2, feature))
+
+    layer = [_field(15, 0) + _varint(2),
+             _bytes_field(1, layer_name)]
+    layer.extend(features)
+    layer.append(_bytes_field(3, 'count'))
+    for count, _ in sorted(values.items(), key=lambda v: v[1]):
+        layer.append(_bytes_field(4, _field(5, 0) + _varint(count)))
+    layer.append(_field(5, 0) + _varint(extent))
+    return _bytes_field(3, ''.join(layer))
+
+
+# Tile cache ===================================================================
+class TileCache(object):
+    '''Directory of encoded tiles for each survey and time window. Each window keeps
+       the latest coordinate id its tiles include so they can be discarded once
+       newer coordinates fall within the window.'''
+    def __init__(self, folder):
+        self.folder = folder
+
+    def window_path(self, survey_id, window_key):
+        return os.path.join(self.folder, str(survey_id), window_key)
+
+    def path(self, survey_id, window_key, z, x, y):
+        return os.path.join(self.window_path(survey_id, window_key), str(z), str(x), '{}.mvt'.format(y))
+
+    def read(self, survey_id, window_key, z, x, y):
+        try:
+            with open(self.path(survey_id, window_key, z, x, y), 'rb') as tile_f:
+                return tile_f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def write(self, survey_id, window_key, z, x, y, tile):
+        path = self.path(survey_id, window_key, z, x, y)
+        _makedirs(os.path.dirname(path))
+        part_path = '{}.{}.part'.format(path, os.getpid())
+        with open(part_path, 'wb') as tile_f:
+            tile_f.write(tile)
+        os.rename(part_path, path)
+
+    # the latest coordinate id of a window's tiles, None for a new window
+    def watermark(self, survey_id, window_key):
+        try:
+            with open(os.path.join(self.window_path(survey_id, window_key), 'watermark')) as watermark_f:
+                return int(watermark_f.read())
+        except (IOError, ValueError):
+            return None
+
+    def set_watermark(self, survey_id, window_key, watermark):
+        window_path = self.window_path(survey_id, window_key)
+        _makedirs(window_path)
+        part_path = os.path.join(window_path, 'watermark.{}.part'.format(os.getpid()))
+        with open(part_path, 'w') as watermark_f:
+            watermark_f.write(str(watermark or 0))
+        os.rename(part_path, os.path.join(window_path, 'watermark'))
+
+    def invalidate(self, survey_id, window_key):
+        shutil.rmtree(self.window_path(survey_id, window_key), ignore_errors=True)
+
+    # remove the windows of all surveys whose watermark was last set or checked longer
+    # than the maximum age ago
+    def evict(self, max_age):
+        removed = []
+        now = time.time()
+        if not os.path.isdir(self.folder):
+            return removed
+        for survey_dir in os.listdir(self.folder):
+            survey_path = os.path.join(self.folder, survey_dir)
+            if not os.path.isdir(survey_path):
+                continue
+            for window_key in os.listdir(survey_path):
+                try:
+                    checked = os.path.getmtime(os.path.join(survey_path, window_key, 'watermark'))
+                except OSError:
+                    continue
+                if now - checked > max_age:
+                    shutil.rmtree(os.path.join(survey_path, window_key), ignore_errors=True)
+                    removed.append(os.path.join(survey_dir, window_key))
+        return removed
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
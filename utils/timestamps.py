@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+#
+# Utils: fast formatting of timezone-aware timestamps for export sheets
+from datetime import date, datetime
+
+import pytz
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+SECONDS_PER_DAY = 86400
+# bound on the cached day strings, several years of days for one export
+MAX_CACHED_DAYS = 10000
+# ' HH:MM:' for each minute of the day and 'SS' for each second of the minute
+MINUTE_STRINGS = tuple(' %02d:%02d:' % divmod(minute, 60) for minute in range(1440))
+SECOND_STRINGS = tuple('%02d' % second for second in range(60))
+
+_day_strings = {}
+
+
+# whole seconds since the epoch rounded down; subtracting aware datetimes applies
+# each timestamp's UTC offset without converting it
+def _floor_seconds(timestamp):
+    delta = timestamp - EPOCH
+    return delta.days * SECONDS_PER_DAY + delta.seconds
+
+
+def _day_string(day):
+    day_str = _day_strings.get(day)
+    if day_str is None:
+        if len(_day_strings) >= MAX_CACHED_DAYS:
+            _day_strings.clear()
+        day_str = date.fromordinal(EPOCH_ORDINAL + day).strftime('%Y-%m-%d')
+        _day_strings[day] = day_str
+    return day_str
+
+
+# Formats a timestamp as 'YYYY-MM-DD HH:MM:SS' in UTC without microseconds
+def utc_timestamp(timestamp):
+    day, second = divmod(_floor_seconds(timestamp), SECONDS_PER_DAY)
+    minute, second = divmod(second, 60)
+    return _day_string(day) + MINUTE_STRINGS[minute] + SECOND_STRINGS[second]
+
+
+# Returns a timestamp's integer seconds since the epoch, truncated towards zero
+def epoch_timestamp(timestamp):
+    delta = timestamp - EPOCH
+    seconds = delta.days * SECONDS_PER_DAY + delta.seconds
+    if seconds < 0 and delta.microseconds:
+        seconds += 1
+    return seconds
+
+
+# Returns a timestamp as a naive UTC datetime
+def naive_utc(timestamp):
+    return timestamp.replace(tzinfo=None) - timestamp.utcoffset()
@@ -1,15 +1,22 @@
 #!/usr/bin/env python
 # Kyle Fitzsimmons, 2015
 import itertools
-import utm
-from .modules import labels, tools
-from .modules.trip_codes import trip_codes
+from .modules import labels, tools, vectorized
+from .modules.points import Point
+from .modules.stations import StationIndex
+from .modules.trip_codes import (NO_NOTE, COMPLETE_TRIP, COMPLETE_TRIP_METRO, MISSING_TRIP,
+                                 MISSING_TRIP_METRO, MISSING_TRIP_SHORT, SINGLE_POINT, METRO_TRANSFER,
+                                 COLD_START, MERGE_MISSING_TRIP_SHORT, MERGE_MISSING_TRIP_METRO,
+                                 MERGE_COLD_START, MERGE_MISSING_TRIP, merge_code_labels,
+                                 note_trip_codes)
+
+ENGINES = ('python', 'numpy')
 
 
 def filter_accuracy(points, cutoff=30):
     '''Filter out points with high reported horizontal accuracy values'''
     for p in points:
-        if p['h_accuracy'] <= cutoff:
+        if p.h_accuracy <= cutoff:
             yield p
 
 
@@ -29,16 +36,16 @@ def filter_errorneous_distance(points, check_speed=60):
             yield p
 
         # find the distance and time passed since last point collected
-        distance_from_last_point = tools.pythagoras((last_p['easting'], last_p['northing']),
-                                                    (p['easting'], p['northing']))
-        seconds_since_last_point = (p['timestamp'] - last_p['timestamp']).total_seconds()
+        distance_from_last_point = tools.pythagoras((last_p.easting, last_p.northing),
+                                                    (p.easting, p.northing))
+        seconds_since_last_point = (p.timestamp - last_p.timestamp).total_seconds()
 
         # toss the point if the speed is greater than `check_speed` and the distance between
         # the previous and next point is less than the distance from the last point to this one
         if distance_from_last_point and seconds_since_last_point:
             kph_since_last_point = (distance_from_last_point / seconds_since_last_point) * 3.6
-            distance_between_adjacent_points = tools.pythagoras((last_p['easting'], last_p['northing']),
-                                                                (next_p['easting'], next_p['northing']))
+            distance_between_adjacent_points = tools.pythagoras((last_p.easting, last_p.northing),
+                                                                (next_p.easting, next_p.northing))
             if (kph_since_last_point >= check_speed and 
                 distance_between_adjacent_points < distance_from_last_point):
                 continue
@@ -53,45 +60,58 @@ def break_by_timegap(points, timegap=360):
     trips = []
     group = 1
     for idx, row in enumerate(points):
-        dt = row['timestamp']
+        dt = row.timestamp
         if idx == 0:
             previous_row = row
             period = 0
         else:
-            period = int((dt - previous_row['timestamp']).total_seconds())
+            period = int((dt - previous_row.timestamp).total_seconds())
             if period > timegap:
                 group += 1
             previous_row = row
 
-        row['segment_group'] = group
-        row['break_period'] = period
-        row['note'] = ''
-        row['merge_codes'] = []
-        trips.append(dict(row))
+        # the first point is emitted twice by `filter_errorneous_distance`, keep the
+        # repeat as its own record so labels applied to one do not affect the other
+        if trips and trips[-1] is row:
+            row = row.copy()
+        row.segment_group = group
+        row.break_period = period
+        row.note = NO_NOTE
+        row.merge_codes = 0
+        trips.append(row)
 
     # group trips by segments in a lookup dictionary
     segment_groups = {}
     for t in trips:
-        segment_groups.setdefault(t['segment_group'], []).append(t)
+        segment_groups.setdefault(t.segment_group, []).append(t)
 
     return segment_groups
 
 
-def metro_stations_utm(metro_stations):
+def metro_stations_utm(metro_stations, zone_number=None):
     '''Get UTM coordinates for metro stations supplied by database lat/lngs'''
-    stations = []
-    for station in metro_stations:
-        northing, easting, _, _ = utm.from_latlon(station.latitude, station.longitude)
-        stations.append((northing, easting))
-    return stations
+    metro_stations = list(metro_stations)
+    eastings, northings, _ = tools.project_utm([s.latitude for s in metro_stations],
+                                               [s.longitude for s in metro_stations],
+                                               zone_number=zone_number)
+    return list(zip(eastings.tolist(), northings.tolist()))
+
+
+def station_index(metro_stations, zone_number=None):
+    '''Build a spatial index of the metro stations unless one is supplied; a supplied
+       index must be projected in the same UTM zone as the points'''
+    if isinstance(metro_stations, StationIndex):
+        return metro_stations
+    return StationIndex(metro_stations_utm(metro_stations, zone_number=zone_number),
+                        zone_number=zone_number)
 
 
 def metro_buffer(stations, point, distance):
     '''Return a boolean indicating whether a point is within a specified distance of
-       of a dictionary of metro stations'''
-    for station in stations:
-        if tools.pythagoras(station, point) <= distance:
-            return True, station
+       of an index of metro stations'''
+    station = stations.first_within(point, distance)
+    if station:
+        return True, station
     return False, None
 
 
@@ -112,8 +132,8 @@ def find_metro_transfers(stations, segment_groups, buffer_m):
     for pt in potential_transfers:
         seg1_num, seg2_num = pt
         segment1, segment2 = segment_groups[seg1_num], segment_groups[seg2_num]
-        segment1_end_p = (segment1[-1]['easting'], segment1[-1]['northing'])
-        segment2_start_p = (segment2[0]['easting'], segment2[0]['northing'])
+        segment1_end_p = (segment1[-1].easting, segment1[-1].northing)
+        segment2_start_p = (segment2[0].easting, segment2[0].northing)
 
         intersect1, station1 = metro_buffer(stations, segment1_end_p, buffer_m)
         intersect2, station2 = metro_buffer(stations, segment2_start_p, buffer_m)
@@ -122,7 +142,7 @@ def find_metro_transfers(stations, segment_groups, buffer_m):
         if intersect1 and intersect2 and station1 != station2:
             # test that metro trip does not take longer than 80 minutes between stops
             # and that the user is travelling at least 0.1m/s on average
-            interval = ((segment2[0]['timestamp'] - segment1[-1]['timestamp']).total_seconds())
+            interval = ((segment2[0].timestamp - segment1[-1].timestamp).total_seconds())
             distance = tools.pythagoras(segment1_end_p, segment2_start_p)
             segment_speed = distance / interval
             if interval < 4800 and segment_speed > 0.1:
@@ -148,7 +168,7 @@ def find_metro_transfers(stations, segment_groups, buffer_m):
         if num in transfer_end_ids:
             linked_trips[counter].extend(segments)
             for segment in linked_trips[counter]:
-                segment['note'] = 'trip with metro transfer'
+                segment.note = METRO_TRANSFER
         # otherwise create a new trip
         else:
             counter += 1
@@ -164,9 +184,9 @@ def connect_by_velocity(linked_trips):
             velocity_connections[num] = trip
             last_trip = trip
             continue
-        prev_pt = (last_trip[-1]['easting'], last_trip[-1]['northing'])
-        next_pt = (trip[0]['easting'], trip[0]['northing'])
-        period = int((trip[0]['timestamp'] - last_trip[-1]['timestamp']).total_seconds())
+        prev_pt = (last_trip[-1].easting, last_trip[-1].northing)
+        next_pt = (trip[0].easting, trip[0].northing)
+        period = int((trip[0].timestamp - last_trip[-1].timestamp).total_seconds())
         last_num = sorted(velocity_connections.keys())[-1]
         if tools.velocity_check(prev_pt, next_pt, period) is True:
             # label end and start points of segments before combining as a single trip
@@ -180,44 +200,47 @@ def connect_by_velocity(linked_trips):
 
 def filter_single_points(linked_trips):
     '''Detects single points and attaches to nearest to/from trip within 20 minute
-       time period and 150 meter radius'''
-
-    test_trips = tools.quick_deepcopy(linked_trips)
+       time period and 150 meter radius. Points are moved between the trip lists in
+       place; only the previous trip's final timestamp is kept aside since relabeling
+       a single point overwrites the value its neighbour is measured against.'''
     cleaned_trips = {}
     offset = 0
     max_time = 20
     max_dist = 150
-    for idx, (num, trip) in enumerate(test_trips.items()):
+    last_trip_end_timestamp = None
+    for idx, (num, trip) in enumerate(linked_trips.items()):
+        trip_end_timestamp = trip[-1].timestamp
+
         # check for single points that have been isolated from other segments and
         # calculate the time since the previous trips and until the next trip
         if (idx != 0) and (num + 1 in linked_trips) and (num - 1 in linked_trips) and (len(trip) == 1):
             # skip first and last points
             point = trip[0]
-            point['note'] = 'single point'
-            point_loc = (point['easting'], point['northing'])
-            point_dt = point['timestamp']
+            point.note = SINGLE_POINT
+            point_loc = (point.easting, point.northing)
+            point_dt = point.timestamp
 
-            last_trip_num = num - 1
-            last_trip_end = linked_trips[last_trip_num][-1]
-            last_trip_pt = (last_trip_end['easting'], last_trip_end['northing'])
+            last_trip_end = linked_trips[num - 1][-1]
+            last_trip_pt = (last_trip_end.easting, last_trip_end.northing)
             last_trip_dist = tools.pythagoras(last_trip_pt, point_loc)
 
             next_trip_num = num + 1
             next_trip_start = linked_trips[next_trip_num][0]
-            next_trip_pt = (next_trip_start['easting'], next_trip_start['northing'])
+            next_trip_pt = (next_trip_start.easting, next_trip_start.northing)
             next_trip_dist = tools.pythagoras(point_loc, next_trip_pt)
 
             if last_trip_dist <= next_trip_dist:
-                point['timestamp'] = last_trip_end['timestamp']
+                point.timestamp = last_trip_end_timestamp
                 labels.single_point(point, cleaned_trips[num - offset - 1], 'append')
                 cleaned_trips[num - offset - 1].append(point)
             else:
-                point['timestamp'] = next_trip_start['timestamp']
-                labels.single_point(point, test_trips[num + 1], 'insert')
-                test_trips[num + 1].insert(0, point)
+                point.timestamp = next_trip_start.timestamp
+                labels.single_point(point, linked_trips[num + 1], 'insert')
+                linked_trips[num + 1].insert(0, point)
             offset += 1
         else:
             cleaned_trips[num - offset] = trip
+        last_trip_end_timestamp = trip_end_timestamp
     return cleaned_trips
 
 
@@ -231,52 +254,47 @@ def infer_missing_trips(stations, linked_trips):
             prior_trip = trip
             continue
 
-        prior_point = (prior_trip[-1]['easting'], prior_trip[-1]['northing'])
-        first_point = (trip[0]['easting'], trip[0]['northing'])
+        prior_point = (prior_trip[-1].easting, prior_trip[-1].northing)
+        first_point = (trip[0].easting, trip[0].northing)
         spatial_gap = tools.pythagoras(prior_point, first_point)
-        prior_timestamp = prior_trip[-1]['timestamp']
-        timestamp = trip[0]['timestamp']
+        prior_timestamp = prior_trip[-1].timestamp
+        timestamp = trip[0].timestamp
         period = float((timestamp - prior_timestamp).seconds)
 
-        missing = {
-            'id': prior_trip[-1]['id'],
-            'latitude': prior_trip[-1]['latitude'],
-            'longitude': prior_trip[-1]['longitude'],
-            'easting': prior_trip[-1]['easting'],
-            'northing': prior_trip[-1]['northing'],
-            'h_accuracy': prior_trip[-1]['h_accuracy'],
-            'timestamp': prior_timestamp,
-            'next_time': timestamp,
-            'distance': spatial_gap,
-            'break_period': period,
-            'note': '',
-            'merge_codes': []
-        }
+        missing = Point(id=prior_trip[-1].id,
+                        latitude=prior_trip[-1].latitude,
+                        longitude=prior_trip[-1].longitude,
+                        easting=prior_trip[-1].easting,
+                        northing=prior_trip[-1].northing,
+                        h_accuracy=prior_trip[-1].h_accuracy,
+                        timestamp=prior_timestamp,
+                        next_time=timestamp,
+                        distance=spatial_gap,
+                        break_period=period)
 
         if spatial_gap < 250:
-            missing['note'] = 'missing trip - less than 250m'
-            missing['merge_codes'].append('missing trip - less than 250m')
+            missing.note = MISSING_TRIP_SHORT
+            missing.merge_codes |= MERGE_MISSING_TRIP_SHORT
             missing_trips[num] = missing
         else:
             # check for missing trips to/from a metro
             intersect1, station1 = metro_buffer(stations, prior_point, 300)
             intersect2, station2 = metro_buffer(stations, first_point, 300)
             if intersect1 and intersect2 and station1 != station2:
-                missing['note'] = 'missing trip - metro'
-                missing['merge_codes'].append('missing trip - metro')
+                missing.note = MISSING_TRIP_METRO
+                missing.merge_codes |= MERGE_MISSING_TRIP_METRO
                 missing_trips[num] = missing
 
             # next, check if missing trip is below the cold start threshold
             elif spatial_gap <= 750:
-                missing['note'] = 'cold start'
-                missing['prev_time'] = prior_timestamp
-                missing['timestamp'] = timestamp
-                missing['merge_codes'].append('cold start')
+                missing.note = COLD_START
+                missing.timestamp = timestamp
+                missing.merge_codes |= MERGE_COLD_START
                 trip.insert(0, missing)
             # if no criteria is match, mark as a vanilla missing trip
             else:
-                missing['note'] = 'missing trip'
-                missing['merge_codes'].append('missing trip')
+                missing.note = MISSING_TRIP
+                missing.merge_codes |= MERGE_MISSING_TRIP
                 missing_trips[num] = missing
         prior_trip = trip
     return missing_trips
@@ -289,55 +307,35 @@ def merge_trips(trips, missing_trips, stations):
     for idx, trip in trips.items():
         note = None
         if idx in missing_trips:
-            note = missing_trips[idx]['note']
-            p = {
-                'id': missing_trips[idx]['id'],
-                'latitude': missing_trips[idx]['latitude'],
-                'longitude': missing_trips[idx]['longitude'],
-                'easting': missing_trips[idx]['easting'],
-                'northing': missing_trips[idx]['northing'],
-                'h_accuracy': missing_trips[idx]['h_accuracy'],
-                'break_period': missing_trips[idx]['break_period'],
-                'dist_prev': missing_trips[idx]['distance'],
-                'trip_distance': '',
-                'segment': '',
-                'trip': idx + offset,
-                'timestamp': None,
-                'note': note,
-                'merge_codes': missing_trips[idx]['merge_codes'],
-            }
-
-            if note == 'missing trip - less than 250m':
-                p['timestamp'] = trip[0]['timestamp']
+            # the inferred missing trip point becomes the first output row
+            p = missing_trips[idx]
+            note = p.note
+            p.trip = idx + offset
+
+            if note == MISSING_TRIP_SHORT:
+                p.timestamp = trip[0].timestamp
                 rows.append(p)
             else:
-                p['timestamp'] = missing_trips[idx]['timestamp']
-                p['trip'] = idx + offset
                 rows.append(p)
 
-                p = {
-                    'id': missing_trips[idx]['id'],
-                    'latitude': trip[0]['latitude'],
-                    'longitude': trip[0]['longitude'],
-                    'easting': trip[0]['easting'],
-                    'northing': trip[0]['northing'],
-                    'h_accuracy': trip[0]['h_accuracy'],
-                    'break_period': missing_trips[idx]['break_period'],
-                    'dist_prev': missing_trips[idx]['distance'],
-                    'trip_distance': '',
-                    'segment': '',
-                    'trip': idx + offset,
-                    'timestamp': missing_trips[idx]['next_time'],
-                    'note': note,
-                    'merge_codes': trip[0]['merge_codes']
-                }
+                p = Point(id=p.id,
+                          latitude=trip[0].latitude,
+                          longitude=trip[0].longitude,
+                          easting=trip[0].easting,
+                          northing=trip[0].northing,
+                          h_accuracy=trip[0].h_accuracy,
+                          break_period=p.break_period,
+                          trip=idx + offset,
+                          timestamp=p.next_time,
+                          note=note,
+                          merge_codes=trip[0].merge_codes)
                 rows.append(p)
 
                 offset += 1
 
         # label complete trips segments
-        start_pt = (trip[0]['easting'], trip[0]['northing'])
-        end_pt = (trip[-1]['easting'], trip[-1]['northing'])
+        start_pt = (trip[0].easting, trip[0].northing)
+        end_pt = (trip[-1].easting, trip[-1].northing)
 
         intersect1, intersect2 = False, False
         station1, station2 = None, None
@@ -345,19 +343,20 @@ def merge_trips(trips, missing_trips, stations):
         intersect2, station2 = metro_buffer(stations, end_pt, 300)
 
         if (intersect1 and intersect2) and station1 != station2:
-            note = 'complete trip - metro'
+            note = COMPLETE_TRIP_METRO
         else:
-            note = 'complete trip'
+            note = COMPLETE_TRIP
 
         if len(trip) == 1:
-            note = 'single point'
+            note = SINGLE_POINT
 
+        # the trip's points are no longer needed by later stages so they become the
+        # output rows directly
         for point in trip:
-            p = point.copy()
-            p['trip'] = idx + offset
+            point.trip = idx + offset
             if note:
-                p['note'] = note
-            rows.append(p)
+                point.note = note
+            rows.append(point)
     return rows
 
 
@@ -368,114 +367,133 @@ def distance_speed(trip_group):
     # test for the specific case of a single point being attached to a
     # missing trip <250 m
     if len(trip_group) == 2:
-        notes = [p['note'] for p in trip_group]
-        if 'missing trip - less than 250m' in notes and 'single point' in notes:
+        notes = [p.note for p in trip_group]
+        if MISSING_TRIP_SHORT in notes and SINGLE_POINT in notes:
             for p in trip_group:
-                p['distance'], p['trip_distance'], p['avg_speed'] = 0, 0, 0
+                p.distance, p.trip_distance, p.avg_speed = 0, 0, 0
             return trip_group
 
     for idx, p in enumerate(trip_group):
-        point = (p['easting'], p['northing'])
+        point = (p.easting, p.northing)
         if idx == 0:
-            p['distance'], p['trip_distance'], p['avg_speed'] = 0, 0, 0
+            p.distance, p.trip_distance, p.avg_speed = 0, 0, 0
             last_point = point
         elif last_point:
-            p['distance'] = tools.pythagoras(last_point, point)
-            trip_distance += p['distance']
-            p['trip_distance'] = trip_distance
-            if p['break_period'] > 0:
-                p['avg_speed'] = p['distance'] / p['break_period']
+            p.distance = tools.pythagoras(last_point, point)
+            trip_distance += p.distance
+            p.trip_distance = trip_distance
+            if p.break_period > 0:
+                p.avg_speed = p.distance / p.break_period
             else:
-                p['avg_speed'] = trip_group[idx-1]['avg_speed']
-        if p['note'] != 'missing trip - less than 250m':
+                p.avg_speed = trip_group[idx-1].avg_speed
+        if p.note != MISSING_TRIP_SHORT:
             last_point = point
     return trip_group
 
 
 def labeling_hierarchy(labels):
-    if 'missing trip - less than 250m' in labels:
-        if 'complete trip - metro' in labels:
-            labels = ['complete trip - metro']
-        elif 'complete trip' in labels:
-            labels = ['complete trip']
-        elif 'single point' in labels:
-            labels = ['single point']
-    elif 'missing trip' in labels:
-        labels = ['missing trip']
-    elif 'missing trip - metro' in labels:
-        labels = ['missing trip - metro']
+    if MISSING_TRIP_SHORT in labels:
+        if COMPLETE_TRIP_METRO in labels:
+            labels = [COMPLETE_TRIP_METRO]
+        elif COMPLETE_TRIP in labels:
+            labels = [COMPLETE_TRIP]
+        elif SINGLE_POINT in labels:
+            labels = [SINGLE_POINT]
+    elif MISSING_TRIP in labels:
+        labels = [MISSING_TRIP]
+    elif MISSING_TRIP_METRO in labels:
+        labels = [MISSING_TRIP_METRO]
     return labels
 
 
-def summarize(rows):
-    '''Condense trip to information from first and last GPS point and add attribute information'''
-    # group points into dictionaries by trip id
+def group_by_trip(rows):
+    '''Group merged rows into lists of points by trip id'''
     trips, group, last_trip_id = {}, [], 1
     for row in rows:
-        trip_id = row['trip']
+        trip_id = row.trip
         if trip_id == last_trip_id:
             group.append(row)
         else:
             if group:
-                trips[last_trip_id] = distance_speed(group)
+                trips[last_trip_id] = group
                 group = [row]
             last_trip_id = trip_id
     if group:
-        trips[last_trip_id] = distance_speed(group)
+        trips[last_trip_id] = group
+    return trips
+
+
+def summarize(rows):
+    '''Condense trip to information from first and last GPS point and add attribute information'''
+    trips = group_by_trip(rows)
+    for num, trip in trips.items():
+        distance_speed(trip)
+    return label_trips(trips)
+
 
+def label_trips(trips):
+    '''Label each trip with its trip code and summarize its first and last GPS point;
+       the points' merge code flags are written out as their comma-separated labels'''
     summaries = {}
     for num, trip in trips.items():
-        labels = list(set([p['note'] for p in trip]))
+        labels = list(set([p.note for p in trip]))
         labels = labeling_hierarchy(labels)
         assert len(labels) == 1
-        c = trip_codes[labels[0]]
+        c = note_trip_codes[labels[0]]
 
         start_pt = trip[0]
         end_pt = trip[-1]
 
-        merge_codes = set()
+        merge_codes = 0
         for segment in trip:
-            for mcode in segment['merge_codes']:
-                merge_codes.add(mcode)
+            merge_codes |= segment.merge_codes
 
-        direct_distance = tools.pythagoras((start_pt['easting'], start_pt['northing']),
-                                           (end_pt['easting'], end_pt['northing']))
+        direct_distance = tools.pythagoras((start_pt.easting, start_pt.northing),
+                                           (end_pt.easting, end_pt.northing))
 
-        if end_pt['trip_distance'] > 250 and c == 103:
+        if end_pt.trip_distance > 250 and c == 103:
             c = 1
-        elif end_pt['trip_distance'] == 0:
+        elif end_pt.trip_distance == 0:
             c = 201
-        elif end_pt['trip_distance'] < 250:
+        elif end_pt.trip_distance < 250:
             c = 202
 
         outrow = {
-            'olat': start_pt['latitude'],
-            'olon': start_pt['longitude'],
-            'dlat': end_pt['latitude'],
-            'dlon': end_pt['longitude'],
+            'olat': start_pt.latitude,
+            'olon': start_pt.longitude,
+            'dlat': end_pt.latitude,
+            'dlon': end_pt.longitude,
             'trip_id': num,
             'trip_code': c,
-            'start': start_pt['timestamp'],
-            'end': end_pt['timestamp'],
+            'start': start_pt.timestamp,
+            'end': end_pt.timestamp,
             'direct_distance': direct_distance,
-            'cumulative_distance': end_pt['trip_distance'],
-            'merge_codes': ', '.join(merge_codes)
+            'cumulative_distance': end_pt.trip_distance,
+            'merge_codes': ', '.join(merge_code_labels(merge_codes))
         }
 
         summaries[num] = outrow
 
         for p in trip:
-            p['trip_code'] = c
+            p.trip_code = c
 
     return trips, summaries
 
 
 # @tools.timeit
-def run(parameters, metro_stations, points):
-    stations = metro_stations_utm(metro_stations)
-    points = tools.process_utm(points)
+def run(parameters, metro_stations, points, engine='python'):
+    '''Detect trips from a user's GPS points; the `numpy` engine runs the point-level
+       stages on columnar arrays and returns the same output as the `python` engine'''
+    if engine not in ENGINES:
+        raise ValueError('Unknown tripbreaker engine: {}'.format(engine))
+    if engine == 'numpy':
+        return run_vectorized(parameters, metro_stations, points)
+
+    points = tools.process_utm(points, zone_number=parameters.get('utm_zone'))
     if not points:
         return None, None
+    zone_number = parameters.get('utm_zone') or tools.utm_zone(points[0].latitude, points[0].longitude)
+    stations = station_index(metro_stations, zone_number=zone_number)
 
     high_accuracy_points = filter_accuracy(points, cutoff=parameters['accuracy_cutoff_meters'])
     cleaned_points = filter_errorneous_distance(high_accuracy_points, check_speed=60)
@@ -487,3 +505,21 @@ def run(parameters, metro_stations, points):
     rows = merge_trips(cleaned_trips, missing_trips, stations)
     trips, summaries = summarize(rows)
     return trips, summaries
+
+
+def run_vectorized(parameters, metro_stations, points):
+    points = vectorized.PointArrays.from_points(points, zone_number=parameters.get('utm_zone'))
+    if not len(points):
+        return None, None
+    stations = station_index(metro_stations, zone_number=points.zone_number)
+
+    high_accuracy_points = vectorized.filter_accuracy(points, cutoff=parameters['accuracy_cutoff_meters'])
+    cleaned_points = vectorized.filter_errorneous_distance(high_accuracy_points, check_speed=60)
+    segment_groups = vectorized.break_by_timegap(cleaned_points, timegap=parameters['break_interval_seconds'])
+    metro_linked_trips = find_metro_transfers(stations, segment_groups, buffer_m=parameters['subway_buffer_meters'])
+    velocity_connected_trips = connect_by_velocity(metro_linked_trips)
+    cleaned_trips = filter_single_points(velocity_connected_trips)
+    missing_trips = infer_missing_trips(stations, cleaned_trips)
+    rows = merge_trips(cleaned_trips, missing_trips, stations)
+    trips = vectorized.distance_speed(group_by_trip(rows))
+    return label_trips(trips)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+'''Tripbreaker benchmark suite: times and memory-profiles each stage of
+   `algorithm.run` on synthetic GPS traces and reports regressions against a
+   stored baseline:
+
+       python -m utils.tripbreaker.benchmark --sizes 1000 100000 1000000
+       python -m utils.tripbreaker.benchmark --engine numpy --save-baseline
+       python -m utils.tripbreaker.benchmark --compare-copying --sizes 100000
+
+   Each trace size is profiled in a fresh process. Memory is the growth of the
+   process' peak resident set while a stage runs, so a stage that stays below an
+   earlier peak reports 0.
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+try:
+    import _pickle as cPickle
+except ImportError:
+    import cPickle
+
+from utils.fake_data import generate_gps_trace, generate_subway_stations
+from . import algorithm
+from .modules import tools, vectorized
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DEFAULT_SIZES = [1000, 100000, 1000000]
+PARAMETERS = {
+    'break_interval_seconds': 360,
+    'subway_buffer_meters': 300,
+    'cold_start_distance_meters': 750,
+    'accuracy_cutoff_meters': 50
+}
+NUM_STATIONS = 68
+
+# regressions smaller than these absolute amounts are treated as noise
+MIN_SECONDS_CHANGE = 0.01
+MIN_MB_CHANGE = 2.
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def _materialized(stage):
+    def run_stage(*args, **kwargs):
+        return list(stage(*args, **kwargs))
+    return run_stage
+
+
+class StageProfiler(object):
+    '''Runs pipeline stages one at a time while recording their duration and the
+       growth in peak memory'''
+    def __init__(self):
+        self.stages = []
+
+    def __call__(self, name, stage, *args, **kwargs):
+        rss_before = _peak_rss_mb()
+        t0 = time.time()
+        result = stage(*args, **kwargs)
+        seconds = time.time() - t0
+        self.stages.append({
+            'stage': name,
+            'seconds': seconds,
+            'added_mb': _peak_rss_mb() - rss_before
+        })
+        return result
+
+
+def profile_python(profile, coordinates, metro_stations):
+    zone_number = tools.utm_zone(coordinates[0].latitude, coordinates[0].longitude)
+    stations = profile('station_index', algorithm.station_index, metro_stations, zone_number=zone_number)
+    points = profile('process_utm', tools.process_utm, coordinates, zone_number=zone_number)
+    points = profile('filter_accuracy', _materialized(algorithm.filter_accuracy),
+                     points, cutoff=PARAMETERS['accuracy_cutoff_meters'])
+    points = profile('filter_errorneous_distance', _materialized(algorithm.filter_errorneous_distance),
+                     points, check_speed=60)
+    segment_groups = profile('break_by_timegap', algorithm.break_by_timegap,
+                             points, timegap=PARAMETERS['break_interval_seconds'])
+    return _profile_trips(profile, stations, segment_groups, algorithm.summarize)
+
+
+def profile_numpy(profile, coordinates, metro_stations):
+    points = profile('process_utm', vectorized.PointArrays.from_points, coordinates)
+    stations = profile('station_index', algorithm.station_index, metro_stations,
+                       zone_number=points.zone_number)
+    points = profile('filter_accuracy', vectorized.filter_accuracy,
+                     points, cutoff=PARAMETERS['accuracy_cutoff_meters'])
+    points = profile('filter_errorneous_distance', vectorized.filter_errorneous_distance,
+                     points, check_speed=60)
+    segment_groups = profile('break_by_timegap', vectorized.break_by_timegap,
+                             points, timegap=PARAMETERS['break_interval_seconds'])
+
+    def summarize(rows):
+        return algorithm.label_trips(vectorized.distance_speed(algorithm.group_by_trip(rows)))
+    return _profile_trips(profile, stations, segment_groups, summarize)
+
+
+def _profile_trips(profile, stations, segment_groups, summarize):
+    linked_trips = profile('find_metro_transfers', algorithm.find_metro_transfers,
+                           stations, segment_groups, buffer_m=PARAMETERS['subway_buffer_meters'])
+    linked_trips = profile('connect_by_velocity', algorithm.connect_by_velocity, linked_trips)
+    cleaned_trips = profile('filter_single_points', algorithm.filter_single_points, linked_trips)
+    missing_trips = profile('infer_missing_trips', algorithm.infer_missing_trips, stations, cleaned_trips)
+    rows = profile('merge_trips', algorithm.merge_trips, cleaned_trips, missing_trips, stations)
+    return profile('summarize', summarize, rows)
+
+
+ENGINE_PROFILES = {
+    'python': profile_python,
+    'numpy': profile_numpy
+}
+
+
+def _trace(num_points, seed):
+    stations = generate_subway_stations(NUM_STATIONS, seed=seed)
+    return generate_gps_trace(num_points, seed=seed, stations=stations), stations
+
+
+def _profile_size(engine, num_points, seed, results):
+    coordinates, stations = _trace(num_points, seed)
+    profile = StageProfiler()
+    ENGINE_PROFILES[engine](profile, coordinates, stations)
+    profile.stages.append({
+        'stage': 'total',
+        'seconds': sum(s['seconds'] for s in profile.stages),
+        'added_mb': sum(s['added_mb'] for s in profile.stages)
+    })
+    results.put(profile.stages)
+
+
+def _in_process(target, *args):
+    '''Run a measurement in a fresh process so its peak resident memory is not
+       hidden by an earlier run'''
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=args + (results,))
+    process.start()
+    process.join()
+    if process.exitcode:
+        raise RuntimeError('Benchmark process exited with code {}'.format(process.exitcode))
+    return results.get()
+
+
+def profile_sizes(engine, sizes, seed=0):
+    return {str(num_points): _in_process(_profile_size, engine, num_points, seed)
+            for num_points in sizes}
+
+
+# Baselines and regression report ==============================================
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline_f:
+        return json.load(baseline_f)
+
+
+def save_baseline(path, engine, results):
+    baseline = load_baseline(path)
+    baseline.setdefault(engine, {}).update(results)
+    baseline['python_version'] = platform.python_version()
+    with open(path, 'w') as baseline_f:
+        json.dump(baseline, baseline_f, indent=2, sort_keys=True, separators=(',', ': '))
+
+
+def _is_regression(value, base, tolerance, min_change):
+    return value > base * (1. + tolerance) and value - base > min_change
+
+
+def report(engine, results, baseline, tolerance):
+    '''Print each stage against the baseline and return the number of regressions'''
+    regressions = 0
+    header = '{:>8} {:<27} {:>9} {:>9} {:>8} {:>9} {:>9}  {}'
+    row = '{:>8} {:<27} {:>9.3f} {:>9} {:>8} {:>9.1f} {:>9}  {}'
+    print(header.format('points', 'stage', 'seconds', 'baseline', 'change', 'added MB', 'baseline', ''))
+    for size in sorted(results, key=int):
+        base_stages = {s['stage']: s for s in baseline.get(engine, {}).get(size, [])}
+        for stage in results[size]:
+            base = base_stages.get(stage['stage'])
+            base_seconds, base_mb, change, flags = '', '', '', []
+            if base:
+                base_seconds = '{:.3f}'.format(base['seconds'])
+                base_mb = '{:.1f}'.format(base['added_mb'])
+                if base['seconds']:
+                    change = '{:+.0%}'.format(stage['seconds'] / base['seconds'] - 1.)
+                if _is_regression(stage['seconds'], base['seconds'], tolerance, MIN_SECONDS_CHANGE):
+                    flags.append('SLOWER')
+                if _is_regression(stage['added_mb'], base['added_mb'], tolerance, MIN_MB_CHANGE):
+                    flags.append('MORE MEMORY')
+            regressions += len(flags)
+            print(row.format(size, stage['stage'], stage['seconds'], base_seconds, change,
+                             stage['added_mb'], base_mb, ', '.join(flags)))
+    return regressions
+
+
+# Copying comparison ===========================================================
+# time and memory of the trip linking stages that once deep-copied every point
+# compared against that previous copying behaviour
+def _linked_trips(num_points, seed):
+    coordinates, metro_stations = _trace(num_points, seed)
+    zone_number = tools.utm_zone(coordinates[0].latitude, coordinates[0].longitude)
+    stations = algorithm.station_index(metro_stations, zone_number=zone_number)
+    points = tools.process_utm(coordinates, zone_number=zone_number)
+    points = algorithm.filter_accuracy(points, cutoff=PARAMETERS['accuracy_cutoff_meters'])
+    points = algorithm.filter_errorneous_distance(points, check_speed=60)
+    segment_groups = algorithm.break_by_timegap(points, timegap=PARAMETERS['break_interval_seconds'])
+    linked_trips = algorithm.find_metro_transfers(stations, segment_groups,
+                                                  buffer_m=PARAMETERS['subway_buffer_meters'])
+    return stations, algorithm.connect_by_velocity(linked_trips)
+
+
+def _copy_free(stations, linked_trips):
+    cleaned_trips = algorithm.filter_single_points(linked_trips)
+    missing_trips = algorithm.infer_missing_trips(stations, cleaned_trips)
+    return algorithm.merge_trips(cleaned_trips, missing_trips, stations)
+
+
+def _copying(stations, linked_trips):
+    # previous behaviour: the linked trips were pickled and unpickled before filtering
+    # single points and each point was copied again as it was merged into the rows
+    linked_trips = cPickle.loads(cPickle.dumps(linked_trips, -1))
+    cleaned_trips = algorithm.filter_single_points(linked_trips)
+    missing_trips = algorithm.infer_missing_trips(stations, cleaned_trips)
+    rows = algorithm.merge_trips(cleaned_trips, missing_trips, stations)
+    return [p.copy() for p in rows]
+
+
+def _measure_copying(variant, num_points, seed, results):
+    stations, linked_trips = _linked_trips(num_points, seed)
+    profile = StageProfiler()
+    rows = profile(variant.__name__, variant, stations, linked_trips)
+    results.put((profile.stages[0], len(rows)))
+
+
+def compare_copying(sizes, seed=0):
+    print('{:>8} {:<10} {:>10} {:>10} {:>10}'.format('points', 'variant', 'seconds', 'added MB', 'rows'))
+    for num_points in sizes:
+        for name, variant in (('copying', _copying), ('copy-free', _copy_free)):
+            stage, num_rows = _in_process(_measure_copying, variant, num_points, seed)
+            print('{:>8} {:<10} {:>10.3f} {:>10.1f} {:>10}'.format(num_points, name, stage['seconds'],
+                                                                   stage['added_mb'], num_rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--engine', choices=algorithm.ENGINES, default='python')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the baseline for the engine and sizes run')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='fractional slowdown or memory growth reported as a regression')
+    parser.add_argument('--compare-copying', action='store_true',
+                        help='compare the single point and merge stages with the former deep copies')
+    args = parser.parse_args()
+
+    if args.compare_copying:
+        compare_copying(args.sizes, seed=args.seed)
+        return
+
+    results = profile_sizes(args.engine, args.sizes, seed=args.seed)
+    regressions = report(args.engine, results, load_baseline(args.baseline), args.tolerance)
+    if args.save_baseline:
+        save_baseline(args.baseline, args.engine, results)
+        print('Saved baseline to {}'.format(args.baseline))
+    elif regressions:
+        print('{} regression(s) against {}'.format(regressions, args.baseline))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+'''Compact record for the GPS points passed between tripbreaker stages'''
+from .trip_codes import NO_NOTE, notes, merge_code_labels
+
+
+class Point(object):
+    '''GPS point with a fixed set of attributes instead of a per-point dict. The
+       `note` is a code from `trip_codes.notes` and `merge_codes` is a bitmask of
+       `trip_codes.merge_codes` flags, so labels are only turned into strings when
+       they are written out.'''
+    __slots__ = ('id', 'timestamp', 'latitude', 'longitude', 'easting', 'northing',
+                 'h_accuracy', 'p_accuracy', 'segment_group', 'break_period', 'note',
+                 'merge_codes', 'trip', 'trip_code', 'distance', 'trip_distance',
+                 'avg_speed', 'next_time')
+
+    def __init__(self, id=None, timestamp=None, latitude=None, longitude=None, easting=None,
+                 northing=None, h_accuracy=None, p_accuracy=None, segment_group=None,
+                 break_period=None, note=NO_NOTE, merge_codes=0, trip=None, trip_code=None,
+                 distance=None, trip_distance=None, avg_speed=None, next_time=None):
+        self.id = id
+        self.timestamp = timestamp
+        self.latitude = latitude
+        self.longitude = longitude
+        self.easting = easting
+        self.northing = northing
+        self.h_accuracy = h_accuracy
+        self.p_accuracy = p_accuracy
+        self.segment_group = segment_group
+        self.break_period = break_period
+        self.note = note
+        self.merge_codes = merge_codes
+        self.trip = trip
+        self.trip_code = trip_code
+        self.distance = distance
+        self.trip_distance = trip_distance
+        self.avg_speed = avg_speed
+        self.next_time = next_time
+
+    def copy(self):
+        return Point(**{attr: getattr(self, attr) for attr in self.__slots__})
+
+    @property
+    def note_label(self):
+        return notes[self.note]
+
+    @property
+    def merge_code_labels(self):
+        return merge_code_labels(self.merge_codes)
+
+    def __eq__(self, other):
+        if not isinstance(other, Point):
+            return NotImplemented
+        return all(getattr(self, attr) == getattr(other, attr) for attr in self.__slots__)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Point(id={}, timestamp={}, trip={}, note={!r})'.format(self.id, self.timestamp,
+                                                                      self.trip, self.note_label)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+'''Uniform grid index over UTM subway station coordinates for radius queries'''
+import math
+
+from . import tools
+
+
+class StationIndex(object):
+    '''Buckets stations into square grid cells so a radius query only tests the
+       stations in the cells overlapping the query's bounding box. Stations keep
+       their original list order so results match a linear scan.'''
+    def __init__(self, stations, zone_number=None, cell_size=500.):
+        self.stations = list(stations)
+        self.zone_number = zone_number
+        self.cell_size = float(cell_size)
+        self.cells = {}
+        for idx, (easting, northing) in enumerate(self.stations):
+            self.cells.setdefault(self._cell(easting, northing), []).append(idx)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def _cell(self, easting, northing):
+        return (int(math.floor(easting / self.cell_size)),
+                int(math.floor(northing / self.cell_size)))
+
+    def _candidates(self, point, distance):
+        min_x, min_y = self._cell(point[0] - distance, point[1] - distance)
+        max_x, max_y = self._cell(point[0] + distance, point[1] + distance)
+
+        # walk the occupied cells instead when the query covers more cells than exist
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > len(self.cells):
+            for (x, y), indices in self.cells.items():
+                if min_x <= x <= max_x and min_y <= y <= max_y:
+                    for idx in indices:
+                        yield idx
+            return
+
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                for idx in self.cells.get((x, y), ()):
+                    yield idx
+
+    def query_radius(self, point, distance):
+        '''Return the indices of stations within `distance` meters of a UTM point in list order'''
+        return sorted(idx for idx in self._candidates(point, distance)
+                      if tools.pythagoras(self.stations[idx], point) <= distance)
+
+    def first_within(self, point, distance):
+        '''Return the first station in list order within `distance` meters of a UTM point'''
+        found = self.query_radius(point, distance)
+        if found:
+            return self.stations[found[0]]
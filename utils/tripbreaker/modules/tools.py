@@ -1,38 +1,89 @@
 #!/usr/bin/env python
 # Kyle Fitzsimmons, 2016
 import math
+import numpy as np
 import time
 import utm
+from utm.conversion import E, E_P2, K0, M1, M2, M3, M4, R
 
-# python 2+3 cpickle import
-try:
-    import _pickle as cPickle
-except ImportError:
-    import cPickle
+from .points import Point
 
 
-def process_utm(points):
-    '''Convert WGS84 lat/lon points to UTM for performing spatial queries'''
-    processed = []
+def utm_zone(latitude, longitude):
+    '''Return the UTM zone number containing a WGS84 lat/lon point'''
+    return utm.latlon_to_zone_number(float(latitude), float(longitude))
 
-    for p in points:
-        easting, northing, _, _ = utm.from_latlon(p.latitude, p.longitude)
-        processed.append({
-            'id': p.id,
-            'timestamp': p.timestamp,
-            'latitude': p.latitude,
-            'longitude': p.longitude,
-            'easting': easting,
-            'northing': northing,
-            'h_accuracy': p.h_accuracy,
-            'p_accuracy': p.v_accuracy
-        })
-    return processed
 
+def project_utm(latitudes, longitudes, zone_number=None):
+    '''Convert arrays of WGS84 lat/lon points to UTM eastings and northings in a single
+       call. All points are projected within one zone, taken from the first point when
+       not given, and each point matches `utm.from_latlon` with the zone forced.'''
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if not len(latitudes):
+        return np.empty(0), np.empty(0), zone_number
+    if np.any((latitudes < -80.) | (latitudes > 84.)):
+        raise utm.error.OutOfRangeError('latitude out of range (must be between 80 deg S and 84 deg N)')
+    if np.any((longitudes < -180.) | (longitudes > 180.)):
+        raise utm.error.OutOfRangeError('longitude out of range (must be between 180 deg W and 180 deg E)')
+    if zone_number is None:
+        zone_number = utm_zone(latitudes[0], longitudes[0])
+
+    lat_rad = np.radians(latitudes)
+    lat_sin = np.sin(lat_rad)
+    lat_cos = np.cos(lat_rad)
+
+    lat_tan = lat_sin / lat_cos
+    lat_tan2 = lat_tan * lat_tan
+    lat_tan4 = lat_tan2 * lat_tan2
+
+    lon_rad = np.radians(longitudes)
+    central_lon_rad = math.radians(utm.conversion.zone_number_to_central_longitude(zone_number))
+
+    # squares go through `pow` as with the scalar `**` operator in `utm`
+    n = R / np.sqrt(1 - E * np.power(lat_sin, 2.))
+    c = E_P2 * np.power(lat_cos, 2.)
+
+    a = lat_cos * (lon_rad - central_lon_rad)
+    a2 = a * a
+    a3 = a2 * a
+    a4 = a3 * a
+    a5 = a4 * a
+    a6 = a5 * a
 
-# hackish way to copy a dictionary faster than deepcopy
-def quick_deepcopy(dictionary):
-    return cPickle.loads(cPickle.dumps(dictionary, -1))
+    m = R * (M1 * lat_rad -
+             M2 * np.sin(2 * lat_rad) +
+             M3 * np.sin(4 * lat_rad) -
+             M4 * np.sin(6 * lat_rad))
+
+    easting = K0 * n * (a +
+                        a3 / 6 * (1 - lat_tan2 + c) +
+                        a5 / 120 * (5 - 18 * lat_tan2 + lat_tan4 + 72 * c - 58 * E_P2)) + 500000
+
+    northing = K0 * (m + n * lat_tan * (a2 / 2 +
+                                        a4 / 24 * (5 - lat_tan2 + 9 * c + 4 * np.power(c, 2.)) +
+                                        a6 / 720 * (61 - 58 * lat_tan2 + lat_tan4 + 600 * c - 330 * E_P2)))
+    northing[latitudes < 0] += 10000000
+    return easting, northing, zone_number
+
+
+def process_utm(points, zone_number=None):
+    '''Convert WGS84 lat/lon points to UTM for performing spatial queries'''
+    points = list(points)
+    eastings, northings, _ = project_utm([p.latitude for p in points],
+                                         [p.longitude for p in points],
+                                         zone_number=zone_number)
+    processed = []
+    for p, easting, northing in zip(points, eastings.tolist(), northings.tolist()):
+        processed.append(Point(id=p.id,
+                               timestamp=p.timestamp,
+                               latitude=p.latitude,
+                               longitude=p.longitude,
+                               easting=easting,
+                               northing=northing,
+                               h_accuracy=p.h_accuracy,
+                               p_accuracy=p.v_accuracy))
+    return processed
 
 
 def pythagoras(point1, point2):
@@ -6,4 +6,45 @@ trip_codes = {
     'missing trip - less than 250m': 103,
     'distance too short': 201,
     'single point': 202
-}
\ No newline at end of file
+}
+
+# labels given to points by the tripbreaker stages; points store the integer code
+(NO_NOTE, COMPLETE_TRIP, COMPLETE_TRIP_METRO, MISSING_TRIP, MISSING_TRIP_METRO,
+ MISSING_TRIP_SHORT, SINGLE_POINT, METRO_TRANSFER, COLD_START) = range(9)
+notes = {
+    NO_NOTE: '',
+    COMPLETE_TRIP: 'complete trip',
+    COMPLETE_TRIP_METRO: 'complete trip - metro',
+    MISSING_TRIP: 'missing trip',
+    MISSING_TRIP_METRO: 'missing trip - metro',
+    MISSING_TRIP_SHORT: 'missing trip - less than 250m',
+    SINGLE_POINT: 'single point',
+    METRO_TRANSFER: 'trip with metro transfer',
+    COLD_START: 'cold start'
+}
+note_trip_codes = {code: trip_codes[label] for code, label in notes.items() if label in trip_codes}
+
+# reasons segments were merged into a trip; points store a bitmask of these flags
+MERGE_METRO = 1 << 0
+MERGE_VELOCITY = 1 << 1
+MERGE_SINGLE_POINT_BEFORE = 1 << 2
+MERGE_SINGLE_POINT_AFTER = 1 << 3
+MERGE_MISSING_TRIP_SHORT = 1 << 4
+MERGE_MISSING_TRIP_METRO = 1 << 5
+MERGE_COLD_START = 1 << 6
+MERGE_MISSING_TRIP = 1 << 7
+merge_codes = {
+    MERGE_METRO: 'metro',
+    MERGE_VELOCITY: 'velocity',
+    MERGE_SINGLE_POINT_BEFORE: 'single point - before',
+    MERGE_SINGLE_POINT_AFTER: 'single point - after',
+    MERGE_MISSING_TRIP_SHORT: 'missing trip - less than 250m',
+    MERGE_MISSING_TRIP_METRO: 'missing trip - metro',
+    MERGE_COLD_START: 'cold start',
+    MERGE_MISSING_TRIP: 'missing trip'
+}
+
+
+def merge_code_labels(flags):
+    '''Return the merge code strings set in a bitmask in flag order'''
+    return [merge_codes[flag] for flag in sorted(merge_codes) if flags & flag]
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# Kyle Fitzsimmons, 2018
+'''Columnar (NumPy) versions of the point-level tripbreaker stages. Each stage
+   reproduces the output of its counterpart in `algorithm.py` exactly.'''
+from datetime import datetime
+import numpy as np
+import pytz
+
+from . import tools
+from .points import Point
+from .trip_codes import MISSING_TRIP_SHORT, SINGLE_POINT
+
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
+
+def _epoch_microseconds(timestamp):
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+
+
+class PointArrays(object):
+    '''Columnar container for a user's GPS points; the projected coordinates and
+       epoch times used by the filters are float/int arrays while the database
+       values passed through to the output rows are kept as object arrays'''
+    fields = ('id', 'timestamp', 'latitude', 'longitude', 'h_accuracy',
+              'p_accuracy', 'easting', 'northing', 'epoch_us')
+
+    def __init__(self, **columns):
+        self.zone_number = None
+        for field in self.fields:
+            setattr(self, field, columns[field])
+
+    def __len__(self):
+        return len(self.epoch_us)
+
+    def take(self, indices):
+        points = PointArrays(**{field: getattr(self, field)[indices]
+                                for field in self.fields})
+        points.zone_number = self.zone_number
+        return points
+
+    @classmethod
+    def from_points(cls, points, zone_number=None):
+        columns = {field: [] for field in ('id', 'timestamp', 'latitude', 'longitude',
+                                           'h_accuracy', 'p_accuracy', 'epoch_us')}
+        for p in points:
+            columns['id'].append(p.id)
+            columns['timestamp'].append(p.timestamp)
+            columns['latitude'].append(p.latitude)
+            columns['longitude'].append(p.longitude)
+            columns['h_accuracy'].append(p.h_accuracy)
+            columns['p_accuracy'].append(p.v_accuracy)
+            columns['epoch_us'].append(_epoch_microseconds(p.timestamp))
+        return cls.from_columns(zone_number=zone_number, **columns)
+
+    @classmethod
+    def from_columns(cls, zone_number=None, **columns):
+        '''Build the arrays from equal-length sequences of each database field'''
+        arrays = {}
+        for field in ('id', 'timestamp', 'latitude', 'longitude', 'h_accuracy', 'p_accuracy'):
+            column = np.empty(len(columns[field]), dtype=object)
+            column[:] = columns[field]
+            arrays[field] = column
+        arrays['easting'], arrays['northing'], zone_number = tools.project_utm(columns['latitude'],
+                                                                              columns['longitude'],
+                                                                              zone_number=zone_number)
+        arrays['epoch_us'] = np.array(columns['epoch_us'], dtype=np.int64)
+        points = cls(**arrays)
+        points.zone_number = zone_number
+        return points
+
+
+def _distance(easting1, northing1, easting2, northing2):
+    '''Element-wise equivalent of `tools.pythagoras`; squares go through `pow` like
+       the scalar `**` operator so distances match to the last bit'''
+    a = easting2 - easting1
+    b = northing2 - northing1
+    return np.sqrt(np.power(a, 2.) + np.power(b, 2.))
+
+
+def filter_accuracy(points, cutoff=30):
+    '''Filter out points with high reported horizontal accuracy values; null
+       accuracies are kept as they are by the reference stage'''
+    accuracy = np.array(points.h_accuracy, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        return points.take(~(accuracy > cutoff))
+
+
+def filter_errorneous_distance(points, check_speed=60, max_passes=4):
+    '''Filter out points with unreasonably fast speeds where next point is closer
+       than erroneous point. Each decision depends on the last point kept, so the
+       rejection mask is re-evaluated until it settles. A pass settles every
+       decision up to and including the first one it changes, which is usually
+       enough within a handful of passes; a long run of rejected points settles
+       one point per pass, so after `max_passes` the rest is decided by a scalar
+       walk from the first unsettled point.
+
+       Mirrors the generator in `algorithm.py`, which emits the first point twice
+       and never emits the final point.'''
+    n = len(points)
+    if n < 2:
+        return points.take(np.array([], dtype=np.int64))
+
+    easting, northing, epoch_us = points.easting, points.northing, points.epoch_us
+
+    def _rejected(last_kept, current):
+        distance = _distance(easting[last_kept], northing[last_kept],
+                             easting[current], northing[current])
+        seconds = (epoch_us[current] - epoch_us[last_kept]) / 1e6
+        testable = (distance != 0) & (seconds != 0)
+        kph = np.zeros(np.shape(current))
+        kph[testable] = (distance[testable] / seconds[testable]) * 3.6
+        adjacent_distance = _distance(easting[last_kept], northing[last_kept],
+                                      easting[current + 1], northing[current + 1])
+        return testable & (kph >= check_speed) & (adjacent_distance < distance)
+
+    current = np.arange(1, n - 1)
+    indices = np.arange(n - 1)
+    kept = np.ones(n - 1, dtype=bool)
+    for _ in range(max_passes):
+        last_kept = np.maximum.accumulate(np.where(kept, indices, 0))[:-1]
+        updated = np.concatenate(([True], ~_rejected(last_kept, current)))
+        changed = np.flatnonzero(updated != kept)
+        kept = updated
+        if not len(changed):
+            break
+    else:
+        # decisions before the first change were already settled, so the changed
+        # decision is too; walk the remaining points from the last one kept
+        last = int(np.flatnonzero(kept[:changed[0] + 1])[-1])
+        for idx in range(changed[0] + 1, n - 1):
+            kept[idx] = not _rejected(np.array([last]), np.array([idx]))[0]
+            if kept[idx]:
+                last = idx
+    return points.take(np.concatenate(([0], np.flatnonzero(kept))))
+
+
+def break_by_timegap(points, timegap=360):
+    '''Break into trip segments when time recorded between points is
+       > timegap variable and group points by segment number in a dictionary'''
+    periods = np.zeros(len(points), dtype=np.int64)
+    periods[1:] = (np.diff(points.epoch_us) / 1e6).astype(np.int64)
+    groups = np.cumsum(periods > timegap) + 1
+
+    segment_groups = {}
+    columns = zip(points.id, points.timestamp, points.latitude, points.longitude,
+                  points.easting.tolist(), points.northing.tolist(),
+                  points.h_accuracy, points.p_accuracy,
+                  groups.tolist(), periods.tolist())
+    for (point_id, timestamp, latitude, longitude, easting, northing,
+         h_accuracy, p_accuracy, group, period) in columns:
+        segment_groups.setdefault(group, []).append(Point(id=point_id,
+                                                          timestamp=timestamp,
+                                                          latitude=latitude,
+                                                          longitude=longitude,
+                                                          easting=easting,
+                                                          northing=northing,
+                                                          h_accuracy=h_accuracy,
+                                                          p_accuracy=p_accuracy,
+                                                          segment_group=group,
+                                                          break_period=period))
+    return segment_groups
+
+
+def distance_speed(trips):
+    '''Calculate point distances, cumulative trip distances and average speeds for
+       every trip in a single pass over the merged rows'''
+    rows = [p for trip in trips.values() for p in trip]
+    if not rows:
+        return trips
+
+    sizes = np.array([len(trip) for trip in trips.values()])
+    starts = np.zeros(len(rows), dtype=bool)
+    starts[np.cumsum(sizes) - sizes] = True
+
+    easting = np.array([p.easting for p in rows], dtype=np.float64)
+    northing = np.array([p.northing for p in rows], dtype=np.float64)
+    break_period = np.array([p.break_period for p in rows], dtype=np.float64)
+    missing_short = np.array([p.note == MISSING_TRIP_SHORT for p in rows])
+
+    # missing trips < 250m do not become the reference for the next distance
+    indices = np.arange(len(rows))
+    anchors = np.maximum.accumulate(np.where(starts | ~missing_short, indices, 0))
+    previous = np.maximum(indices - 1, 0)
+    last_point = anchors[previous]
+    distance = _distance(easting[last_point], northing[last_point], easting, northing)
+    distance[starts] = 0.
+
+    trip_distance = np.concatenate([np.cumsum(d) for d in np.split(distance, np.cumsum(sizes)[:-1])])
+
+    # carry the previous average speed forward over points without a break period
+    moving = break_period > 0
+    avg_speed = np.zeros(len(rows))
+    avg_speed[moving] = distance[moving] / break_period[moving]
+    avg_speed[starts] = 0.
+    avg_speed = avg_speed[np.maximum.accumulate(np.where(starts | moving, indices, 0))]
+
+    distance, trip_distance, avg_speed = distance.tolist(), trip_distance.tolist(), avg_speed.tolist()
+    for idx, p in enumerate(rows):
+        if starts[idx]:
+            p.distance, p.trip_distance, p.avg_speed = 0, 0, 0
+        else:
+            p.distance, p.trip_distance, p.avg_speed = distance[idx], trip_distance[idx], avg_speed[idx]
+
+    # test for the specific case of a single point being attached to a
+    # missing trip <250 m
+    for trip in trips.values():
+        if len(trip) == 2:
+            notes = [p.note for p in trip]
+            if MISSING_TRIP_SHORT in notes and SINGLE_POINT in notes:
+                for p in trip:
+                    p.distance, p.trip_distance, p.avg_speed = 0, 0, 0
+    return trips